@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rest_social.settings')
 
-application = get_asgi_application()
+# as get_asgi_application(), but the handler serves the async views natively
+django.setup(set_prefix=False)
+
+from rest_social.social_app.handlers import AsyncHandler  # noqa: E402
+
+application = AsyncHandler()
@@ -45,6 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'rest_social.social_app.instrumentation.TimingMiddleware',
+    'rest_social.social_app.profiling.ProfilingMiddleware',
+    'rest_social.social_app.routers.ReadOnlyRequestMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,21 +79,115 @@ REST_FRAMEWORK = {
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
     'DEFAULT_PAGINATION_CLASS': 'rest_social.social_app.pagination.CustomPagination',
     'PAGE_SIZE': 10,
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_social.social_app.renderers.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Per-request timing: the Server-Timing header, a JSON log line per request (the logger
+# 'rest_social.social_app.instrumentation' at INFO) and the per-endpoint histograms of /metrics/,
+# which answers only to the `Authorization: Bearer <METRICS_TOKEN>` header (without the token it's switched off).
+# BUCKETS are the upper bounds of the latency buckets in ms
+INSTRUMENTATION = {
+    'SERVER_TIMING': os.getenv('SERVER_TIMING', '1') == '1',
+    'LOG': True,
+    'METRICS_TOKEN': os.getenv('METRICS_TOKEN'),
+    'BUCKETS': (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000),
+}
+
+# Profiling of single requests with cProfile: the requests with the `X-Profile: <TOKEN>` header and a SAMPLE_RATE
+# share of all the requests are profiled into DIRECTORY. Without a token and with the zero rate it's switched off
+PROFILING = {
+    'TOKEN': os.getenv('PROFILING_TOKEN'),
+    'SAMPLE_RATE': float(os.getenv('PROFILING_SAMPLE_RATE', 0)),
+    'DIRECTORY': os.getenv('PROFILING_DIRECTORY', os.path.join(BASE_DIR, 'profiles')),
+}
+
+# Email verification of the registration. MODE 'sync' verifies during the request (the user is created pending,
+# if the service is unavailable), MODE 'background' always creates a pending user, who is verified by a worker
+EMAIL_VERIFICATION = {
+    'BACKEND': os.getenv('EMAIL_VERIFICATION_BACKEND', 'rest_social.social_app.email_verification.HunterEmailVerifier'),
+    'OPTIONS': {'API_KEY': EMAIL_HUNTER_API_KEY},
+    'MODE': os.getenv('EMAIL_VERIFICATION_MODE', 'sync'),
+    'TIMEOUT': 3,
+    'CACHE_TTL': 24 * 60 * 60,
+    # circuit breaker
+    'FAILURE_THRESHOLD': 5,
+    'RECOVERY_TIMEOUT': 60,
+    # background worker
+    'WORKERS': 2,
+    'RETRIES': 3,
+    'RETRY_DELAY': 60,
+    'EAGER': False,
+}
+
+# Verified JWT payloads are cached per token; with CLAIMS_ONLY the user is built from the token claims
+# without the auth_user lookup (revoked tokens are still rejected by the per-user token version). The version
+# is kept in the 'default' cache for VERSION_TTL seconds then: a logout deletes it, but with a local cache
+# the other processes accept the revoked token until the TTL expires; 0 reads it by one query per request
+TOKEN_AUTH = {
+    'CACHE_SIZE': 1024,
+    'CACHE_TTL': 300,
+    'CLAIMS_ONLY': os.getenv('TOKEN_AUTH_CLAIMS_ONLY') == '1',
+    'VERSION_TTL': 30,
 }
 
 WSGI_APPLICATION = 'rest_social.wsgi.application'
 
+# ASGI deployment (asgi.py): the views of URLCONF are native async views, the rest of the requests run
+# on the pool of SYNC_WORKERS threads (set CONN_MAX_AGE, so the threads keep their database connections)
+ASYNC_VIEWS = {
+    'URLCONF': 'rest_social.social_app.async_urls',
+    'SYNC_WORKERS': int(os.getenv('ASYNC_SYNC_WORKERS', 16)),
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'ENGINE': 'rest_social.social_app.backends.sqlite3',
+        'NAME': os.getenv('SQLITE_PATH', os.path.join(BASE_DIR, 'db.sqlite3')),
     }
 }
 
+# DATABASE_PROFILE=production: WAL journal (the readers don't block the writer), persistent connections,
+# the write transactions take the lock at BEGIN and wait for it up to busy_timeout, and the read-only
+# 'replica' connection to the same file serves the reads of the safe requests (see social_app/routers.py)
+DATABASE_PROFILE = os.getenv('DATABASE_PROFILE', 'development')
+
+if DATABASE_PROFILE == 'production':
+    SQLITE_PRAGMAS = ('PRAGMA journal_mode = WAL; PRAGMA synchronous = NORMAL; PRAGMA busy_timeout = 5000; '
+                      'PRAGMA temp_store = MEMORY; PRAGMA cache_size = -20000')
+    DATABASES['default'].update(CONN_MAX_AGE=int(os.getenv('CONN_MAX_AGE', 600)),
+                                OPTIONS={'init_command': SQLITE_PRAGMAS, 'transaction_mode': 'IMMEDIATE'})
+    DATABASES['replica'] = dict(DATABASES['default'], TEST={'MIRROR': 'default'},
+                                OPTIONS={'init_command': SQLITE_PRAGMAS + '; PRAGMA query_only = ON'})
+
+DATABASE_ROUTERS = ['rest_social.social_app.routers.ReadWriteRouter']
+DATABASE_ROUTING = {
+    'PRIMARY': 'default',
+    'REPLICA': 'replica',
+}
+
+
+# Caches. 'posts' keeps the bodies of /post/<pk>/ by their change sequence numbers; a shared backend
+# (e.g. memcached) shares the bodies between the processes
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'default'),
+    },
+    'posts': {
+        'BACKEND': os.getenv('POST_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('POST_CACHE_LOCATION', 'posts'),
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -111,9 +208,56 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 PASSWORD_HASHERS = (
-    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'rest_social.social_app.hashing.PBKDF2PasswordHasher',
 )
 
+# PBKDF2 runs on a process pool of WORKERS processes (0 - in the request thread), at most QUEUE_DEPTH
+# requests wait for a worker, the rest are answered with 503
+PASSWORD_HASHING = {
+    'ITERATIONS': int(os.getenv('PASSWORD_ITERATIONS', 180000)),
+    'WORKERS': int(os.getenv('PASSWORD_HASHING_WORKERS', os.cpu_count() or 1)),
+    'QUEUE_DEPTH': 16,
+    'TIMEOUT': 10,
+    'START_METHOD': 'spawn',
+}
+
+# Write-behind of the like marks (social_app/like_buffer.py): the marks are buffered in the process and written
+# in one transaction every FLUSH_INTERVAL seconds (0 - only by the size) or at MAX_PENDING marks. Without
+# JOURNAL the pending marks are lost with the process; JOURNAL is a file of this process, which keeps them
+# (FSYNC syncs it per mark) and is replayed at the start. It's locked by its process, with several processes
+# put {pid} into the path (e.g. /var/lib/social/likes-{pid}.journal), the journals of the ended ones are replayed
+LIKE_BUFFER = {
+    'ENABLED': os.getenv('LIKE_BUFFER') == '1',
+    'FLUSH_INTERVAL': float(os.getenv('LIKE_BUFFER_FLUSH_INTERVAL', 0.5)),
+    'MAX_PENDING': int(os.getenv('LIKE_BUFFER_MAX_PENDING', 1000)),
+    'JOURNAL': os.getenv('LIKE_BUFFER_JOURNAL'),
+    'FSYNC': os.getenv('LIKE_BUFFER_FSYNC') == '1',
+}
+
+# Server-sent events of /events/ (social_app/events.py, ASGI only). BACKEND fans the events out: LocalBackend
+# within the process, DatabaseBackend through the social_app_event table for several processes (polled every
+# POLL_INTERVAL seconds, KEEP rows are kept). The last HISTORY events are kept for the resume by Last-Event-ID,
+# a connection buffers at most QUEUE_SIZE events and is closed, if its client doesn't read them
+EVENTS = {
+    'BACKEND': os.getenv('EVENTS_BACKEND', 'rest_social.social_app.events.LocalBackend'),
+    'HISTORY': int(os.getenv('EVENTS_HISTORY', 1000)),
+    'QUEUE_SIZE': int(os.getenv('EVENTS_QUEUE_SIZE', 100)),
+    'MAX_CONNECTIONS': int(os.getenv('EVENTS_MAX_CONNECTIONS', 10000)),
+    'HEARTBEAT': 15,
+    'RETRY': 3000,
+    'POLL_INTERVAL': float(os.getenv('EVENTS_POLL_INTERVAL', 0.5)),
+    'KEEP': 10000,
+}
+
+# Home timelines of /feed/ (social_app/feed.py): a new post is copied into the timelines of the author's followers,
+# unless the author has ever had more than FANOUT_LIMIT followers, then the posts are read at the feed time.
+# A timeline is trimmed to MAX_LENGTH newest entries, when it has grown by TRIM_EVERY more
+FEED = {
+    'FANOUT_LIMIT': int(os.getenv('FEED_FANOUT_LIMIT', 5000)),
+    'MAX_LENGTH': int(os.getenv('FEED_MAX_LENGTH', 800)),
+    'TRIM_EVERY': 50,
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.0/topics/i18n/
 
@@ -0,0 +1 @@
+default_app_config = 'rest_social.social_app.apps.SocialAppConfig'
@@ -2,4 +2,9 @@ from django.apps import AppConfig
 
 
 class SocialAppConfig(AppConfig):
-    name = 'social_app'
+    name = 'rest_social.social_app'
+    label = 'social_app'
+
+    def ready(self):
+        # connects the search indexing, event publishing and fan-out receivers
+        from . import events, feed, search
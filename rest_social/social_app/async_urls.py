@@ -0,0 +1,8 @@
+from django.urls import path
+from .async_views import events_view, register_user_view
+
+# Served natively by handlers.AsyncHandler under ASGI, the rest of the urls run on the sync pool
+urlpatterns = [
+    path('register/', register_user_view, name='register'),
+    path('events/', events_view, name='events'),
+]
@@ -0,0 +1,110 @@
+"""
+Native async views of the ASGI deployment (see handlers.AsyncHandler).
+
+Only the waits on the email service and on the password hashing pool are awaited in the event loop,
+the database work runs on the sync pool. The responses are the same as of the sync views.
+The event stream (/events/) waits for the events in the event loop, so an open stream holds no thread.
+"""
+import asyncio
+
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.views import status
+
+from .authentication import TokenAuthentication
+from .email_verification import DELIVERABLE, UNDELIVERABLE, averify_email, schedule_verification
+from .events import EventStreamResponse, event_stream, get_hub
+from .hashing import HashingUnavailable, ahash_password
+from .models import User
+from .serializers import UserSerializer
+from .sync_pool import run_sync
+
+
+PARSERS = (JSONParser(), FormParser(), MultiPartParser())
+
+
+def json_response(data, status_code, headers=None):
+    response = HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status_code)
+    for header, value in (headers or {}).items():
+        response[header] = value
+    return response
+
+
+def busy_response():
+    return json_response({'Error': 'Server is busy, try again later'}, status.HTTP_503_SERVICE_UNAVAILABLE,
+                         headers={'Retry-After': '1'})
+
+
+def create_user(validated_data, password, pending):
+    user = User.objects.create(username=validated_data['username'], password=password,
+                               email=validated_data['email'], is_active=not pending)
+    if pending:
+        schedule_verification(user.id)
+    return user
+
+
+async def register_user_view(request):
+    if request.method != 'POST':
+        return json_response({'detail': 'Method "{0}" not allowed.'.format(request.method)},
+                             status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        serialized = UserSerializer(data=Request(request, parsers=PARSERS).data,
+                                    context={'request': request, 'verify_email': False})
+        if await run_sync(serialized.is_valid):
+            # the email service is called only for otherwise valid registrations
+            verdict = serialized.email_verdict
+            if verdict is None:
+                verdict = await averify_email(serialized.validated_data['email'])
+
+            if verdict == UNDELIVERABLE:
+                data = {'email': 'Email is undeliverable'}
+                status_code = status.HTTP_400_BAD_REQUEST
+            else:
+                password = await ahash_password(serialized.validated_data['password'])
+                pending = verdict != DELIVERABLE
+                await run_sync(create_user, serialized.validated_data, password, pending)
+                data = {"Result": "User {0} was successfully added".format(serialized.validated_data['username'])}
+                if pending:
+                    data['Email'] = 'Email verification is pending'
+                status_code = status.HTTP_201_CREATED
+        else:
+            data = {key: str(value[0]) for key, value in serialized.errors.items()}
+            status_code = status.HTTP_400_BAD_REQUEST
+    except HashingUnavailable:
+        return busy_response()
+    except ParseError:
+        data = {'Error': 'Bad request'}
+        status_code = status.HTTP_400_BAD_REQUEST
+    except Exception as e:
+        data = {'Error': 'Ensure in the username, password and email existence \n' + str(e)}
+        status_code = status.HTTP_400_BAD_REQUEST
+    return json_response(data, status_code)
+
+
+async def events_view(request):
+    if request.method != 'GET':
+        return json_response({'detail': 'Method "{0}" not allowed.'.format(request.method)},
+                             status.HTTP_405_METHOD_NOT_ALLOWED)
+    # EventSource of the browsers can't send headers, so the token can be given as ?token=
+    if 'token' not in request.headers and 'token' in request.GET:
+        request.META['HTTP_TOKEN'] = request.GET['token']
+    try:
+        await run_sync(TokenAuthentication().authenticate, request)
+    except APIException as e:
+        return json_response({'detail': str(e.detail)}, status.HTTP_403_FORBIDDEN)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return json_response({'Error': 'Invalid Last-Event-ID'}, status.HTTP_400_BAD_REQUEST)
+
+    hub = get_hub()
+    await run_sync(hub.start)
+    subscriber, missed = hub.subscribe(asyncio.get_running_loop(), last_event_id)
+    if subscriber is None:
+        return busy_response()
+    return EventStreamResponse(event_stream(hub, subscriber, missed))
@@ -1,21 +1,134 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
 from rest_framework.authentication import BaseAuthentication
 from rest_framework import exceptions
 from rest_social.settings import SECRET_KEY
-from .models import User
+from .instrumentation import timed
+from .models import TokenVersion, User
 import jwt
 
 
+class TokenCache:
+    """
+    Bounded LRU cache of the verified token payloads, so the HMAC check runs once per token and TTL.
+    """
+    def __init__(self):
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, token):
+        with self._lock:
+            item = self._items.get(token)
+            if item is None:
+                return None
+            payload, expires = item
+            if expires < time.monotonic():
+                del self._items[token]
+                return None
+            self._items.move_to_end(token)
+            return payload
+
+    def set(self, token, payload, size, ttl):
+        if size <= 0:
+            return
+        with self._lock:
+            self._items[token] = (payload, time.monotonic() + ttl)
+            self._items.move_to_end(token)
+            while len(self._items) > size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+token_cache = TokenCache()
+
+TOKEN_VERSION_KEY = 'token-version:{0}'
+
+
+def get_token_version(user_id):
+    # the version is kept in the database, so a revocation is seen by every process at once
+    version = TokenVersion.objects.filter(user_id=user_id).values_list('version', flat=True).first()
+    return version or 0
+
+
+def cached_token_version(user_id, ttl):
+    # get_token_version() through the 'default' cache, so the claims-only requests don't query the database
+    if ttl <= 0:
+        return get_token_version(user_id)
+    key = TOKEN_VERSION_KEY.format(user_id)
+    version = caches['default'].get(key)
+    if version is None:
+        version = get_token_version(user_id)
+        caches['default'].set(key, version, ttl)
+    return version
+
+
+def invalidate_user_tokens(user):
+    # All tokens issued before for the user stop being accepted
+    key = TOKEN_VERSION_KEY.format(user.id)
+    with transaction.atomic():
+        TokenVersion.objects.get_or_create(user_id=user.id)
+        TokenVersion.objects.filter(user_id=user.id).update(version=F('version') + 1)
+        # deleted again after the commit, a request may have cached the old version in the meantime
+        caches['default'].delete(key)
+        transaction.on_commit(lambda: caches['default'].delete(key))
+
+
+def token_payload(user):
+    payload = {
+        'id': user.id,
+        'username': user.username
+    }
+    # tokens of the initial version don't carry it
+    version = get_token_version(user.id)
+    if version:
+        payload['ver'] = version
+    return payload
+
+
 class TokenAuthentication(BaseAuthentication):
+    @timed('auth')
     def authenticate(self, request):
-        if request.headers.get('token'):
-            payload = jwt.decode(bytes(request.headers.get('token'), 'utf-8'), SECRET_KEY)
+        token = request.headers.get('token')
+        if not token:
+            raise exceptions.NotAuthenticated()
+
+        options = settings.TOKEN_AUTH
+        payload = token_cache.get(token)
+        if payload is None:
             try:
-                user_id = payload['id']
-                username = payload['username']
-                user = User.objects.get(username=username, id=user_id)
-            except User.DoesNotExist:
+                payload = jwt.decode(bytes(token, 'utf-8'), SECRET_KEY, algorithms=['HS256'])
+            except jwt.InvalidTokenError:
+                raise exceptions.AuthenticationFailed()
+            if 'id' not in payload or 'username' not in payload:
                 raise exceptions.AuthenticationFailed()
+            token_cache.set(token, payload, options['CACHE_SIZE'], options['CACHE_TTL'])
+
+        if options['CLAIMS_ONLY']:
+            # trust the verified claims and skip the auth_user lookup, the token version is read from the cache
+            version = cached_token_version(payload['id'], options['VERSION_TTL'])
+            user = User(id=payload['id'], username=payload['username'])
+            user._state.adding = False
+            user._state.db = 'default'
         else:
-            raise exceptions.NotAuthenticated()
+            # the token version is read by the same query
+            versions = TokenVersion.objects.filter(user_id=OuterRef('id')).values('version')
+            try:
+                user = User.objects.annotate(token_version_number=Subquery(versions)) \
+                    .get(username=payload['username'], id=payload['id'])
+            except User.DoesNotExist:
+                raise exceptions.AuthenticationFailed()
+            version = user.token_version_number or 0
+
+        if payload.get('ver', 0) != version:
+            raise exceptions.AuthenticationFailed('Token was revoked')
 
-        return (user, None)
\ No newline at end of file
+        return (user, None)
@@ -0,0 +1,33 @@
+"""
+SQLite backend with the connection options of Django 5.1:
+
+- `init_command`: statements (e.g. pragmas) separated by ";", run on every new connection;
+- `transaction_mode`: "IMMEDIATE" takes the write lock at the start of the transaction, so under WAL
+  a writer waits for the busy timeout instead of failing with "database is locked" on upgrading its read lock.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    init_command = None
+    transaction_mode = None
+
+    def get_connection_params(self):
+        params = super(DatabaseWrapper, self).get_connection_params()
+        # they aren't arguments of sqlite3.connect()
+        self.init_command = params.pop('init_command', None)
+        self.transaction_mode = params.pop('transaction_mode', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super(DatabaseWrapper, self).get_new_connection(conn_params)
+        for statement in (self.init_command or '').split(';'):
+            if statement.strip():
+                conn.execute(statement)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode:
+            self.cursor().execute('BEGIN ' + self.transaction_mode)
+        else:
+            super(DatabaseWrapper, self)._start_transaction_under_autocommit()
@@ -0,0 +1,66 @@
+"""
+Conditional GET for the read endpoints.
+
+The validators are built from the database, so every process gives the same ones: a post is tagged by its
+change sequence number (Post.change_seq, see models.next_change_seq) and the list by the last number, which
+are read by the primary key and the (change_seq, id) index, and a 304 is answered before the page query and
+the serializers run. Last-Modified is the `updated` time. The pending marks of the like buffer are seen only
+in their process, so they are a part of the tags there. The deleted posts (there is no endpoint for them)
+don't change the list tag.
+"""
+import hashlib
+
+from django.db.models import Max
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from .like_buffer import get_buffer
+from .models import Post
+
+
+def _etag(*parts):
+    return quote_etag(hashlib.sha1(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest())
+
+
+def _to_timestamp(updated):
+    return int(updated.timestamp()) if updated else 0
+
+
+def post_validators(request, pk):
+    """
+    (etag, last modified, change_seq) of the post, change_seq is None if there is no post.
+    The viewer is a part of the tag, because the `like` field differs per viewer.
+    """
+    row = list(Post.objects.filter(pk=pk).order_by().values_list('change_seq', 'updated')[:1])
+    change_seq, updated = row[0] if row else (None, None)
+    buffer = get_buffer()
+    pending = (buffer.count_delta(pk), buffer.pending_state(request.user.id, pk)) if buffer is not None else ()
+    etag = _etag('post', pk, change_seq, *pending, request.user.id, request.query_params.get('fields', ''))
+    return etag, _to_timestamp(updated), change_seq
+
+
+def posts_validators(request):
+    # two aggregates, so each of them is one lookup of its index
+    change_seq = Post.objects.aggregate(change_seq=Max('change_seq'))['change_seq']
+    updated = Post.objects.aggregate(updated=Max('updated'))['updated']
+    buffer = get_buffer()
+    pending = (buffer.marks_tag(),) if buffer is not None else ()
+    etag = _etag('posts', change_seq, *pending, request.user.id, request.get_full_path())
+    return etag, _to_timestamp(updated)
+
+
+def conditional_response(request, etag, last_modified):
+    # Returns 304 (or 412), if the client's copy is still valid
+    response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # every poll has to be revalidated, and the copies of different users must not be mixed
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ('token',))
+    return response
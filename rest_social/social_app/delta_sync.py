@@ -0,0 +1,67 @@
+"""
+Delta sync of the posts (/posts/changes/).
+
+Every write, which changes a post visibly for the clients (the creation, an edit, a changed likes counter),
+gives the post the next number of the change sequence (Post.change_seq, see models.next_change_seq). The sync
+token is the (change_seq, id) key of the last returned post, so a refresh is one index range scan over the
+changes since the token, whatever the table size is. A post changed again moves after the token, so it's
+returned once per refresh with its current state.
+"""
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import binascii
+import json
+
+from django.db.models import Q
+
+from .models import Post
+
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def encode_token(position):
+    encoded = urlsafe_b64encode(json.dumps({'c': list(position)}, separators=(',', ':')).encode('ascii'))
+    return encoded.decode('ascii').rstrip('=')
+
+
+def decode_token(token):
+    # (change_seq, id) of the token, (0, 0) without it. Raises InvalidToken
+    if not token:
+        return 0, 0
+    try:
+        change_seq, post_id = json.loads(urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('ascii'))['c']
+        if not isinstance(change_seq, int) or not isinstance(post_id, int):
+            raise ValueError
+    except (TypeError, ValueError, KeyError, binascii.Error):
+        raise InvalidToken('Invalid sync token')
+    return change_seq, post_id
+
+
+def parse_limit(value):
+    # ?limit= is cut to MAX_LIMIT. Raises ValueError
+    limit = DEFAULT_LIMIT if value is None else int(value)
+    if limit < 1:
+        raise ValueError('limit has to be positive')
+    return min(limit, MAX_LIMIT)
+
+
+def changed_posts(position, columns, limit=DEFAULT_LIMIT, using='default'):
+    """
+    values() rows of the posts changed after the (change_seq, id) position in the change order, at most `limit`.
+    Returns (rows, token of the last row, whether more changes follow).
+    """
+    change_seq, post_id = position
+    posts = Post.objects.using(using).order_by('change_seq', 'id') \
+        .filter(Q(change_seq__gt=change_seq) | Q(change_seq=change_seq, id__gt=post_id), change_seq__gte=change_seq)
+    # one more row tells, whether the client has to ask again
+    rows = list(posts.values(*set(columns) | {'change_seq'})[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        position = (rows[-1]['change_seq'], rows[-1]['id'])
+    return rows, encode_token(position), more
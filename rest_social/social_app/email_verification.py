@@ -0,0 +1,287 @@
+"""
+Pluggable email verification for the registration.
+
+The configured backend is called with a strict timeout, verdicts are cached per email (and per domain, when
+the whole domain can't receive mail), and a circuit breaker stops calling an unavailable service.
+When the verdict can't be got, the email is verified later by the background worker.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Timer
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils.module_loading import import_string
+import requests
+
+from .instrumentation import timed
+from .models import User
+from .sync_pool import run_sync
+
+try:
+    import httpx
+except ImportError:
+    # the async check of emailhunter.co falls back to the sync client on the thread pool
+    httpx = None
+
+
+DELIVERABLE = 'deliverable'
+UNDELIVERABLE = 'undeliverable'
+UNKNOWN = 'unknown'
+
+EMAIL_CACHE_KEY = 'email-verdict:{0}'
+DOMAIN_CACHE_KEY = 'email-domain-verdict:{0}'
+
+logger = logging.getLogger(__name__)
+
+
+class EmailVerificationError(Exception):
+    # the service didn't give a verdict (timeout, bad response, etc.)
+    pass
+
+
+class BaseEmailVerifier:
+    def __init__(self, timeout, **options):
+        self.timeout = timeout
+
+    def check(self, email):
+        """
+        Returns (verdict, domain_wide) or raises EmailVerificationError.
+        domain_wide means, that the verdict is true for every email of the domain.
+        """
+        raise NotImplementedError
+
+    async def acheck(self, email):
+        # backends without an async client are run on the thread pool
+        return await run_sync(self.check, email)
+
+
+class HunterEmailVerifier(BaseEmailVerifier):
+    url = 'https://api.hunter.io/v1/verify'
+
+    def __init__(self, timeout, API_KEY=None, **options):
+        super(HunterEmailVerifier, self).__init__(timeout, **options)
+        self.api_key = API_KEY
+
+    def check(self, email):
+        try:
+            response = requests.get(self.url, params={'email': email, 'api_key': self.api_key}, timeout=self.timeout)
+            response = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise EmailVerificationError(str(e))
+        return self.verdict(response)
+
+    async def acheck(self, email):
+        if httpx is None:
+            return await super(HunterEmailVerifier, self).acheck(email)
+        try:
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                response = await client.get(self.url, params={'email': email, 'api_key': self.api_key})
+            response = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise EmailVerificationError(str(e))
+        return self.verdict(response)
+
+    @staticmethod
+    def verdict(response):
+        if response.get('status') == 'error':
+            return UNDELIVERABLE, False
+        if response.get('status') != 'success':
+            raise EmailVerificationError('Unexpected response status')
+        if response.get('mx_records') is False:
+            return UNDELIVERABLE, True
+        if response.get('result') == 'undeliverable':
+            return UNDELIVERABLE, False
+        return DELIVERABLE, False
+
+
+class FakeEmailVerifier(BaseEmailVerifier):
+    # Local backend for tests and development: nothing leaves the process.
+    # DELAY (seconds) simulates the latency of the service
+    def __init__(self, timeout, UNDELIVERABLE_DOMAINS=(), UNAVAILABLE_DOMAINS=(), DELAY=0, **options):
+        super(FakeEmailVerifier, self).__init__(timeout, **options)
+        self.undeliverable_domains = set(UNDELIVERABLE_DOMAINS)
+        self.unavailable_domains = set(UNAVAILABLE_DOMAINS)
+        self.delay = DELAY
+
+    def check(self, email):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.verdict(email)
+
+    async def acheck(self, email):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self.verdict(email)
+
+    def verdict(self, email):
+        domain = email_domain(email)
+        if domain in self.unavailable_domains:
+            raise EmailVerificationError('Service is unavailable')
+        if domain in self.undeliverable_domains:
+            return UNDELIVERABLE, True
+        return DELIVERABLE, False
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` failures in a row; while it's open, the service isn't called
+    until `recovery_timeout` seconds pass, then one trial call is let through.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def allow(self, recovery_timeout):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= recovery_timeout:
+                # half-open: the next failure opens the breaker again
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self, threshold):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= threshold:
+                self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker()
+
+
+def email_domain(email):
+    return email.rsplit('@', 1)[-1].lower()
+
+
+def get_verifier():
+    options = settings.EMAIL_VERIFICATION
+    return import_string(options['BACKEND'])(options['TIMEOUT'], **options.get('OPTIONS', {}))
+
+
+def cached_verdict(email):
+    verdict = cache.get(DOMAIN_CACHE_KEY.format(email_domain(email)))
+    if verdict is None:
+        verdict = cache.get(EMAIL_CACHE_KEY.format(email.lower()))
+    return verdict
+
+
+def verify_email(email):
+    """
+    Returns DELIVERABLE, UNDELIVERABLE or UNKNOWN (the email has to be verified later).
+    """
+    verdict = cached_verdict(email)
+    if verdict is not None:
+        return verdict
+
+    options = settings.EMAIL_VERIFICATION
+    if not breaker.allow(options['RECOVERY_TIMEOUT']):
+        return UNKNOWN
+
+    try:
+        with timed('email'):
+            verdict, domain_wide = get_verifier().check(email)
+    except EmailVerificationError as e:
+        logger.warning('Email verification failed: %s', e)
+        breaker.record_failure(options['FAILURE_THRESHOLD'])
+        return UNKNOWN
+
+    breaker.record_success()
+    store_verdict(email, verdict, domain_wide)
+    return verdict
+
+
+async def averify_email(email):
+    """
+    verify_email for the async endpoints: the service is awaited without holding a thread.
+    """
+    verdict = await run_sync(cached_verdict, email)
+    if verdict is not None:
+        return verdict
+
+    options = settings.EMAIL_VERIFICATION
+    if not breaker.allow(options['RECOVERY_TIMEOUT']):
+        return UNKNOWN
+
+    try:
+        with timed('email'):
+            verdict, domain_wide = await get_verifier().acheck(email)
+    except EmailVerificationError as e:
+        logger.warning('Email verification failed: %s', e)
+        breaker.record_failure(options['FAILURE_THRESHOLD'])
+        return UNKNOWN
+
+    breaker.record_success()
+    await run_sync(store_verdict, email, verdict, domain_wide)
+    return verdict
+
+
+def store_verdict(email, verdict, domain_wide):
+    key = DOMAIN_CACHE_KEY.format(email_domain(email)) if domain_wide else EMAIL_CACHE_KEY.format(email.lower())
+    cache.set(key, verdict, timeout=settings.EMAIL_VERIFICATION['CACHE_TTL'])
+
+
+_executor = None
+_executor_lock = Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.EMAIL_VERIFICATION['WORKERS'],
+                                           thread_name_prefix='email-verification')
+        return _executor
+
+
+def verify_pending_user(user_id, attempt=0):
+    """
+    Verifies the email of the pending (inactive) user: deliverable emails activate the user,
+    unavailable service reschedules the check, undeliverable emails leave the user inactive.
+    """
+    options = settings.EMAIL_VERIFICATION
+    user = User.objects.filter(id=user_id, is_active=False).first()
+    if user is None:
+        return
+
+    verdict = verify_email(user.email)
+    if verdict == DELIVERABLE:
+        User.objects.filter(id=user_id).update(is_active=True)
+    elif verdict == UNDELIVERABLE:
+        logger.info('Email of the user %s is undeliverable', user.username)
+    elif attempt < options['RETRIES'] and not options['EAGER']:
+        retry = Timer(options['RETRY_DELAY'], schedule_verification, args=(user_id, attempt + 1))
+        retry.daemon = True
+        retry.start()
+
+
+def _verify_in_worker(user_id, attempt):
+    try:
+        verify_pending_user(user_id, attempt)
+    except Exception:
+        logger.exception('Background email verification failed')
+    finally:
+        # the worker thread owns its own connection
+        connection.close()
+
+
+def schedule_verification(user_id, attempt=0):
+    if settings.EMAIL_VERIFICATION['EAGER']:
+        verify_pending_user(user_id, attempt)
+    else:
+        _get_executor().submit(_verify_in_worker, user_id, attempt)
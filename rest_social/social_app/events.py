@@ -0,0 +1,335 @@
+"""
+Server-sent events of the new posts and the changed likes counters (/events/, settings.EVENTS).
+
+The receivers of the post creation and of `likes_changed` publish the events after the commit to the hub of
+the process. The hub numbers them through the fan-out backend, keeps the last HISTORY ones and hands them to
+the connected streams:
+
+    id: 1718000000123
+    event: post                 {"id": .., "creator": .., "title": .., "date": .., "likes_count": 0}
+    event: likes                {"id": .., "likes_count": ..}
+    event: reset                the events since Last-Event-ID are lost, resync with /posts/changes/
+
+The frame of an event is encoded once for all the streams. Every stream has a queue of QUEUE_SIZE events,
+the publishers never wait for the clients: a stream, which falls behind, is closed, and its client reconnects
+with Last-Event-ID and gets the missed events from the history.
+
+LocalBackend numbers the events in the process (by the time in ms, so the numbers grow across the restarts).
+DatabaseBackend writes the events into the social_app_event table, the autoincrement id is the event id for
+every process, and each process with the streams polls the table.
+"""
+from collections import deque
+from threading import Lock, Thread
+import asyncio
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.http.response import HttpResponseBase
+from django.utils.module_loading import import_string
+from rest_framework.fields import DateTimeField
+
+from .models import Event, Post, likes_changed
+
+
+logger = logging.getLogger(__name__)
+
+
+def encode_frame(event_id, event_type, data):
+    # data is the JSON text of the event
+    return 'id: {0}\nevent: {1}\ndata: {2}\n\n'.format(event_id, event_type, data).encode('utf-8')
+
+
+class EventStreamResponse(HttpResponseBase):
+    """
+    text/event-stream of an async iterator of bytes, sent by handlers.AsyncHandler until the client disconnects.
+    """
+    streaming = True
+
+    def __init__(self, stream, *args, **kwargs):
+        kwargs.setdefault('content_type', 'text/event-stream')
+        super(EventStreamResponse, self).__init__(*args, **kwargs)
+        self.stream = stream
+        self['Cache-Control'] = 'no-cache'
+        # nginx would buffer the stream
+        self['X-Accel-Buffering'] = 'no'
+
+
+class Subscriber:
+    # the queue of one stream, filled in its event loop
+    def __init__(self, loop, size):
+        self.loop = loop
+        self.size = size
+        self.frames = deque()
+        self.overflowed = False
+        self.ready = asyncio.Event()
+
+    def put(self, frames):
+        if len(self.frames) + len(frames) > self.size:
+            self.overflowed = True
+        else:
+            self.frames.extend(frames)
+        self.ready.set()
+
+    async def get(self, timeout):
+        """
+        The queued frames, [] after `timeout` seconds without events, None if the stream fell behind.
+        """
+        if not self.frames and not self.overflowed:
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self.ready.clear()
+        if self.overflowed:
+            return None
+        frames = list(self.frames)
+        self.frames.clear()
+        return frames
+
+
+def put_all(subscribers, frames):
+    for subscriber in subscribers:
+        subscriber.put(frames)
+
+
+class LocalBackend:
+    # the events of one process
+    shared = False
+
+    def __init__(self, hub, options):
+        self.hub = hub
+        self._lock = Lock()
+        self._last_id = int(time.time() * 1000)
+
+    def start(self):
+        # the id, after which the events are known
+        return self._last_id
+
+    def publish(self, events):
+        with self._lock:
+            numbered = []
+            for event_type, data in events:
+                self._last_id = max(self._last_id + 1, int(time.time() * 1000))
+                numbered.append((self._last_id, event_type, data))
+            # delivered under the lock, so the streams get the events in the order of their ids
+            self.hub.deliver(numbered)
+
+    def stop(self):
+        pass
+
+
+class DatabaseBackend:
+    """
+    Fan-out through the social_app_event table. The ids are assigned by the insert under the database write lock,
+    so they grow in the commit order, and every process delivers the rows after the last seen id.
+    """
+    shared = True
+
+    def __init__(self, hub, options):
+        self.hub = hub
+        self.options = options
+        self._last_id = None
+        self._polls = 0
+        self._stopped = False
+
+    def start(self):
+        history = list(Event.objects.order_by('-id').values_list('id', 'type', 'data')[:self.options['HISTORY']])
+        history.reverse()
+        horizon = history[0][0] - 1 if history else 0
+        self._last_id = history[-1][0] if history else 0
+        self.hub.deliver(history)
+        if self.options['POLL_INTERVAL']:
+            Thread(target=self._run, name='events-poller', daemon=True).start()
+        return horizon
+
+    def publish(self, events):
+        Event.objects.bulk_create([Event(type=event_type, data=data) for event_type, data in events])
+
+    def poll(self):
+        # delivers the new rows, returns their number
+        rows = list(Event.objects.filter(id__gt=self._last_id).order_by('id').values_list('id', 'type', 'data')
+                    [:self.options['HISTORY']])
+        if rows:
+            self._last_id = rows[-1][0]
+            self.hub.deliver(rows)
+        self._polls += 1
+        if self._polls % 100 == 0:
+            Event.objects.filter(id__lte=self._last_id - self.options['KEEP']).delete()
+        return len(rows)
+
+    def _run(self):
+        while not self._stopped:
+            time.sleep(self.options['POLL_INTERVAL'])
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Events were not polled')
+                # the poller thread owns its own connection
+                connection.close()
+
+    def stop(self):
+        self._stopped = True
+
+
+class EventHub:
+    def __init__(self, options):
+        self.options = options
+        self.backend = import_string(options['BACKEND'])(self, options)
+        self._lock = Lock()
+        self._start_lock = Lock()
+        self._started = False
+        self._history = deque()
+        # the events up to the horizon are forgotten, the last id is the newest known event
+        self._horizon = self._last_id = None
+        # event loop -> its subscribers, one wakeup of a loop delivers to all its streams
+        self._subscribers = {}
+        self._connections = 0
+
+    @property
+    def active(self):
+        # the local events are kept only in the processes, which have ever served a stream
+        return self.backend.shared or self._started
+
+    def start(self):
+        with self._start_lock:
+            if not self._started:
+                horizon = self.backend.start()
+                with self._lock:
+                    self._horizon = horizon
+                    if self._last_id is None:
+                        self._last_id = horizon
+                self._started = True
+
+    def publish(self, events):
+        # [(type, data)]
+        if self.active and events:
+            self.backend.publish([(event_type, json.dumps(data, separators=(',', ':')))
+                                  for event_type, data in events])
+
+    def deliver(self, events):
+        # [(id, type, JSON data)] of the backend, in the order of the ids
+        if not events:
+            return
+        frames = [encode_frame(*event) for event in events]
+        with self._lock:
+            for (event_id, _, _), frame in zip(events, frames):
+                self._history.append((event_id, frame))
+                self._last_id = event_id
+            while len(self._history) > self.options['HISTORY']:
+                self._horizon = self._history.popleft()[0]
+            for loop, subscribers in self._subscribers.items():
+                try:
+                    loop.call_soon_threadsafe(put_all, tuple(subscribers), frames)
+                except RuntimeError:
+                    # the loop is closed, its streams are being dropped
+                    pass
+
+    def subscribe(self, loop, last_event_id=None):
+        """
+        Returns the subscriber and the frames after last_event_id, or the reset frame, if they are lost (or unknown).
+        The subscriber is None, if MAX_CONNECTIONS streams are open.
+        """
+        with self._lock:
+            if self._connections >= self.options['MAX_CONNECTIONS']:
+                return None, None
+            subscriber = Subscriber(loop, self.options['QUEUE_SIZE'])
+            self._subscribers.setdefault(loop, set()).add(subscriber)
+            self._connections += 1
+            if last_event_id is None:
+                missed = []
+            elif last_event_id < self._horizon or last_event_id > self._last_id:
+                # the client continues from the current position after the resync
+                missed = [encode_frame(self._last_id, 'reset', '{}')]
+            else:
+                missed = [frame for event_id, frame in self._history if event_id > last_event_id]
+        return subscriber, missed
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.loop, ())
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+                self._connections -= 1
+                if not subscribers:
+                    del self._subscribers[subscriber.loop]
+
+    def connections(self):
+        with self._lock:
+            return self._connections
+
+    def stop(self):
+        self.backend.stop()
+
+
+_hub = None
+_hub_lock = Lock()
+
+
+def get_hub():
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = EventHub(settings.EVENTS)
+        return _hub
+
+
+@receiver(setting_changed)
+def reset_hub(**kwargs):
+    global _hub
+    if kwargs['setting'] == 'EVENTS':
+        with _hub_lock:
+            hub, _hub = _hub, None
+        if hub is not None:
+            hub.stop()
+
+
+async def event_stream(hub, subscriber, missed):
+    # the frames of one connection, heartbeat comments keep it open through the proxies
+    options = hub.options
+    try:
+        yield 'retry: {0}\n\n'.format(options['RETRY']).encode('ascii')
+        for frame in missed:
+            yield frame
+        while True:
+            frames = await subscriber.get(options['HEARTBEAT'])
+            if frames is None:
+                # the client reconnects with its Last-Event-ID and reads the rest from the history
+                return
+            if not frames:
+                yield b': ping\n\n'
+            for frame in frames:
+                yield frame
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+def post_event(post):
+    return 'post', {'id': post.id, 'creator': post.creator_id, 'title': post.title,
+                    'date': DateTimeField().to_representation(post.date), 'likes_count': post.likes_count}
+
+
+@receiver(post_save, sender=Post)
+def publish_new_post(sender, instance, created, **kwargs):
+    hub = get_hub()
+    if created and hub.active:
+        event = post_event(instance)
+        transaction.on_commit(lambda: hub.publish([event]))
+
+
+@receiver(likes_changed)
+def publish_likes(sender, post_ids, **kwargs):
+    hub = get_hub()
+    if not hub.active:
+        return
+
+    def publish():
+        # the counters as committed
+        counts = Post.objects.filter(id__in=post_ids).order_by('id').values_list('id', 'likes_count')
+        hub.publish([('likes', {'id': post_id, 'likes_count': likes_count}) for post_id, likes_count in counts])
+    transaction.on_commit(publish)
@@ -0,0 +1,73 @@
+"""
+NDJSON export of the posts and their likes.
+
+The rows are read with .iterator() in chunks and written out in blocks, so the memory doesn't depend on the table
+size. The stream is:
+
+    {"type": "export", "since": ..., "until": ...}    "until" is the `since` of the next incremental export
+    {"type": "post", "id": .., "creator": .., "title": .., "content": .., "date": .., "updated": .., "likes_count": ..}
+    {"type": "like", "post_id": .., "user_id": ..}    likes of the exported posts
+    {"type": "end", "posts": .., "likes": ..}         missing, if the stream was cut
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Post
+
+
+CHUNK_SIZE = 2000
+
+POST_FIELDS = ('id', 'creator_id', 'title', 'content', 'date', 'updated', 'likes_count')
+
+
+def _line(record):
+    return json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def parse_since(value):
+    # ISO 8601 time, the naive one is in UTC. Raises ValueError
+    since = parse_datetime(value)
+    if since is None:
+        raise ValueError('since has to be an ISO 8601 time')
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since, timezone.utc)
+    return since
+
+
+def export_lines(since=None, likes=True, using='default', chunk_size=CHUNK_SIZE):
+    """
+    Yields the NDJSON stream by blocks of lines. `since` exports only the posts changed since that time.
+    """
+    until = timezone.now()
+    yield _line({'type': 'export', 'since': since, 'until': until})
+
+    posts = Post.objects.using(using).order_by('updated', 'id')
+    if since is not None:
+        posts = posts.filter(updated__gte=since)
+
+    block, counts = [], {'posts': 0, 'likes': 0}
+    for row in posts.values_list(*POST_FIELDS).iterator(chunk_size=chunk_size):
+        record = dict(zip(POST_FIELDS, row))
+        record['creator'] = record.pop('creator_id')
+        block.append(_line(dict(type='post', **record)))
+        counts['posts'] += 1
+        if len(block) == chunk_size:
+            yield ''.join(block)
+            block = []
+
+    if likes:
+        through = Post.likes.through.objects.using(using).order_by('post_id', 'user_id')
+        if since is not None:
+            through = through.filter(post__updated__gte=since)
+        for post_id, user_id in through.values_list('post_id', 'user_id').iterator(chunk_size=chunk_size):
+            block.append(_line({'type': 'like', 'post_id': post_id, 'user_id': user_id}))
+            counts['likes'] += 1
+            if len(block) == chunk_size:
+                yield ''.join(block)
+                block = []
+
+    block.append(_line(dict(type='end', **counts)))
+    yield ''.join(block)
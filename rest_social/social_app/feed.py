@@ -0,0 +1,164 @@
+"""
+Home timelines of the followed authors (/feed/, settings.FEED).
+
+Fan-out on write: a new post is copied into the timelines (TimelineEntry) of the author and of the followers
+by one INSERT ... SELECT, so a feed page is one range scan of the (user, date, post) key plus the lookup of
+its posts. The authors, which have ever had more than FANOUT_LIMIT followers, aren't copied (one post would
+write that many rows), their posts are read at the feed time from the (creator, date, id) index and merged
+into the page by the same key. The flag stays set, so no posts of an author fall between the two paths.
+
+A followed author's newest MAX_LENGTH posts are copied into the timeline, the unfollowed author's are removed.
+Every timeline counts its entries (Timeline.length): the fan-out trims the timelines of the audience, which
+have grown to MAX_LENGTH + TRIM_EVERY entries, to the MAX_LENGTH newest ones, and the follow backfill trims
+the follower's timeline at once, so no timeline grows over MAX_LENGTH + TRIM_EVERY entries.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Author, Follow, Post, Timeline, TimelineEntry
+from .pagination import KeysetPagination
+from .utils import insert_batch_size
+
+
+def fan_out(post):
+    # copies the new post into the timelines, returns the number of the entries
+    if Author.objects.filter(user_id=post.creator_id, fanout_on_read=True).exists():
+        return 0
+    Timeline.objects.get_or_create(user_id=post.creator_id)
+    date = connection.ops.adapt_datetimefield_value(post.date)
+    # the author and the followers
+    audience = 'SELECT follower_id FROM {0} WHERE author_id = %s UNION ALL SELECT %s'.format(Follow._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute('INSERT INTO {0} (user_id, post_id, date) SELECT follower_id, %s, %s FROM {1} '
+                       'WHERE author_id = %s UNION ALL SELECT %s, %s, %s'
+                       .format(TimelineEntry._meta.db_table, Follow._meta.db_table),
+                       [post.id, date, post.creator_id, post.creator_id, post.id, date])
+        entries = cursor.rowcount
+        cursor.execute('UPDATE {0} SET length = length + 1 WHERE user_id IN ({1})'
+                       .format(Timeline._meta.db_table, audience), [post.creator_id, post.creator_id])
+    options = settings.FEED
+    trim_timelines('SELECT user_id FROM {0} WHERE length >= %s AND user_id IN ({1})'
+                   .format(Timeline._meta.db_table, audience),
+                   [options['MAX_LENGTH'] + options['TRIM_EVERY'], post.creator_id, post.creator_id])
+    return entries
+
+
+def trim_timelines(users, params):
+    """
+    Trims the timelines of the users (the SQL query of their ids with its params) to MAX_LENGTH newest entries
+    and recounts their lengths, returns the number of the removed entries.
+    """
+    table = TimelineEntry._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {0} WHERE user_id IN ({1}) AND date < (SELECT newer.date FROM {0} newer '
+                       'WHERE newer.user_id = {0}.user_id ORDER BY newer.date DESC, newer.post_id DESC '
+                       'LIMIT 1 OFFSET %s)'.format(table, users),
+                       list(params) + [settings.FEED['MAX_LENGTH'] - 1])
+        removed = cursor.rowcount
+        cursor.execute('UPDATE {0} SET length = (SELECT COUNT(*) FROM {1} WHERE {1}.user_id = {0}.user_id) '
+                       'WHERE user_id IN ({2})'.format(Timeline._meta.db_table, table, users), params)
+    return removed
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, **kwargs):
+    if created:
+        fan_out(instance)
+
+
+def follow(follower, author):
+    """
+    Follows the author, returns False, if it was followed already.
+    """
+    with transaction.atomic():
+        _, created = Follow.objects.get_or_create(follower=follower, author=author)
+        if not created:
+            return False
+        stats, _ = Author.objects.get_or_create(user=author)
+        Author.objects.filter(user=author).update(followers_count=F('followers_count') + 1)
+        if not stats.fanout_on_read and stats.followers_count + 1 > settings.FEED['FANOUT_LIMIT']:
+            # from now on the author's posts are read at the feed time
+            stats.fanout_on_read = True
+            Author.objects.filter(user=author).update(fanout_on_read=True)
+        Timeline.objects.get_or_create(user=follower)
+        if not stats.fanout_on_read:
+            posts = Post.objects.filter(creator=author).order_by('-date', '-id') \
+                .values_list('id', 'date')[:settings.FEED['MAX_LENGTH']]
+            TimelineEntry.objects.bulk_create([TimelineEntry(user=follower, post_id=post_id, date=date)
+                                               for post_id, date in posts],
+                                              batch_size=insert_batch_size(['user', 'post', 'date'], 1000),
+                                              ignore_conflicts=True)
+            # the backfill can double the timeline
+            trim_timelines('SELECT %s', [follower.id])
+    return True
+
+
+def unfollow(follower, author):
+    """
+    Stops following the author, returns False, if it wasn't followed.
+    """
+    with transaction.atomic():
+        deleted, _ = Follow.objects.filter(follower=follower, author=author).delete()
+        if not deleted:
+            return False
+        Author.objects.filter(user=author).update(followers_count=F('followers_count') - 1)
+        removed, _ = TimelineEntry.objects.filter(user=follower, post__creator=author).delete()
+        Timeline.objects.filter(user=follower).update(length=F('length') - removed)
+    return True
+
+
+def feed_sources(user):
+    """
+    (queryset, ordering) of every source of the user's feed: the timeline and the posts of every author,
+    which is read at the feed time (the user's own posts included). A source per author keeps each of them
+    a range scan of the (creator, date, id) index, an IN list of the authors would sort all their posts.
+    """
+    sources = [(TimelineEntry.objects.filter(user=user), ('-date', '-post_id'))]
+    pulled = list(Author.objects.filter(fanout_on_read=True, user__followers__follower=user)
+                  .values_list('user_id', flat=True))
+    if Author.objects.filter(user_id=user.id, fanout_on_read=True).exists():
+        pulled.append(user.id)
+    for author_id in pulled:
+        sources.append((Post.objects.filter(creator_id=author_id), ('-date', '-id')))
+    return sources
+
+
+class FeedPagination(KeysetPagination):
+    """
+    KeysetPagination over several sources of the same (date, post id) key: every source is read by its own
+    range scan of at most a page, and the page is merged from them.
+    """
+    ordering = ('-date', '-id')
+
+    def paginate_sources(self, sources, request):
+        # the page of {'date': .., 'id': ..} keys of the posts
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.fields = [Post._meta.get_field(name.lstrip('-')) for name in self.ordering]
+
+        position, reverse = self.decode_cursor(request)
+        keys = set()
+        for queryset, ordering in sources:
+            if reverse:
+                ordering = tuple(name[1:] if name.startswith('-') else '-' + name for name in ordering)
+            queryset = queryset.order_by(*ordering)
+            if position is not None:
+                queryset = queryset.filter(self._seek_filter(ordering, position))
+            keys.update(queryset.values_list(*(name.lstrip('-') for name in ordering))[:self.page_size + 1])
+
+        # one more key tells, whether the page has a continuation
+        results = sorted(keys, reverse=not reverse)[:self.page_size + 1]
+        has_following = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = position is not None, has_following
+        else:
+            self.has_next, self.has_previous = has_following, position is not None
+
+        self.page = [{'date': date, 'id': post_id} for date, post_id in results]
+        return self.page
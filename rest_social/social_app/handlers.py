@@ -0,0 +1,144 @@
+"""
+ASGI handler with native async views.
+
+Django 3.0 runs only sync views, and its ASGIHandler puts every request onto the one thread-sensitive thread.
+AsyncHandler serves the views of ASYNC_VIEWS['URLCONF'] in the event loop and runs the rest of the requests
+(the usual middleware chain and the sync views) on the bounded sync pool. The event streams are sent
+from their async iterators until the client disconnects, the sync streaming responses (the export) are
+pulled chunk by chunk on a thread of their own.
+"""
+from django.conf import settings
+from django.core import signals
+from django.core.exceptions import RequestAborted
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.exception import response_for_exception
+from django.db import connections
+from django.http import FileResponse
+from django.urls import Resolver404, get_resolver, set_script_prefix
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+
+from .events import EventStreamResponse
+from .sync_pool import run_sync
+
+
+def close_stream(response):
+    try:
+        response.close()
+    finally:
+        connections.close_all()
+
+
+class AsyncHandler(ASGIHandler):
+    def resolve_async(self, request):
+        try:
+            return get_resolver(settings.ASYNC_VIEWS['URLCONF']).resolve(request.path_info)
+        except Resolver404:
+            return None
+
+    def get_sync_response(self, request, scope):
+        signals.request_started.send(sender=self.__class__, scope=scope)
+        return self.get_response(request)
+
+    async def get_async_response(self, request, match):
+        request.resolver_match = match
+        try:
+            return await match.func(request, *match.args, **match.kwargs)
+        except Exception as e:
+            return await run_sync(response_for_exception, request, e)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            raise ValueError('Django can only handle ASGI/HTTP connections, not %s.' % scope['type'])
+        try:
+            body_file = await self.read_body(receive)
+        except RequestAborted:
+            return
+        set_script_prefix(self.get_script_prefix(scope))
+
+        request, error_response = self.create_request(scope, body_file)
+        if request is None:
+            await self.send_response(error_response, send)
+            return
+
+        match = self.resolve_async(request)
+        if match is not None:
+            signals.request_started.send(sender=self.__class__, scope=scope)
+            response = await self.get_async_response(request, match)
+        else:
+            # the whole sync request is one job on the pool
+            response = await run_sync(self.get_sync_response, request, scope)
+        response._handler_class = self.__class__
+        if isinstance(response, FileResponse):
+            response.block_size = self.chunk_size
+        if isinstance(response, EventStreamResponse):
+            await self.send_stream(response, receive, send)
+        elif response.streaming:
+            await self.send_sync_stream(response, send)
+        else:
+            await self.send_response(response, send)
+
+    def response_headers(self, response):
+        headers = [(header.encode('ascii'), value.encode('latin1')) for header, value in response.items()]
+        for cookie in response.cookies.values():
+            headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+        return headers
+
+    async def send_sync_stream(self, response, send):
+        """
+        Sends a StreamingHttpResponse (e.g. the export), whose iterator runs the queries lazily. Every chunk
+        is pulled on one thread of the response, so its cursor and connection stay on the thread that opened them.
+        """
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': self.response_headers(response),
+        })
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='stream')
+        iterator = iter(response)
+        try:
+            while True:
+                part = await loop.run_in_executor(executor, next, iterator, None)
+                if part is None:
+                    break
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body'})
+        finally:
+            # the thread ends with the response, so its connections are closed whatever CONN_MAX_AGE is
+            await loop.run_in_executor(executor, close_stream, response)
+            executor.shutdown(wait=False)
+
+    async def send_stream(self, response, receive, send):
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': self.response_headers(response),
+        })
+
+        async def disconnected():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        watcher = asyncio.ensure_future(disconnected())
+        stream = response.stream
+        try:
+            while True:
+                chunk = asyncio.ensure_future(stream.__anext__())
+                await asyncio.wait((chunk, watcher), return_when=asyncio.FIRST_COMPLETED)
+                if not chunk.done():
+                    # the client is gone, the stream is closed
+                    chunk.cancel()
+                    await asyncio.gather(chunk, return_exceptions=True)
+                    break
+                try:
+                    body = chunk.result()
+                except StopAsyncIteration:
+                    await send({'type': 'http.response.body'})
+                    break
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        finally:
+            watcher.cancel()
+            await stream.aclose()
+            response.close()
@@ -0,0 +1,155 @@
+"""
+Password hashing off the request threads.
+
+PBKDF2 runs on a bounded process pool; when all the workers and queue slots are busy,
+HashingUnavailable is raised immediately instead of piling the requests up.
+"""
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from threading import BoundedSemaphore, Lock
+import asyncio
+import multiprocessing
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .instrumentation import timed
+from .sync_pool import run_sync
+
+
+class HashingUnavailable(Exception):
+    pass
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    PBKDF2 with the iteration count from settings.PASSWORD_HASHING. The algorithm name is the same,
+    so the existing hashes are valid, and they are upgraded to the actual count on login.
+    """
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASHING['ITERATIONS']
+
+
+def _encode(password, salt, iterations):
+    return hashers.PBKDF2PasswordHasher().encode(password, salt, iterations)
+
+
+def _verify(password, encoded, iterations, new_salt):
+    # Returns (valid, new hash if the iteration count has changed)
+    hasher = hashers.PBKDF2PasswordHasher()
+    if not hasher.verify(password, encoded):
+        return False, None
+    if int(encoded.split('$', 2)[1]) != iterations:
+        return True, hasher.encode(password, new_salt, iterations)
+    return True, None
+
+
+_pool = None
+_slots = None
+_lock = Lock()
+
+
+def _get_pool():
+    global _pool, _slots
+    with _lock:
+        if _pool is None:
+            options = settings.PASSWORD_HASHING
+            context = multiprocessing.get_context(options['START_METHOD'])
+            _pool = ProcessPoolExecutor(max_workers=options['WORKERS'], mp_context=context)
+            # requests being hashed plus the ones waiting in the queue
+            _slots = BoundedSemaphore(options['WORKERS'] + options['QUEUE_DEPTH'])
+        return _pool, _slots
+
+
+@receiver(setting_changed)
+def reset_pool(**kwargs):
+    global _pool, _slots
+    if kwargs['setting'] == 'PASSWORD_HASHING':
+        with _lock:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = _slots = None
+
+
+def _submit(pool, slots, function, *args):
+    # the slot is held until the job is done, also when the caller has stopped waiting for it
+    try:
+        future = pool.submit(function, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    return future
+
+
+@timed('hash')
+def _run(function, *args):
+    options = settings.PASSWORD_HASHING
+    if not options['WORKERS']:
+        return function(*args)
+
+    pool, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        raise HashingUnavailable('Password hashing queue is full')
+    try:
+        return _submit(pool, slots, function, *args).result(timeout=options['TIMEOUT'])
+    except TimeoutError:
+        raise HashingUnavailable('Password hashing timed out')
+
+
+async def _arun(function, *args):
+    # _run for the async endpoints: the pool's future is awaited in the event loop
+    options = settings.PASSWORD_HASHING
+    with timed('hash'):
+        if not options['WORKERS']:
+            return await run_sync(function, *args)
+
+        pool, slots = _get_pool()
+        if not slots.acquire(blocking=False):
+            raise HashingUnavailable('Password hashing queue is full')
+        try:
+            # a job still in the queue is cancelled by the timeout, a running one keeps its slot until it ends
+            return await asyncio.wait_for(asyncio.wrap_future(_submit(pool, slots, function, *args)),
+                                          options['TIMEOUT'])
+        except asyncio.TimeoutError:
+            raise HashingUnavailable('Password hashing timed out')
+
+
+def hash_password(password):
+    hasher = PBKDF2PasswordHasher()
+    return _run(_encode, password, hasher.salt(), hasher.iterations)
+
+
+def hash_passwords(passwords):
+    # Bulk hashing for the imports: the list is spread over the whole pool
+    hasher = PBKDF2PasswordHasher()
+    salts = [hasher.salt() for _ in passwords]
+    iterations = [hasher.iterations] * len(passwords)
+    workers = settings.PASSWORD_HASHING['WORKERS']
+    if not workers:
+        return list(map(_encode, passwords, salts, iterations))
+    pool, _ = _get_pool()
+    return list(pool.map(_encode, passwords, salts, iterations, chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+async def ahash_password(password):
+    hasher = PBKDF2PasswordHasher()
+    return await _arun(_encode, password, hasher.salt(), hasher.iterations)
+
+
+def verify_password(user, password):
+    """
+    Checks the password of the user; the hash with an outdated iteration count is transparently replaced.
+    """
+    hasher = PBKDF2PasswordHasher()
+    if not user.password or not user.password.startswith(hasher.algorithm + '$'):
+        # unusable passwords and foreign algorithms are checked by Django itself
+        return user.check_password(password)
+
+    valid, new_encoded = _run(_verify, password, user.password, hasher.iterations, hasher.salt())
+    if new_encoded:
+        user.password = new_encoded
+        type(user).objects.filter(pk=user.pk).update(password=new_encoded)
+    return valid
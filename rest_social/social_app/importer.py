@@ -0,0 +1,255 @@
+"""
+Bulk import of users, posts and likes (the import_data command).
+
+The records are read as a stream and handled by chunks: every chunk is validated with the rules of the API
+serializers (without the remote email check), then written with bulk_create in one transaction.
+Records are dicts with a "type":
+
+    {"type": "user", "username": .., "email": .., "password": ..}   or "password_hash" with an encoded hash
+    {"type": "post", "id": .., "creator": username, "title": .., "content": .., "date": ..}
+    {"type": "like", "post_id": .., "user": username}
+
+"id" of a post is its id in the source; the likes refer to the posts of the same import by it.
+Invalid records are skipped and reported with their line numbers.
+"""
+from collections import Counter
+import csv
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.db.models import Max
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import as_serializer_error
+
+from .hashing import hash_passwords
+from .models import Post, User, hot_score, likes_changed
+from .search import index_posts
+from .utils import insert_batch_size, lock_for_writes
+from .serializers import ImportPostSerializer, ImportUserSerializer
+
+
+BATCH_SIZE = 1000
+
+TYPES = ('user', 'post', 'like')
+
+
+def ndjson_records(lines):
+    # (line number, record) pairs, the broken lines are yielded as the error strings
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield number, 'Invalid JSON'
+            continue
+        yield number, record if isinstance(record, dict) else 'Record has to be an object'
+
+
+def csv_records(lines, record_type=None):
+    # the type is taken from the "type" column or given for the whole file; the empty cells are missing values
+    reader = csv.DictReader(lines)
+    for record in reader:
+        record = {key: value for key, value in record.items() if key is not None and value not in ('', None)}
+        if record_type:
+            record['type'] = record_type
+        yield reader.line_num, record
+
+
+def validate(serializer, records):
+    """
+    Validates the (line, record) pairs by one serializer instance, as ListSerializer does: its fields are built
+    once per chunk, not per record. Yields (line, record, validated data or the first error).
+    """
+    for line, record in records:
+        try:
+            yield line, record, serializer.run_validation(record)
+        except (ValidationError, DjangoValidationError) as e:
+            field, messages = next(iter(as_serializer_error(e).items()))
+            yield line, record, '{0}: {1}'.format(field, messages[0] if isinstance(messages, list) else messages)
+
+
+class Importer:
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        # source id of a post -> id in the database
+        self.post_ids = {}
+        self.counts = Counter()
+        self.errors = []
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+        self.counts['errors'] += 1
+
+    def run(self, records):
+        chunk = []
+        for line, record in records:
+            chunk.append((line, record))
+            if len(chunk) == self.batch_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        return self.counts
+
+    def import_chunk(self, chunk):
+        grouped = {record_type: [] for record_type in TYPES}
+        for line, record in chunk:
+            if isinstance(record, str):
+                self.error(line, record)
+            elif record.get('type') not in grouped:
+                self.error(line, 'Unknown type "{0}"'.format(record.get('type')))
+            else:
+                grouped[record['type']].append((line, record))
+
+        with transaction.atomic():
+            # the ids of the posts are allocated from the last one, no other writer may take them before the commit
+            lock_for_writes(connection, Post._meta.db_table)
+            self.import_users(grouped['user'])
+            new_posts = self.import_posts(grouped['post'])
+            changed = self.import_likes(grouped['like'])
+            index_posts(new_posts)
+            if new_posts or changed:
+                Post.objects.filter(id__in=set(new_posts) | changed).touch()
+        if changed:
+            likes_changed.send(sender=Post, post_ids=changed)
+
+    def import_users(self, records):
+        valid = []
+        for line, _, data in validate(ImportUserSerializer(), records):
+            if isinstance(data, str):
+                self.error(line, data)
+            else:
+                valid.append((line, data))
+        if not valid:
+            return
+
+        # uniqueness of the whole chunk in two queries
+        usernames = {data['username'] for _, data in valid}
+        emails = {data['email'] for _, data in valid}
+        taken_usernames = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        taken_emails = set(User.objects.filter(email__in=emails).values_list('email', flat=True))
+        users = []
+        for line, data in valid:
+            if data['username'] in taken_usernames:
+                self.error(line, 'username: A user with that username already exists.')
+            elif data['email'] in taken_emails:
+                self.error(line, 'email: Email exists')
+            else:
+                taken_usernames.add(data['username'])
+                taken_emails.add(data['email'])
+                users.append(data)
+
+        raw = [data['password'] for data in users if 'password_hash' not in data]
+        hashed = iter(hash_passwords(raw) if raw else [])
+        User.objects.bulk_create(
+            (User(username=data['username'], email=data['email'], password=data.get('password_hash') or next(hashed))
+             for data in users),
+            batch_size=insert_batch_size(['username', 'password', 'email'], self.batch_size))
+        self.counts['users'] += len(users)
+
+    def import_posts(self, records):
+        creators = self.user_ids(record.get('creator') for _, record in records)
+        valid, source_ids = [], set()
+        for line, record, data in validate(ImportPostSerializer(), records):
+            source_id = record.get('id')
+            if isinstance(data, str):
+                self.error(line, data)
+            elif record.get('creator') not in creators:
+                self.error(line, 'creator: User "{0}" does not exist'.format(record.get('creator')))
+            elif source_id is not None and (str(source_id) in self.post_ids or str(source_id) in source_ids):
+                self.error(line, 'id: Post "{0}" was already imported'.format(source_id))
+            else:
+                if source_id is not None:
+                    source_ids.add(str(source_id))
+                valid.append((source_id, creators[record['creator']], data))
+        if not valid:
+            return []
+
+        # bulk_create doesn't return the ids on SQLite, so they are allocated in the chunk's transaction,
+        # which holds the write lock
+        first_id = (Post.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        now = timezone.now()
+        posts, dated = [], []
+        for number, (source_id, creator_id, data) in enumerate(valid):
+            date = data.get('date') or now
+            post = Post(id=first_id + number, creator_id=creator_id, title=data['title'], content=data['content'],
+                        hot_score=hot_score(0, date))
+            posts.append(post)
+            if source_id is not None:
+                self.post_ids[str(source_id)] = post.id
+            if 'date' in data:
+                dated.append((post, date))
+
+        fields = ['creator', 'title', 'content', 'likes_count', 'date', 'hot_score', 'updated']
+        Post.objects.bulk_create(posts, batch_size=insert_batch_size(['id'] + fields, self.batch_size))
+        if dated:
+            # auto_now_add has replaced the dates of the source
+            for post, date in dated:
+                post.date = date
+            Post.objects.bulk_update([post for post, _ in dated], ['date'],
+                                     batch_size=insert_batch_size(['id', 'date'], self.batch_size))
+        self.counts['posts'] += len(posts)
+        return [post.id for post in posts]
+
+    def import_likes(self, records):
+        users = self.user_ids(record.get('user') for _, record in records)
+        likes = {}
+        for line, record in records:
+            post_id = self.post_ids.get(str(record.get('post_id')))
+            if post_id is None:
+                self.error(line, 'post_id: Post "{0}" was not imported'.format(record.get('post_id')))
+            elif record.get('user') not in users:
+                self.error(line, 'user: User "{0}" does not exist'.format(record.get('user')))
+            else:
+                key = (post_id, users[record['user']])
+                if key in likes:
+                    self.counts['skipped_likes'] += 1
+                likes[key] = line
+        if not likes:
+            return set()
+
+        # the likes, which are in the database already, aren't counted as imported
+        through = Post.likes.through
+        existing = set(through.objects.filter(post_id__in={post_id for post_id, _ in likes},
+                                              user_id__in={user_id for _, user_id in likes})
+                       .values_list('post_id', 'user_id'))
+        new = [key for key in likes if key not in existing]
+        self.counts['skipped_likes'] += len(likes) - len(new)
+        if not new:
+            return set()
+        through.objects.bulk_create((through(post_id=post_id, user_id=user_id) for post_id, user_id in new),
+                                    batch_size=insert_batch_size(['post', 'user'], self.batch_size),
+                                    ignore_conflicts=True)
+        changed = {post_id for post_id, _ in new}
+        self.recount_likes(changed)
+        self.counts['likes'] += len(new)
+        return changed
+
+    @staticmethod
+    def recount_likes(post_ids):
+        """
+        recount_likes() and refresh_hot_scores() of the posts as one executemany: the CASE of bulk_update
+        takes longer to build than the update of thousands of posts itself.
+        """
+        post_ids = list(post_ids)
+        through = Post.likes.through
+        counts = dict(through.objects.filter(post_id__in=post_ids).order_by().values('post_id')
+                      .annotate(total=Count('id')).values_list('post_id', 'total'))
+        rows = [(counts.get(post_id, 0), hot_score(counts.get(post_id, 0), date), post_id)
+                for post_id, date in Post.objects.filter(id__in=post_ids).values_list('id', 'date')]
+        # the posts are touched by import_chunk()
+        with connection.cursor() as cursor:
+            cursor.executemany('UPDATE {0} SET likes_count = %s, hot_score = %s WHERE id = %s'
+                               .format(Post._meta.db_table), rows)
+
+    @staticmethod
+    def user_ids(usernames):
+        # username -> id of the existing users in one query
+        usernames = {username for username in usernames if isinstance(username, str)}
+        if not usernames:
+            return {}
+        return dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
@@ -0,0 +1,173 @@
+"""
+Per-request timing of the API.
+
+The middleware counts the SQL queries and their time on every connection, the code marks its phases with
+`timed(name)` (authentication, pagination, serialization, rendering, the email service, the password hashing).
+The result is sent back in the Server-Timing header, written as a JSON log line and added to the per-endpoint
+histograms of the process, which are exposed by /metrics/.
+"""
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from threading import Lock
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.phases = defaultdict(float)
+        self.active = set()
+        self.queries = 0
+        self.db = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # database execute wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+
+
+def current_timings():
+    return _current.get()
+
+
+@contextmanager
+def timed(name):
+    """
+    Adds the time of the block to the phase of the current request; nested blocks of the same phase
+    are counted once. Works as a decorator too.
+    """
+    timings = _current.get()
+    if timings is None or name in timings.active:
+        yield
+        return
+
+    timings.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.phases[name] += time.perf_counter() - started
+        timings.active.discard(name)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sums = defaultdict(float)
+
+    def observe(self, total_ms, values):
+        index = next((i for i, bound in enumerate(self.buckets) if total_ms <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.count += 1
+        self.sums['total_ms'] += total_ms
+        for key, value in values.items():
+            self.sums[key] += value
+
+    def as_dict(self):
+        # cumulative buckets, as in Prometheus
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            'count': self.count,
+            'sum': {key: round(value, 3) for key, value in self.sums.items()},
+            'mean_ms': round(self.sums['total_ms'] / self.count, 3) if self.count else 0,
+            'buckets_ms': buckets,
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = Lock()
+        self._histograms = {}
+
+    def observe(self, endpoint, total_ms, values):
+        with self._lock:
+            histogram = self._histograms.get(endpoint)
+            if histogram is None:
+                histogram = self._histograms[endpoint] = Histogram(settings.INSTRUMENTATION['BUCKETS'])
+            histogram.observe(total_ms, values)
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: histogram.as_dict() for endpoint, histogram in sorted(self._histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+metrics = Metrics()
+
+
+def endpoint_name(request):
+    match = getattr(request, 'resolver_match', None)
+    route = match.route if match is not None else 'unmatched'
+    return '{0} {1}'.format(request.method, route)
+
+
+def server_timing(durations, queries):
+    entries = []
+    for name, duration in durations.items():
+        entry = '{0};dur={1:.2f}'.format(name, duration)
+        if name == 'db':
+            entry += ';desc="{0} queries"'.format(queries)
+        entries.append(entry)
+    return ', '.join(entries)
+
+
+class TimingMiddleware:
+    """
+    Has to be the first middleware, so the whole request is measured.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = (time.perf_counter() - started) * 1000
+
+        durations = {'total': total, 'view': total - timings.phases.get('render', 0) * 1000,
+                     'db': timings.db * 1000}
+        durations.update((name, duration * 1000) for name, duration in sorted(timings.phases.items()))
+
+        options = settings.INSTRUMENTATION
+        if options['SERVER_TIMING']:
+            response['Server-Timing'] = server_timing(durations, timings.queries)
+
+        endpoint = endpoint_name(request)
+        values = {'{0}_ms'.format(name): duration for name, duration in durations.items() if name != 'total'}
+        values['queries'] = timings.queries
+        metrics.observe(endpoint, total, values)
+        if options['LOG']:
+            record = {'endpoint': endpoint, 'path': request.path, 'status': response.status_code}
+            record.update((key, round(value, 3)) for key, value in values.items())
+            record['total_ms'] = round(total, 3)
+            logger.info(json.dumps(record))
+        return response
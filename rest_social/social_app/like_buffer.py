@@ -0,0 +1,360 @@
+"""
+Write-behind buffer of the like marks (settings.LIKE_BUFFER).
+
+The marks of /change-mark/ and /change-mark/batch/ are kept in the process by (user, post), a later mark
+replaces the earlier one, and a mark returning to the stored state is dropped, so the flapping never reaches
+the database. The buffer is written in one transaction every FLUSH_INTERVAL seconds or at MAX_PENDING marks.
+
+The reads see the pending marks at once: the like flags and the likes counters of the responses are corrected
+by the buffer (`visible_likes`, `count_delta`), and the tags of the conditional GET include the pending state.
+
+Durability: without JOURNAL the pending marks (at most FLUSH_INTERVAL of them) are lost, if the process dies.
+With JOURNAL every mark is appended to the file before the response (and fsynced with FSYNC), the file is
+compacted to the still pending marks after every flush and replayed at the start. The marks are states,
+not toggles, so a replay of the already written marks changes nothing. The journal belongs to one process:
+it's locked (the .lock file next to it), and a second process with the same path refuses to start. With {pid}
+in the path every process has its own journal, and a starting process replays the unlocked journals of
+the ended ones.
+
+The pending marks are seen only by their process. With several processes a mark, which contradicts a pending
+mark of another process, is compared with the stored state: it's answered `unchanged`, if it matches it, and the
+pending mark is written by its flush, so the user's last mark is lost. Route the marks of a user to one process
+(or keep the buffer off) where it matters.
+"""
+from threading import Event, Lock, Thread
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.dispatch import receiver
+
+from .models import Post, User, likes_changed
+
+
+logger = logging.getLogger(__name__)
+
+
+def write_marks(marks, notify=True):
+    """
+    Writes the {(user_id, post_id): like} marks in one transaction, returns the ids of the changed posts.
+    The marks of the deleted users and posts are skipped. Without `notify` the caller sends `likes_changed`.
+    """
+    through = Post.likes.through
+    with transaction.atomic():
+        user_ids = set(User.objects.filter(id__in={user_id for user_id, _ in marks}).values_list('id', flat=True))
+        post_ids = set(Post.objects.filter(id__in={post_id for _, post_id in marks}).values_list('id', flat=True))
+        marks = {key: like for key, like in marks.items() if key[0] in user_ids and key[1] in post_ids}
+        liked = set(through.objects.filter(user_id__in=user_ids, post_id__in=post_ids)
+                    .values_list('user_id', 'post_id'))
+
+        added = [key for key, like in marks.items() if like and key not in liked]
+        removed = {}
+        for user_id, post_id in (key for key, like in marks.items() if not like and key in liked):
+            removed.setdefault(user_id, []).append(post_id)
+        if added:
+            through.objects.bulk_create([through(user_id=user_id, post_id=post_id) for user_id, post_id in added],
+                                        ignore_conflicts=True)
+        for user_id, removed_ids in removed.items():
+            through.objects.filter(user_id=user_id, post_id__in=removed_ids).delete()
+
+        changed = {post_id for _, post_id in added} | {post_id for ids in removed.values() for post_id in ids}
+        if changed:
+            posts = Post.objects.filter(id__in=changed)
+            posts.update_likes_count()
+            posts.refresh_hot_scores()
+    if changed and notify:
+        likes_changed.send(sender=Post, post_ids=changed)
+    return changed
+
+
+def lock_journal(path):
+    # the exclusive lock of the journal, None if another process holds it
+    lock = open(path + '.lock', 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+
+def read_journal(path):
+    # {(user_id, post_id): like} of the journal
+    marks = {}
+    if not os.path.exists(path):
+        return marks
+    with open(path, encoding='utf-8') as journal:
+        for line in journal:
+            try:
+                user_id, post_id, like = json.loads(line)
+            except ValueError:
+                # the last line can be cut by the crash
+                continue
+            marks[(user_id, post_id)] = bool(like)
+    return marks
+
+
+class LikeBuffer:
+    def __init__(self, options):
+        self.options = options
+        self._lock = Lock()
+        # (user_id, post_id) -> (like, stored like), the flushing marks stay visible until they are committed
+        self._pending = {}
+        self._flushing = {}
+        self._deltas = {}
+        # number of the committed flushes, a stored state read before a flush may be outdated
+        self._generation = 0
+        # number of the accepted marks, the tag of the pending state for the conditional GET
+        self._marks = 0
+        self._flush_lock = Lock()
+        self._wakeup = Event()
+        self._journal = None
+        self._journal_lock = None
+        self._stopped = False
+        if options['JOURNAL']:
+            self._path = options['JOURNAL'].format(pid=os.getpid())
+            self._journal_lock = lock_journal(self._path)
+            if self._journal_lock is None:
+                raise ImproperlyConfigured('Like buffer journal {0} is used by another process, '
+                                           'put {{pid}} into its path'.format(self._path))
+            self._replay()
+            self._journal = open(self._path, 'a', encoding='utf-8')
+        if options['FLUSH_INTERVAL']:
+            Thread(target=self._run, name='like-buffer', daemon=True).start()
+
+    def _orphaned_journals(self):
+        # [(path, lock)] of the journals of the ended processes, locked for the replay
+        template = self.options['JOURNAL']
+        if '{pid}' not in template:
+            return []
+        journals = []
+        for path in sorted(glob.glob(glob.escape(template).format(pid='*'))):
+            if path == self._path or path.endswith(('.lock', '.tmp')):
+                continue
+            lock = lock_journal(path)
+            if lock is not None:
+                journals.append((path, lock))
+        return journals
+
+    def _replay(self):
+        orphans = self._orphaned_journals()
+        marks = {}
+        for path in [path for path, _ in orphans] + [self._path]:
+            marks.update(read_journal(path))
+        if marks:
+            write_marks(marks)
+            logger.info('%s journaled like marks were replayed', len(marks))
+        self._compact({})
+        for path, lock in orphans:
+            os.remove(path)
+            lock.close()
+
+    def _compact(self, pending):
+        # the journal is replaced with the marks, which aren't written yet
+        path = self._path
+        with open(path + '.tmp', 'w', encoding='utf-8') as journal:
+            for (user_id, post_id), (like, _) in pending.items():
+                journal.write(json.dumps([user_id, post_id, int(like)]) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _visible(self, key):
+        # the like state, which is shown to the readers, None if it's only in the database
+        for marks in (self._pending, self._flushing):
+            if key in marks:
+                return marks[key][0]
+        return None
+
+    def mark(self, user_id, post_id, like):
+        """
+        Buffers the mark, returns True, if the state seen by the user was changed.
+        """
+        while True:
+            generation = self._generation
+            stored = None
+            if self.pending_state(user_id, post_id) is None:
+                stored = Post.likes.through.objects.filter(user_id=user_id, post_id=post_id).exists()
+            changed = self._add(user_id, post_id, like, stored, generation)
+            if changed is not None:
+                return changed
+
+    def _add(self, user_id, post_id, like, stored, generation):
+        # None, if the stored state is unknown or a flush has changed it after it was read
+        key = (user_id, post_id)
+        with self._lock:
+            visible = self._visible(key)
+            if visible is None and (stored is None or generation != self._generation):
+                return None
+            base = self._pending[key][1] if key in self._pending else (stored if visible is None else visible)
+            if (base if visible is None else visible) == like:
+                return False
+
+            if self._journal is not None:
+                self._journal.write(json.dumps([user_id, post_id, int(like)]) + '\n')
+                self._journal.flush()
+                if self.options['FSYNC']:
+                    os.fsync(self._journal.fileno())
+            if like == base:
+                # back to the state, which is (or will be) in the database
+                del self._pending[key]
+            else:
+                self._pending[key] = (like, base)
+            self._change_delta(post_id, 1 if like else -1)
+            self._marks += 1
+            full = len(self._pending) >= self.options['MAX_PENDING']
+
+        if full:
+            if self.options['FLUSH_INTERVAL']:
+                self._wakeup.set()
+            else:
+                self.flush()
+        return True
+
+    def _change_delta(self, post_id, change):
+        delta = self._deltas.get(post_id, 0) + change
+        if delta:
+            self._deltas[post_id] = delta
+        else:
+            self._deltas.pop(post_id, None)
+
+    def apply_marks(self, user, marks):
+        # Post.apply_marks() of the buffer: a result per (post_id, like) mark
+        existing = set(Post.objects.filter(id__in={post_id for post_id, _ in marks}).values_list('id', flat=True))
+        results = []
+        for post_id, like in marks:
+            if post_id not in existing:
+                results.append({'post_id': post_id, 'Error': 'Post with id "{0}" does not exist'.format(post_id)})
+            elif not self.mark(user.id, post_id, like):
+                results.append({'post_id': post_id, 'Result': 'unchanged'})
+            else:
+                results.append({'post_id': post_id, 'Result': 'liked' if like else 'unliked'})
+        return results
+
+    def pending_state(self, user_id, post_id):
+        with self._lock:
+            return self._visible((user_id, post_id))
+
+    def visible_likes(self, user_id, post_ids, stored):
+        # the liked posts out of post_ids as the user sees them, `stored` are the liked ones in the database
+        with self._lock:
+            result = set(stored)
+            for post_id in post_ids:
+                like = self._visible((user_id, post_id))
+                if like is True:
+                    result.add(post_id)
+                elif like is False:
+                    result.discard(post_id)
+            return result
+
+    def marks_tag(self):
+        # changes with every accepted mark, None while nothing is pending
+        with self._lock:
+            return self._marks if self._pending or self._flushing else None
+
+    def count_delta(self, post_id):
+        return self._deltas.get(post_id, 0)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """
+        Writes the pending marks, returns their number. A failed flush keeps them pending.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+            try:
+                changed = write_marks({key: like for key, (like, _) in self._flushing.items()}, notify=False)
+            except Exception:
+                logger.exception('Like marks were not written, they stay pending')
+                with self._lock:
+                    for key, (like, base) in self._flushing.items():
+                        # a newer mark of the same (user, post) wins, but it's based on the stored state now
+                        newer = self._pending.pop(key, (like, base))[0]
+                        if newer != base:
+                            self._pending[key] = (newer, base)
+                    self._flushing = {}
+                raise
+
+            with self._lock:
+                for (_, post_id), (like, base) in self._flushing.items():
+                    # the written marks are in the counters of the database now
+                    self._change_delta(post_id, int(base) - int(like))
+                count, self._flushing = len(self._flushing), {}
+                self._generation += 1
+                if self._journal is not None:
+                    self._journal.close()
+                    self._compact(self._pending)
+                    self._journal = open(self._path, 'a', encoding='utf-8')
+            # the versions are bumped after the deltas, so the new ones never see the marks counted twice
+            if changed:
+                likes_changed.send(sender=Post, post_ids=changed)
+            return count
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.options['FLUSH_INTERVAL'])
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # logged by flush(), the marks are retried with the next flush
+                pass
+            finally:
+                # the flusher thread owns its own connection
+                connection.close()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        try:
+            self.flush()
+        finally:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal_lock.close()
+
+
+_buffer = None
+_buffer_lock = Lock()
+
+
+def get_buffer():
+    # the buffer of the process, None in the write-through mode
+    global _buffer
+    if not settings.LIKE_BUFFER['ENABLED']:
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = LikeBuffer(settings.LIKE_BUFFER)
+        return _buffer
+
+
+def stop_buffer():
+    # flushes the pending marks, e.g. at the process exit
+    global _buffer
+    with _buffer_lock:
+        buffer, _buffer = _buffer, None
+    if buffer is not None:
+        buffer.stop()
+
+
+@receiver(setting_changed)
+def reset_buffer(**kwargs):
+    if kwargs['setting'] == 'LIKE_BUFFER':
+        stop_buffer()
+
+
+atexit.register(stop_buffer)
@@ -0,0 +1,185 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from rest_social.social_app.authentication import token_payload
+from rest_social.social_app.handlers import AsyncHandler
+from rest_social.social_app.models import User, Post
+from rest_social.settings import SECRET_KEY
+import jwt
+
+
+ENDPOINTS = ('register', 'posts', 'post')
+
+
+def wsgi_call(application, method, path, body, headers):
+    environ = {
+        'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+        'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': BytesIO(body), 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    environ.update(('HTTP_' + name.upper(), value) for name, value in headers.items())
+    status = []
+    response = application(environ, lambda status_line, response_headers: status.append(int(status_line[:3])))
+    b''.join(response)
+    response.close()
+    return status[0]
+
+
+async def asgi_call(application, method, path, body, headers):
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http', 'path': path,
+        'query_string': b'', 'root_path': '', 'server': ('testserver', 80), 'client': ('127.0.0.1', 5000),
+        'headers': [(b'host', b'testserver'), (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode('ascii'))] +
+                   [(name.lower().encode('ascii'), value.encode('ascii')) for name, value in headers.items()],
+    }
+    messages = [{'type': 'http.request', 'body': body}]
+    status = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+class Command(BaseCommand):
+    help = 'Compares the concurrent throughput of the WSGI and the ASGI (async views) deployments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and deployment')
+        parser.add_argument('--concurrency', type=int, default=32, help='WSGI threads / concurrent ASGI requests')
+        parser.add_argument('--email-delay', type=float, default=0.2,
+                            help='Simulated latency of the email service in seconds')
+        parser.add_argument('--iterations', type=int, default=None, help='PBKDF2 iterations (settings by default)')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                            help='Comma separated endpoints out of: ' + ', '.join(ENDPOINTS))
+        parser.add_argument('--output', default=None, help='JSON file for the results')
+
+    def handle(self, *args, **options):
+        endpoints = [endpoint for endpoint in options['endpoints'].split(',') if endpoint]
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            self.stderr.write('Unknown endpoints: ' + ', '.join(sorted(unknown)))
+            return
+
+        email_verification = dict(settings.EMAIL_VERIFICATION,
+                                  BACKEND='rest_social.social_app.email_verification.FakeEmailVerifier',
+                                  OPTIONS={'DELAY': options['email_delay']}, MODE='sync')
+        password_hashing = dict(settings.PASSWORD_HASHING,
+                                ITERATIONS=options['iterations'] or settings.PASSWORD_HASHING['ITERATIONS'],
+                                QUEUE_DEPTH=options['concurrency'])
+        async_views = dict(settings.ASYNC_VIEWS, SYNC_WORKERS=options['concurrency'])
+
+        # a file database: the threads of both deployments have to see the same data
+        directory = tempfile.TemporaryDirectory()
+        connection.settings_dict['TEST']['NAME'] = os.path.join(directory.name, 'bench.sqlite3')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(EMAIL_VERIFICATION=email_verification, PASSWORD_HASHING=password_hashing,
+                                   ASYNC_VIEWS=async_views):
+                for cache in caches.all():
+                    cache.clear()
+                call_command('seed_data', users=100, posts=1000, likes=5000, prefix='bench', stdout=self.stdout)
+                results = []
+                for endpoint in endpoints:
+                    results.append(self.run_wsgi(endpoint, options))
+                    results.append(self.run_asgi(endpoint, options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            directory.cleanup()
+
+        self.stdout.write('{0:<6} {1:<10} {2:>10} {3:>9} {4:>9} {5:>7}'.format(
+            'server', 'endpoint', 'req/s', 'p50 ms', 'p99 ms', 'errors'))
+        for result in results:
+            self.stdout.write('{server:<6} {endpoint:<10} {requests_per_second:>10} {p50_ms:>9} {p99_ms:>9} '
+                              '{errors:>7}'.format(**result))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'concurrency': options['concurrency'], 'email_delay': options['email_delay'],
+                           'results': results}, output, indent=2)
+
+    def requests(self, endpoint, server, count):
+        user = User.objects.filter(username__startswith='bench_user_').first()
+        headers = {'token': jwt.encode(token_payload(user), SECRET_KEY).decode('utf-8')}
+        post_ids = list(Post.objects.values_list('id', flat=True)[:count])
+        for number in range(count):
+            if endpoint == 'register':
+                username = '{0}_{1}'.format(server, number)
+                body = json.dumps({'username': username, 'password': 'benchpass123',
+                                   'email': username + '@example.com'}).encode('utf-8')
+                yield 'POST', '/register/', body, {}
+            elif endpoint == 'posts':
+                yield 'GET', '/posts/', b'', headers
+            else:
+                yield 'GET', '/post/{0}/'.format(post_ids[number % len(post_ids)]), b'', headers
+
+    def summary(self, server, endpoint, statuses, latencies, elapsed):
+        return {
+            'server': server,
+            'endpoint': endpoint,
+            'requests_per_second': round(len(statuses) / elapsed, 1),
+            'p50_ms': round(statistics.median(latencies), 1),
+            'p99_ms': round(sorted(latencies)[max(0, int(len(latencies) * 0.99) - 1)], 1),
+            'errors': sum(1 for status in statuses if status >= 400),
+        }
+
+    def run_wsgi(self, endpoint, options):
+        application = WSGIHandler()
+        latencies = []
+
+        def call(request):
+            started = time.perf_counter()
+            status = wsgi_call(application, *request)
+            latencies.append((time.perf_counter() - started) * 1000)
+            return status
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            statuses = list(executor.map(call, self.requests(endpoint, 'wsgi', options['requests'])))
+        return self.summary('wsgi', endpoint, statuses, latencies, time.perf_counter() - started)
+
+    def run_asgi(self, endpoint, options):
+        application = AsyncHandler()
+        latencies = []
+        requests = list(self.requests(endpoint, 'asgi', options['requests']))
+
+        async def run():
+            limit = asyncio.Semaphore(options['concurrency'])
+
+            async def call(request):
+                async with limit:
+                    started = time.perf_counter()
+                    status = await asgi_call(application, *request)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    return status
+
+            return await asyncio.gather(*(call(request) for request in requests))
+
+        started = time.perf_counter()
+        statuses = asyncio.run(run())
+        return self.summary('asgi', endpoint, statuses, latencies, time.perf_counter() - started)
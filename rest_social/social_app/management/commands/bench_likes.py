@@ -0,0 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from threading import Lock
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from rest_social.social_app.authentication import token_payload
+from rest_social.social_app.like_buffer import stop_buffer
+from rest_social.social_app.management.commands.bench_asgi import wsgi_call
+from rest_social.social_app.models import User, Post
+from rest_social.settings import SECRET_KEY
+import jwt
+
+
+MODES = ('direct', 'buffered')
+
+
+class WriteCounter:
+    # INSERT and DELETE statements of the likes table
+    def __init__(self):
+        self.lock = Lock()
+        self.writes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if 'social_app_post_likes' in sql and sql.lstrip().upper().startswith(('INSERT', 'DELETE')):
+            with self.lock:
+                self.writes += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Measures the sustained /change-mark/ throughput of the write-through and the write-behind modes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=16, help='Concurrent users, one thread each')
+        parser.add_argument('--marks', type=int, default=200, help='Marks per user')
+        parser.add_argument('--posts', type=int, default=5, help='Hot posts, all the marks go to them')
+        parser.add_argument('--flush-interval', type=float, default=0.2)
+        parser.add_argument('--journal', action='store_true', help='Journal the buffered marks')
+        parser.add_argument('--fsync', action='store_true', help='Fsync the journal per mark')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', default=None, help='JSON file for the results')
+
+    def handle(self, *args, **options):
+        directory = tempfile.TemporaryDirectory()
+        default = connections['default']
+        # the write lock is the point, so the database is a file, not the in-memory test one
+        default.settings_dict['TEST']['NAME'] = os.path.join(directory.name, 'likes.sqlite3')
+        setup_test_environment()
+        old_name = default.creation.create_test_db(verbosity=0, autoclobber=True)
+        for alias in connections:
+            if connections[alias].settings_dict['TEST']['MIRROR'] == 'default':
+                connections[alias].creation.set_as_test_mirror(default.settings_dict)
+        try:
+            for cache in caches.all():
+                cache.clear()
+            call_command('seed_data', users=options['users'], posts=options['posts'], likes=0, prefix='likes',
+                         stdout=self.stdout)
+            results = []
+            for mode in MODES:
+                buffer_options = dict(settings.LIKE_BUFFER, ENABLED=mode == 'buffered', FSYNC=options['fsync'],
+                                      FLUSH_INTERVAL=options['flush_interval'],
+                                      JOURNAL=os.path.join(directory.name, 'likes.journal') if options['journal']
+                                      else None)
+                with override_settings(LIKE_BUFFER=buffer_options):
+                    results.append(self.run(mode, options))
+        finally:
+            connections.close_all()
+            default.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            directory.cleanup()
+
+        self.stdout.write('{0:<9} {1:>9} {2:>8} {3:>8} {4:>7} {5:>7} {6:>10}'.format(
+            'mode', 'marks/s', 'p50 ms', 'p99 ms', 'errors', 'writes', 'consistent'))
+        for result in results:
+            self.stdout.write('{mode:<9} {marks_per_second:>9} {p50_ms:>8} {p99_ms:>8} {errors:>7} {writes:>7} '
+                              '{consistent!s:>10}'.format(**result))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'users': options['users'], 'marks': options['marks'], 'posts': options['posts'],
+                           'results': results}, output, indent=2)
+
+    def run(self, mode, options):
+        Post.likes.through.objects.all().delete()
+        Post.objects.recount_likes()
+        application = WSGIHandler()
+        post_ids = list(Post.objects.values_list('id', flat=True))
+        users = list(User.objects.filter(username__startswith='likes_user_'))
+        rnd = random.Random(options['seed'])
+        # every user toggles the hot posts; the last mark of every (user, post) is the expected state
+        plans = {user.id: [(rnd.choice(post_ids), rnd.random() < 0.5) for _ in range(options['marks'])]
+                 for user in users}
+        latencies, statuses = [], []
+
+        def run_user(user):
+            headers = {'token': jwt.encode(token_payload(user), SECRET_KEY).decode('utf-8')}
+            try:
+                for post_id, like in plans[user.id]:
+                    body = json.dumps({'post_id': post_id, 'like': int(like),
+                                       'unlike': int(not like)}).encode('utf-8')
+                    started = time.perf_counter()
+                    statuses.append(wsgi_call(application, 'POST', '/change-mark/', body, headers))
+                    latencies.append((time.perf_counter() - started) * 1000)
+            finally:
+                connections.close_all()
+
+        counter = WriteCounter()
+
+        def count_writes(connection, **kwargs):
+            # the connections of the request threads and of the flusher are opened during the run (possibly
+            # inside the wrapper of a request, which pops the last wrapper at its end)
+            if counter not in connection.execute_wrappers:
+                connection.execute_wrappers.insert(0, counter)
+
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(counter))
+            connection_created.connect(count_writes)
+            try:
+                with ThreadPoolExecutor(len(users)) as executor:
+                    list(executor.map(run_user, users))
+                elapsed = time.perf_counter() - started
+                # the rest of the buffer is written, as at the process exit
+                stop_buffer()
+            finally:
+                connection_created.disconnect(count_writes)
+
+        expected = {(user_id, post_id): like for user_id, plan in plans.items() for post_id, like in plan}
+        liked = set(Post.likes.through.objects.values_list('user_id', 'post_id'))
+        # the failed requests don't change anything, so only the counters are checked then
+        consistent = not Post.objects.with_wrong_likes_count().exists() and (
+            any(status != 201 for status in statuses) or
+            all((key in liked) == like for key, like in expected.items()))
+        return {
+            'mode': mode,
+            'marks_per_second': round(len(statuses) / elapsed, 1),
+            'p50_ms': round(statistics.median(latencies), 1),
+            'p99_ms': round(sorted(latencies)[max(0, int(len(latencies) * 0.99) - 1)], 1),
+            'errors': sum(1 for status in statuses if status >= 400),
+            'writes': counter.writes,
+            'consistent': consistent,
+        }
@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.conf import settings
+
+from rest_social.social_app import hashing
+
+
+class Command(BaseCommand):
+    help = 'Measures the password checks per second (the login throughput) per core with and without the pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Password checks per run')
+        parser.add_argument('--concurrency', type=int, default=32, help='Request threads')
+        parser.add_argument('--iterations', type=int, default=None, help='PBKDF2 iterations (settings by default)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Pool processes')
+        parser.add_argument('--output', default=None, help='JSON file for the results')
+
+    def run(self, options, workers):
+        password = 'benchmark-password'
+        encoded = hashing.hashers.PBKDF2PasswordHasher().encode(password, 'benchsalt', options['iterations'])
+        rejected = []
+
+        def check(_):
+            while True:
+                try:
+                    return hashing._run(hashing._verify, password, encoded, options['iterations'], 'benchsalt')
+                except hashing.HashingUnavailable:
+                    # the client retries after 503
+                    rejected.append(1)
+                    time.sleep(0.01)
+
+        hashing_options = dict(settings.PASSWORD_HASHING, ITERATIONS=options['iterations'], WORKERS=workers,
+                               QUEUE_DEPTH=options['concurrency'])
+        with override_settings(PASSWORD_HASHING=hashing_options):
+            # warm up the pool, so the processes start isn't measured
+            with ThreadPoolExecutor(max(workers, 1)) as executor:
+                list(executor.map(check, range(max(workers, 1))))
+            started = time.perf_counter()
+            with ThreadPoolExecutor(options['concurrency']) as executor:
+                results = list(executor.map(check, range(options['requests'])))
+            elapsed = time.perf_counter() - started
+
+        assert all(valid for valid, _ in results)
+        throughput = options['requests'] / elapsed
+        # inline hashing may use every core of the machine
+        cores = workers or os.cpu_count() or 1
+        return {
+            'workers': workers,
+            'requests': options['requests'],
+            'seconds': round(elapsed, 3),
+            'logins_per_second': round(throughput, 2),
+            'logins_per_second_per_core': round(throughput / cores, 2),
+            'rejected': len(rejected),
+        }
+
+    def handle(self, *args, **options):
+        if options['iterations'] is None:
+            options['iterations'] = settings.PASSWORD_HASHING['ITERATIONS']
+
+        results = {
+            'iterations': options['iterations'],
+            'concurrency': options['concurrency'],
+            'runs': [self.run(options, 0), self.run(options, options['workers'])],
+        }
+        for run in results['runs']:
+            self.stdout.write('{0:>8} {1:>10} logins/s {2:>10} logins/s per core'.format(
+                'pool={0}'.format(run['workers']) if run['workers'] else 'inline',
+                run['logins_per_second'], run['logins_per_second_per_core']))
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
@@ -0,0 +1,76 @@
+import json
+import statistics
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.renderers import JSONRenderer
+
+from rest_social.social_app.models import Post
+from rest_social.social_app.renderers import FastJSONRenderer, orjson
+from rest_social.social_app.serializers import PostsOutputSerializer, row_serializer
+
+
+class Command(BaseCommand):
+    help = 'Compares the /posts/ page fetching, serialization and rendering of the DRF and the fast read paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-sizes', default='10,100,1000', help='Comma separated page sizes')
+        parser.add_argument('--repeat', type=int, default=50, help='Measured runs per page size and path')
+        parser.add_argument('--output', default=None, help='JSON file for the results')
+
+    def handle(self, *args, **options):
+        page_sizes = [int(size) for size in options['page_sizes'].split(',') if size]
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            call_command('seed_data', users=100, posts=max(page_sizes), likes=max(page_sizes) * 5, prefix='bench',
+                         stdout=self.stdout)
+            results = [self.measure(page_size, options['repeat']) for page_size in page_sizes]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if orjson is None:
+            self.stdout.write('orjson is not installed, the fast path renders with the stock JSON renderer')
+        self.stdout.write('{0:>9} {1:>10} {2:>10} {3:>8}'.format('page size', 'drf ms', 'fast ms', 'speedup'))
+        for result in results:
+            self.stdout.write('{page_size:>9} {drf_ms:>10} {fast_ms:>10} {speedup:>7}x'.format(**result))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'orjson': orjson is not None, 'results': results}, output, indent=2)
+
+    def measure(self, page_size, repeat):
+        ordering = ('-date', '-id')
+        liked_ids = set(Post.objects.order_by(*ordering).values_list('id', flat=True)[:page_size:3])
+
+        def drf():
+            page = list(Post.objects.order_by(*ordering)[:page_size])
+            data = PostsOutputSerializer(page, many=True, context={'liked_ids': liked_ids}).data
+            return JSONRenderer().render({'results': data})
+
+        def fast():
+            serializer = row_serializer(PostsOutputSerializer)
+            page = list(Post.objects.order_by(*ordering).values(*serializer.columns)[:page_size])
+            data = serializer.many(page, like=lambda row: 1 if row['id'] in liked_ids else 0)
+            return FastJSONRenderer().render({'results': data})
+
+        if drf() != fast():
+            raise CommandError('The fast path output differs for the page size {0}'.format(page_size))
+
+        timings = {}
+        for name, function in (('drf', drf), ('fast', fast)):
+            runs = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                function()
+                runs.append((time.perf_counter() - started) * 1000)
+            timings[name] = statistics.median(runs)
+        return {
+            'page_size': page_size,
+            'drf_ms': round(timings['drf'], 3),
+            'fast_ms': round(timings['fast'], 3),
+            'speedup': round(timings['drf'] / timings['fast'], 1),
+        }
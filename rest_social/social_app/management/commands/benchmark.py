@@ -0,0 +1,144 @@
+from datetime import datetime
+import json
+import math
+import random
+import statistics
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from rest_social.social_app.models import User, Post
+
+
+ENDPOINTS = ('login', 'add-post', 'posts', 'post', 'change-mark')
+
+
+def percentile(values, percent):
+    # nearest-rank percentile
+    values = sorted(values)
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=settings.BASE_DIR).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Seeds a throwaway database and measures latency percentiles and query counts of the endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--likes', type=int, default=50000)
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+        parser.add_argument('--page-size', type=int, default=10, help='page_size of /posts/')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                            help='Comma separated endpoints out of: ' + ', '.join(ENDPOINTS))
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', default=None, help='JSON file for the results')
+        parser.add_argument('--compare', default=None, help='JSON results of another run to compare with')
+
+    def handle(self, *args, **options):
+        endpoints = [endpoint for endpoint in options['endpoints'].split(',') if endpoint]
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            self.stderr.write('Unknown endpoints: ' + ', '.join(sorted(unknown)))
+            return
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for cache in caches.all():
+                cache.clear()
+            call_command('seed_data', users=options['users'], posts=options['posts'], likes=options['likes'],
+                         seed=options['seed'], password='benchpass123', prefix='bench', stdout=self.stdout)
+            results = {endpoint: self.measure(endpoint, options) for endpoint in endpoints}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'revision': git_revision(),
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'sizes': {'users': options['users'], 'posts': options['posts'], 'likes': options['likes']},
+            'requests': options['requests'],
+            'results': results,
+        }
+        self.print_report(report, options['compare'])
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+    def measure(self, endpoint, options):
+        rnd = random.Random(options['seed'])
+        client = APIClient()
+        users = list(User.objects.filter(username__startswith='bench_user_').values_list('id', 'username'))
+        post_ids = list(Post.objects.values_list('id', flat=True))
+
+        user_id, username = rnd.choice(users)
+        response = client.post(reverse('login'), {'username': username, 'password': 'benchpass123'})
+        client.credentials(HTTP_TOKEN=response.data['token'])
+        pages = max(1, len(post_ids) // options['page_size'])
+
+        def request():
+            if endpoint == 'login':
+                return client.post(reverse('login'), {'username': rnd.choice(users)[1], 'password': 'benchpass123'})
+            if endpoint == 'add-post':
+                return client.post(reverse('add-post'), {'title': 'Benchmark post', 'content': 'Benchmark content'})
+            if endpoint == 'posts':
+                # the deep pages are the expensive ones for the OFFSET pagination
+                return client.get(reverse('posts'), {'page': rnd.randint(1, pages), 'page_size': options['page_size']})
+            if endpoint == 'post':
+                return client.get(reverse('post', args=[rnd.choice(post_ids)]))
+            like = rnd.randint(0, 1)
+            return client.post(reverse('change-mark'), {'post_id': rnd.choice(post_ids), 'like': like,
+                                                         'unlike': 1 - like})
+
+        latencies, queries, errors = [], [], 0
+        for _ in range(options['requests']):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = request()
+                latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured))
+            if response.status_code >= 400:
+                errors += 1
+
+        return {
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p90_ms': round(percentile(latencies, 90), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'mean_ms': round(statistics.mean(latencies), 3),
+            'max_ms': round(max(latencies), 3),
+            'queries_mean': round(statistics.mean(queries), 2),
+            'queries_max': max(queries),
+            'errors': errors,
+        }
+
+    def print_report(self, report, compare):
+        baseline = {}
+        if compare:
+            with open(compare) as previous:
+                baseline = json.load(previous).get('results', {})
+
+        self.stdout.write('{0:<12} {1:>9} {2:>9} {3:>9} {4:>9} {5:>8} {6:>7}'.format(
+            'endpoint', 'p50 ms', 'p90 ms', 'p99 ms', 'mean ms', 'queries', 'errors'))
+        for endpoint, result in report['results'].items():
+            line = '{0:<12} {p50_ms:>9} {p90_ms:>9} {p99_ms:>9} {mean_ms:>9} {queries_mean:>8} {errors:>7}'.format(
+                endpoint, **result)
+            if endpoint in baseline:
+                line += '   p50 x{0:.2f} vs {1}'.format(result['p50_ms'] / max(baseline[endpoint]['p50_ms'], 1e-9),
+                                                      compare)
+            self.stdout.write(line)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_social.social_app.export import CHUNK_SIZE, export_lines, parse_since
+
+
+class Command(BaseCommand):
+    help = 'Writes all the posts (or the ones changed since the time) and their likes as NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', default=None, help='ISO 8601 time, e.g. "until" of the previous export')
+        parser.add_argument('--no-likes', action='store_true', help='Export only the posts')
+        parser.add_argument('--output', default=None, help='File for the export (stdout by default)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_since(options['since']) if options['since'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        lines = export_lines(since, likes=not options['no_likes'], chunk_size=options['chunk_size'])
+        if options['output'] is None:
+            for block in lines:
+                self.stdout.write(block, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            for block in lines:
+                output.write(block)
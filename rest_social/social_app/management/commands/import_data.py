@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_social.social_app.importer import BATCH_SIZE, TYPES, Importer, csv_records, ndjson_records
+
+
+class Command(BaseCommand):
+    help = 'Imports users, posts and likes from an NDJSON or CSV file with bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='NDJSON or CSV file')
+        parser.add_argument('--format', choices=('ndjson', 'csv'), default=None,
+                            help='Format of the file (by the extension by default)')
+        parser.add_argument('--type', choices=TYPES, default=None,
+                            help='Type of every CSV row, if the file has no "type" column')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Records per transaction')
+        parser.add_argument('--max-errors', type=int, default=20, help='Errors listed in the report')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'ndjson')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size has to be positive')
+
+        importer = Importer(batch_size=options['batch_size'])
+        started = time.perf_counter()
+        try:
+            with open(options['path'], encoding='utf-8', newline='') as source:
+                if file_format == 'csv':
+                    records = csv_records(source, options['type'])
+                else:
+                    records = ndjson_records(source)
+                counts = importer.run(records)
+        except OSError as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+
+        for line, message in importer.errors[:options['max_errors']]:
+            self.stderr.write('line {0}: {1}'.format(line, message))
+        if len(importer.errors) > options['max_errors']:
+            self.stderr.write('... {0} more errors'.format(len(importer.errors) - options['max_errors']))
+
+        rows = counts['users'] + counts['posts'] + counts['likes']
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {0} users, {1} posts and {2} likes ({3} errors) in {4:.2f}s, {5:.0f} rows/s'.format(
+                counts['users'], counts['posts'], counts['likes'], counts['errors'], elapsed,
+                rows / elapsed if elapsed else 0)))
+        if counts['skipped_likes']:
+            self.stdout.write('{0} likes were skipped as duplicates'.format(counts['skipped_likes']))
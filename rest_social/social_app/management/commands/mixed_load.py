@@ -0,0 +1,130 @@
+from collections import Counter
+from contextlib import ExitStack
+from threading import Lock, Thread
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from rest_social.social_app.authentication import token_payload
+from rest_social.social_app.models import User, Post
+from rest_social.settings import SECRET_KEY
+import jwt
+
+
+class Command(BaseCommand):
+    help = 'Runs concurrent /change-mark/ writers and /posts/ readers against a throwaway file database ' \
+           'of the configured profile and reports the throughput, the errors and the connections used'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4, help='Threads changing the marks')
+        parser.add_argument('--readers', type=int, default=8, help='Threads reading the posts')
+        parser.add_argument('--requests', type=int, default=100, help='Requests per thread')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', default=None, help='JSON file for the results')
+
+    def handle(self, *args, **options):
+        directory = tempfile.TemporaryDirectory()
+        default = connections['default']
+        # the journal mode and the locking are the point, so the database is a file, not the in-memory test one
+        default.settings_dict['TEST']['NAME'] = os.path.join(directory.name, 'load.sqlite3')
+        setup_test_environment()
+        old_name = default.creation.create_test_db(verbosity=0, autoclobber=True)
+        for alias in connections:
+            if connections[alias].settings_dict['TEST']['MIRROR'] == 'default':
+                connections[alias].creation.set_as_test_mirror(default.settings_dict)
+        try:
+            for cache in caches.all():
+                cache.clear()
+            call_command('seed_data', users=options['writers'] + options['readers'], posts=200, likes=1000,
+                         prefix='load', seed=options['seed'], stdout=self.stdout)
+            report = self.run(options)
+        finally:
+            connections.close_all()
+            default.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            directory.cleanup()
+
+        for role, result in report['roles'].items():
+            self.stdout.write('{0:<8} {1:>8.1f} req/s  p50 {2:>7.1f} ms  p99 {3:>7.1f} ms  errors {4}  queries {5}'.format(
+                role, result['requests_per_second'], result['p50_ms'], result['p99_ms'], result['errors'],
+                ', '.join('{0}={1}'.format(alias, count) for alias, count in sorted(result['queries'].items()))))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+    def run(self, options):
+        users = list(User.objects.filter(username__startswith='load_user_').order_by('id'))
+        post_ids = list(Post.objects.values_list('id', flat=True))
+        pages = max(1, len(post_ids) // 10)
+        lock = Lock()
+        results = {role: {'latencies': [], 'errors': Counter(), 'queries': Counter()} for role in ('writers', 'readers')}
+
+        def worker(role, user, seed):
+            rnd = random.Random(seed)
+            client = Client(HTTP_TOKEN=jwt.encode(token_payload(user), SECRET_KEY).decode('utf-8'))
+            latencies, errors, queries = [], Counter(), Counter()
+
+            def count(execute, sql, params, many, context):
+                queries[context['connection'].alias] += 1
+                return execute(sql, params, many, context)
+
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(count))
+                for _ in range(options['requests']):
+                    started = time.perf_counter()
+                    try:
+                        if role == 'writers':
+                            like = rnd.randint(0, 1)
+                            response = client.post(reverse('change-mark'), {
+                                'post_id': rnd.choice(post_ids), 'like': like, 'unlike': 1 - like})
+                        else:
+                            response = client.get(reverse('posts'), {'page': rnd.randint(1, pages)})
+                        if response.status_code >= 400:
+                            # the views answer 400 on a database error
+                            errors[str(response.status_code)] += 1
+                    except Exception as e:
+                        errors[type(e).__name__] += 1
+                    latencies.append((time.perf_counter() - started) * 1000)
+            connections.close_all()
+
+            with lock:
+                results[role]['latencies'].extend(latencies)
+                results[role]['errors'].update(errors)
+                results[role]['queries'].update(queries)
+
+        threads = [Thread(target=worker, args=('writers', users[i], options['seed'] + i))
+                   for i in range(options['writers'])]
+        threads += [Thread(target=worker, args=('readers', users[options['writers'] + i], options['seed'] + 1000 + i))
+                    for i in range(options['readers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        report = {'profile': {alias: connections[alias].settings_dict.get('OPTIONS', {}) for alias in connections},
+                  'seconds': round(elapsed, 3), 'roles': {}}
+        for role, result in results.items():
+            latencies = sorted(result['latencies']) or [0]
+            report['roles'][role] = {
+                'requests_per_second': round(len(result['latencies']) / elapsed, 1),
+                'p50_ms': round(statistics.median(latencies), 1),
+                'p99_ms': round(latencies[max(0, int(len(latencies) * 0.99) - 1)], 1),
+                'errors': sum(result['errors'].values()),
+                'error_types': dict(result['errors']),
+                'queries': dict(result['queries']),
+            }
+        return report
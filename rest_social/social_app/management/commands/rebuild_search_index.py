@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_social.social_app.search import fts_enabled, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of the posts from scratch'
+
+    def handle(self, *args, **options):
+        if not fts_enabled():
+            raise CommandError('Full-text index is available only on SQLite')
+        with transaction.atomic():
+            indexed = rebuild_index()
+        self.stdout.write(self.style.SUCCESS('{0} posts were indexed'.format(indexed)))
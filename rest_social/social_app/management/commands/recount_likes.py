@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_social.social_app.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Reconciles the denormalized Post.likes_count counter with the real likes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Rebuild the counter of every post, not only the drifted ones, '
+                                 'all of them are marked as changed')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report posts with a wrong counter')
+
+    def handle(self, *args, **options):
+        if options['all'] and not options['dry_run']:
+            with transaction.atomic():
+                updated = Post.objects.update_likes_count()
+            self.stdout.write(self.style.SUCCESS('Likes counter was rebuilt for {0} posts'.format(updated)))
+            return
+
+        if options['dry_run']:
+            drifted = Post.objects.with_wrong_likes_count()
+            self.stdout.write('{0} posts have a wrong likes counter'.format(drifted.count()))
+            return
+
+        with transaction.atomic():
+            updated = Post.objects.recount_likes()
+        self.stdout.write(self.style.SUCCESS('Likes counter was fixed for {0} posts'.format(updated)))
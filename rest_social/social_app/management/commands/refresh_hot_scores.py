@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_social.social_app.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Recalculates the stored "hot" ranking score of the posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Posts updated per query')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = Post.objects.refresh_hot_scores(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Hot score was refreshed for {0} posts'.format(updated)))
@@ -0,0 +1,78 @@
+from itertools import accumulate
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rest_social.social_app.models import User, Post
+from rest_social.social_app.search import fts_enabled, rebuild_index
+from rest_social.social_app.utils import insert_batch_size
+
+
+WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'social', 'network', 'django', 'rest', 'post', 'like',
+         'coffee', 'travel', 'music', 'photo', 'weekend', 'friends', 'city', 'sunny', 'news', 'game', 'book')
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with synthetic users, posts and a Zipf-distributed likes graph'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--likes', type=int, default=50000, help='Like attempts (duplicates are skipped)')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Exponent of the posts popularity')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--password', default='seedpass123', help='Password of every seeded user')
+        parser.add_argument('--prefix', default='seed', help='Prefix of the usernames')
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            # one hash for everyone, PBKDF2 per user would take longer than the whole seeding
+            password = make_password(options['password'])
+            first_user = (User.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+            User.objects.bulk_create(
+                (User(username='{0}_user_{1}'.format(options['prefix'], first_user + i), password=password,
+                      email='{0}_user_{1}@example.com'.format(options['prefix'], first_user + i))
+                 for i in range(options['users'])),
+                batch_size=insert_batch_size(['username', 'password', 'email'], batch_size))
+            user_ids = list(User.objects.filter(username__startswith=options['prefix'] + '_user_')
+                            .values_list('id', flat=True))
+
+            first_post = (Post.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+            Post.objects.bulk_create(
+                (Post(creator_id=rnd.choice(user_ids), title=' '.join(rnd.choices(WORDS, k=rnd.randint(2, 8))),
+                      content=' '.join(rnd.choices(WORDS, k=rnd.randint(10, 120)))[:800])
+                 for _ in range(options['posts'])),
+                batch_size=insert_batch_size(['creator', 'title', 'content', 'likes_count', 'date', 'hot_score'],
+                                             batch_size))
+            post_ids = list(Post.objects.filter(id__gte=first_post).order_by('id').values_list('id', flat=True))
+
+            # the rank of a post (by a random permutation) defines its popularity
+            popularity = post_ids[:]
+            rnd.shuffle(popularity)
+            cum_weights = list(accumulate(1 / (rank ** options['zipf']) for rank in range(1, len(popularity) + 1)))
+            through = Post.likes.through
+            likes = set()
+            for _ in range(options['likes'] if post_ids else 0):
+                likes.add((rnd.choices(popularity, cum_weights=cum_weights)[0], rnd.choice(user_ids)))
+            through.objects.bulk_create((through(post_id=post_id, user_id=user_id) for post_id, user_id in likes),
+                                        batch_size=insert_batch_size(['post', 'user'], batch_size),
+                                        ignore_conflicts=True)
+
+            seeded = Post.objects.filter(id__gte=first_post)
+            # the seeded posts are new, nothing has seen their counters
+            seeded.recount_likes(notify=False)
+            seeded.refresh_hot_scores(batch_size=batch_size)
+            if fts_enabled():
+                rebuild_index()
+
+        self.stdout.write(self.style.SUCCESS(
+            '{0} users, {1} posts and {2} likes were created in {3:.1f}s'.format(
+                options['users'], len(post_ids), len(likes), time.perf_counter() - started)))
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.3 on 2026-10-18 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_app', '0002_post_likes_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['date', 'id'], name='social_app_post_date_id_idx'),
+        ),
+    ]
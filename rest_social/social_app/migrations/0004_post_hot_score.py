@@ -0,0 +1,34 @@
+# Generated by Django 3.0.3 on 2026-10-18 12:16
+
+from datetime import datetime, timezone
+import math
+
+from django.db import migrations, models
+
+
+def fill_hot_score(apps, schema_editor):
+    Post = apps.get_model('social_app', 'Post')
+    epoch = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    posts = [Post(id=post_id, hot_score=math.log10(max(likes_count, 1)) + (date - epoch).total_seconds() / 45000)
+             for post_id, likes_count, date in Post.objects.values_list('id', 'likes_count', 'date')]
+    Post.objects.bulk_update(posts, ['hot_score'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_app', '0003_post_date_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='hot_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['hot_score', 'id'], name='social_app_post_hot_id_idx'),
+        ),
+        migrations.RunPython(fill_hot_score, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('CREATE VIRTUAL TABLE social_app_post_fts USING fts5(title, content)')
+    schema_editor.execute('INSERT INTO social_app_post_fts (rowid, title, content) '
+                          'SELECT id, title, content FROM social_app_post')
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE social_app_post_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_app', '0004_post_hot_score'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.0.3 on 2026-10-18 15:02
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def fill_updated(apps, schema_editor):
+    Post = apps.get_model('social_app', 'Post')
+    Post.objects.update(updated=F('date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_app', '0005_post_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['updated', 'id'], name='social_app_post_updated_id_idx'),
+        ),
+        migrations.RunPython(fill_updated, migrations.RunPython.noop),
+    ]
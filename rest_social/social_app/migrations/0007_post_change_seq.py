@@ -0,0 +1,30 @@
+# Generated by Django 3.0.3 on 2026-10-18 13:01
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_change_seq(apps, schema_editor):
+    # the existing posts are ordered by their ids
+    Post = apps.get_model('social_app', 'Post')
+    Post.objects.update(change_seq=F('id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_app', '0006_post_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='change_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['change_seq', 'id'], name='social_app_post_change_id_idx'),
+        ),
+        migrations.RunPython(fill_change_seq, migrations.RunPython.noop),
+    ]
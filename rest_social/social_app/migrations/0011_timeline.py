@@ -0,0 +1,37 @@
+# Generated by Django 3.0.3 on 2026-10-18 13:33
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def fill_timelines(apps, schema_editor):
+    # the timelines of the followers and of the authors, with their current lengths
+    Follow = apps.get_model('social_app', 'Follow')
+    Timeline = apps.get_model('social_app', 'Timeline')
+    TimelineEntry = apps.get_model('social_app', 'TimelineEntry')
+    lengths = dict(TimelineEntry.objects.order_by().values('user_id').annotate(length=Count('id'))
+                   .values_list('user_id', 'length'))
+    user_ids = set(lengths) | set(Follow.objects.values_list('follower_id', flat=True))
+    Timeline.objects.bulk_create([Timeline(user_id=user_id, length=lengths.get(user_id, 0)) for user_id in user_ids],
+                                 batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('social_app', '0010_token_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Timeline',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('length', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
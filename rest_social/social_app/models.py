@@ -1,13 +1,268 @@
-from django.db import models
+from datetime import datetime, timezone
+import math
+
+from django.db import models, transaction
+from django.db.models import Count, F, FloatField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest, Log
 from django.contrib.auth.models import User
+from django.dispatch import Signal
+from django.utils import timezone as django_timezone
 # Create your models here.
 
+
+# Sent after the likes of the posts were changed (the likes_count is already updated)
+likes_changed = Signal(providing_args=['post_ids'])
+
+
+# "Hot" ranking: log10 of the likes plus the age bonus, so a post needs 10 times more likes to stay above
+# a post, which is HOT_DECAY_SECONDS newer. The time part of a post never changes, so the stored score
+# has to be updated only when the likes are changed.
+HOT_EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+HOT_DECAY_SECONDS = 45000
+
+
+def hot_score(likes_count, date):
+    return math.log10(max(likes_count, 1)) + (date - HOT_EPOCH).total_seconds() / HOT_DECAY_SECONDS
+
+
+def hot_score_expression(likes_count, date):
+    # hot_score() for UPDATE, where the likes count is an expression
+    time_part = (date - HOT_EPOCH).total_seconds() / HOT_DECAY_SECONDS
+    return Log(10, Greatest(likes_count, 1)) + Value(time_part, output_field=FloatField())
+
+
+def next_change_seq():
+    # The next number of the change sequence (the delta sync). It's calculated inside the writing statement,
+    # and the writers are serialized by the database lock, so the numbers grow in the commit order
+    last = Post.objects.order_by('-change_seq').values('change_seq')[:1]
+    return Coalesce(Subquery(last), 0) + 1
+
+
+def changed():
+    # the values of an UPDATE, which changes the posts visibly for the clients
+    return {'updated': django_timezone.now(), 'change_seq': next_change_seq()}
+
+
+class PostQuerySet(models.QuerySet):
+    def recount_likes(self, notify=True):
+        # Fix the denormalized likes counter of the posts, whose counter is wrong, the correct ones stay unchanged.
+        # With `notify` likes_changed is sent for them after the commit
+        post_ids = set(self.with_wrong_likes_count().values_list('id', flat=True))
+        if not post_ids:
+            return 0
+        updated = Post.objects.filter(id__in=post_ids).update_likes_count()
+        if notify:
+            transaction.on_commit(lambda: likes_changed.send(sender=Post, post_ids=post_ids))
+        return updated
+
+    def update_likes_count(self):
+        # Rebuild the likes counter of all the posts from the through table in one UPDATE, for the posts,
+        # whose likes were just changed
+        likes = Post.likes.through.objects.filter(post_id=OuterRef('pk')).order_by() \
+            .values('post_id').annotate(total=Count('id')).values('total')
+        return self.update(likes_count=Coalesce(Subquery(likes), 0), **changed())
+
+    def touch(self):
+        # marks the posts as changed for the incremental export and the delta sync
+        return self.update(**changed())
+
+    def refresh_hot_scores(self, batch_size=1000):
+        # Recalculates the stored ranking score by chunks, returns the number of posts
+        rows = self.order_by().values_list('id', 'likes_count', 'date')
+        posts = []
+        total = 0
+        for post_id, likes_count, date in rows.iterator(chunk_size=batch_size):
+            posts.append(Post(id=post_id, hot_score=hot_score(likes_count, date)))
+            if len(posts) == batch_size:
+                Post.objects.bulk_update(posts, ['hot_score'])
+                total += len(posts)
+                posts = []
+        if posts:
+            Post.objects.bulk_update(posts, ['hot_score'])
+            total += len(posts)
+        return total
+
+    def with_wrong_likes_count(self):
+        # Posts, whose stored counter differs from the real number of likes
+        return self.annotate(real_likes_count=Count('likes')).exclude(likes_count=F('real_likes_count'))
+
+
 class Post (models.Model):
     creator = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.TextField(max_length=120)
     content = models.TextField(max_length=800)
     likes = models.ManyToManyField(User, related_name='liked_posts', symmetrical=False)
+    likes_count = models.PositiveIntegerField(default=0)
+    date = models.DateTimeField(auto_now_add=True)
+    hot_score = models.FloatField(default=0)
+    # time of the last change of the post or of its likes (the incremental export)
+    updated = models.DateTimeField(auto_now=True)
+    # number of the last change in the commit order (the delta sync), see next_change_seq()
+    change_seq = models.BigIntegerField(default=0)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-date']
+        indexes = [
+            # key of the keyset pagination
+            models.Index(fields=['date', 'id'], name='social_app_post_date_id_idx'),
+            # key of the "hot" feed
+            models.Index(fields=['hot_score', 'id'], name='social_app_post_hot_id_idx'),
+            # key of the incremental export
+            models.Index(fields=['updated', 'id'], name='social_app_post_updated_id_idx'),
+            # key of the delta sync
+            models.Index(fields=['change_seq', 'id'], name='social_app_post_change_id_idx'),
+            # key of the authors' posts, which are read at the feed time
+            models.Index(fields=['creator', 'date', 'id'], name='social_app_post_creator_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        if adding:
+            self.hot_score = hot_score(self.likes_count, self.date or django_timezone.now())
+        with transaction.atomic():
+            super(Post, self).save(*args, **kwargs)
+            # the sequence number is taken in the database (the instance keeps the old one)
+            Post.objects.filter(id=self.id).touch()
+
+    @staticmethod
+    def is_liked(post_id, user):
+        # Existence check by the unique (post_id, user_id) index of the through table
+        return Post.likes.through.objects.filter(post_id=post_id, user_id=user.id).exists()
+
+    def is_liked_by(self, user):
+        return Post.is_liked(self.id, user)
+
+    @staticmethod
+    def liked_ids(user, posts):
+        # Ids of the given posts, which were liked by the user, in one query
+        return Post.liked_among(user, [post.id for post in posts])
+
+    @staticmethod
+    def liked_among(user, post_ids):
+        return set(Post.likes.through.objects.filter(user_id=user.id, post_id__in=post_ids)
+                   .values_list('post_id', flat=True))
+
+    @staticmethod
+    def apply_marks(user, marks):
+        """
+        Applies the (post_id, like) marks of the user with bulk writes in one transaction.
+        Marks are applied in order, so the last mark of a post wins. Returns a result per mark.
+        """
+        post_ids = {post_id for post_id, _ in marks}
+        through = Post.likes.through
+        with transaction.atomic():
+            existing = set(Post.objects.filter(id__in=post_ids).values_list('id', flat=True))
+            liked = set(through.objects.filter(user_id=user.id, post_id__in=existing)
+                        .values_list('post_id', flat=True))
+
+            state = set(liked)
+            results = []
+            for post_id, like in marks:
+                if post_id not in existing:
+                    results.append({'post_id': post_id,
+                                    'Error': 'Post with id "{0}" does not exist'.format(post_id)})
+                elif like == (post_id in state):
+                    results.append({'post_id': post_id, 'Result': 'unchanged'})
+                elif like:
+                    state.add(post_id)
+                    results.append({'post_id': post_id, 'Result': 'liked'})
+                else:
+                    state.discard(post_id)
+                    results.append({'post_id': post_id, 'Result': 'unliked'})
+
+            added, removed = state - liked, liked - state
+            if added:
+                through.objects.bulk_create([through(post_id=post_id, user_id=user.id) for post_id in added],
+                                            ignore_conflicts=True)
+            if removed:
+                through.objects.filter(user_id=user.id, post_id__in=removed).delete()
+            if added or removed:
+                changed = Post.objects.filter(id__in=added | removed)
+                changed.update_likes_count()
+                changed.refresh_hot_scores()
+        if added or removed:
+            likes_changed.send(sender=Post, post_ids=added | removed)
+        return results
+
+    def add_like(self, user):
+        # Returns True, if the like was really added
+        with transaction.atomic():
+            _, created = Post.likes.through.objects.get_or_create(post_id=self.id, user_id=user.id)
+            if created:
+                Post.objects.filter(id=self.id).update(
+                    likes_count=F('likes_count') + 1,
+                    hot_score=hot_score_expression(F('likes_count') + 1, self.date),
+                    **changed())
+        if created:
+            likes_changed.send(sender=Post, post_ids={self.id})
+        return created
+
+    def remove_like(self, user):
+        # Returns True, if the like existed and was removed
+        with transaction.atomic():
+            deleted, _ = Post.likes.through.objects.filter(post_id=self.id, user_id=user.id).delete()
+            if deleted:
+                # the counter never goes below zero, even if it has drifted
+                likes_count = Greatest(F('likes_count') - deleted, 0)
+                Post.objects.filter(id=self.id).update(likes_count=likes_count,
+                                                       hot_score=hot_score_expression(likes_count, self.date),
+                                                       **changed())
+        if deleted:
+            likes_changed.send(sender=Post, post_ids={self.id})
+        return bool(deleted)
+
+
+class Follow (models.Model):
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following', db_index=False)
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='followers', db_index=False)
     date = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        ordering = ['-date']
\ No newline at end of file
+        constraints = [
+            models.UniqueConstraint(fields=['follower', 'author'], name='social_app_follow_unique'),
+        ]
+        indexes = [
+            # the followers of an author (the fan-out)
+            models.Index(fields=['author', 'follower'], name='social_app_follow_author_idx'),
+        ]
+
+
+class Author (models.Model):
+    # followers counter of a followed user; the authors, which have ever had more than FEED['FANOUT_LIMIT']
+    # followers, are read at the feed time instead of the fan-out (see feed.py)
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='author_stats')
+    followers_count = models.PositiveIntegerField(default=0)
+    fanout_on_read = models.BooleanField(default=False)
+
+
+class Timeline (models.Model):
+    # number of the entries in the home timeline of the user, the timeline is trimmed by it (see feed.py)
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    length = models.PositiveIntegerField(default=0)
+
+
+class TimelineEntry (models.Model):
+    # a post in the home timeline of the user, the date is the date of the post (the key of the feed)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            # key of the feed pagination
+            models.UniqueConstraint(fields=['user', 'date', 'post'], name='social_app_timeline_key'),
+        ]
+
+
+class Event (models.Model):
+    # the events of /events/ fanned out through the database (events.DatabaseBackend), the id is the event id
+    type = models.CharField(max_length=20)
+    data = models.TextField()
+
+
+class TokenVersion (models.Model):
+    # the version of the user's tokens, the tokens of an older version are revoked (see authentication.py)
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='token_version')
+    version = models.PositiveIntegerField(default=0)
@@ -1,5 +1,16 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .instrumentation import timed
 
 
 class CustomPagination(PageNumberPagination):
@@ -7,6 +18,10 @@ class CustomPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 1000
 
+    @timed('paginate')
+    def paginate_queryset(self, queryset, request, view=None):
+        return super(CustomPagination, self).paginate_queryset(queryset, request, view)
+
     def get_paginated_response(self, data):
         return Response({
             'links': {
@@ -16,4 +31,128 @@ class CustomPagination(PageNumberPagination):
             'count': self.page.paginator.count,
             'page_size': self.page_size,
             'results': data
-        })
\ No newline at end of file
+        })
+
+
+class KeysetPagination(BasePagination):
+    """
+    Seeks on the (ordering) key instead of OFFSET, so every page costs one index range scan.
+    The cursor is opaque for clients, and the full count is never calculated.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    # the last field has to be unique, so the key defines a total order
+    ordering = ('-date', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+
+    @timed('paginate')
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.fields = [queryset.model._meta.get_field(name.lstrip('-')) for name in self.ordering]
+
+        position, reverse = self.decode_cursor(request)
+        ordering = self._reversed_ordering() if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._seek_filter(ordering, position))
+
+        # one more row tells, whether the page has a continuation
+        results = list(queryset[:self.page_size + 1])
+        has_following = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = position is not None, has_following
+        else:
+            self.has_next, self.has_previous = has_following, position is not None
+
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True,
+                                 cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_paginated_response(self, data):
+        return Response({
+            'links': {
+                'next': self.get_next_link(),
+                'previous': self.get_previous_link()
+            },
+            'page_size': self.page_size,
+            'results': data
+        })
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, item, reverse):
+        position = []
+        for field in self.fields:
+            # the page holds the model instances or the values() rows of the fast read path
+            value = item[field.name] if isinstance(item, dict) else getattr(item, field.attname)
+            position.append(value.isoformat() if isinstance(value, datetime) else value)
+
+        cursor = {'p': position}
+        if reverse:
+            cursor['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded.rstrip('='))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode('ascii'))
+            raw_position = cursor['p']
+            if len(raw_position) != len(self.fields):
+                raise ValueError
+            position = [field.to_python(value) for field, value in zip(self.fields, raw_position)]
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, bool(cursor.get('r'))
+
+    def _reversed_ordering(self):
+        return tuple(name[1:] if name.startswith('-') else '-' + name for name in self.ordering)
+
+    def _seek_filter(self, ordering, position):
+        # Lexicographic "after the position" condition:
+        # (a > x) OR (a = x AND b > y) OR ...
+        condition = Q()
+        equal = Q()
+        for name, value in zip(ordering, position):
+            field = name.lstrip('-')
+            lookup = '{0}__{1}'.format(field, 'lt' if name.startswith('-') else 'gt')
+            condition |= equal & Q(**{lookup: value})
+            equal &= Q(**{field: value})
+
+        # the redundant bound on the leading field lets the database drive the scan by the index
+        first = ordering[0]
+        bound = '{0}__{1}'.format(first.lstrip('-'), 'lte' if first.startswith('-') else 'gte')
+        return Q(**{bound: position[0]}) & condition
+
+
+def cursor_pagination_requested(request):
+    # Keyset mode is opt-in: ?pagination=cursor or an already issued cursor
+    return request.query_params.get('pagination') == 'cursor' or 'cursor' in request.query_params
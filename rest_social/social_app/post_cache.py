@@ -0,0 +1,110 @@
+"""
+Cache of the shared (viewer independent) body of /post/<pk>/.
+
+The body of /post/<pk>/ is stored under the change sequence number of the post (Post.change_seq), which
+the view reads with its validators, so a change is seen by every process at once, and a reader, which loaded
+the old row, can't overwrite the fresh entry. The old bodies are never read again and expire. Concurrent
+misses of the same post in the process are coalesced into one database load.
+"""
+from threading import Event, Lock
+
+from django.core.cache import caches
+
+from .models import Post
+from .serializers import PostOutputSerializer, row_serializer
+
+
+POST_DATA_KEY = 'post:{0}:{1}'
+
+
+def post_cache():
+    return caches['posts']
+
+
+class SingleFlight:
+    """
+    The first caller of a key runs the function, callers coming while it runs wait for its result.
+    """
+    class _Call:
+        def __init__(self):
+            self.done = Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+loads = SingleFlight()
+
+
+def _load_post_data(pk, change_seq):
+    cache = post_cache()
+    data = cache.get(POST_DATA_KEY.format(pk, change_seq))
+    if data is None:
+        serializer = row_serializer(PostOutputSerializer)
+        row = Post.objects.values('change_seq', *serializer.columns).get(id=pk)
+        data = serializer.to_representation(row)
+        # a post changed since its number was read is kept under its own number
+        cache.set(POST_DATA_KEY.format(pk, row['change_seq']), data)
+    return data
+
+
+def get_post_data(pk, change_seq):
+    """
+    Returns the serialized post of the change sequence number (see conditional.post_validators) without
+    the viewer's `like` field. The number is the key, so every process caches only the current bodies.
+    Raises Post.DoesNotExist.
+    """
+    if change_seq is None:
+        raise Post.DoesNotExist
+    data = post_cache().get(POST_DATA_KEY.format(pk, change_seq))
+    if data is None:
+        data = loads.do((pk, change_seq), lambda: _load_post_data(pk, change_seq))
+    return data
+
+
+def get_posts_data(pks):
+    """
+    get_post_data() of several posts: {pk: data} of the existing ones. The change sequence numbers are read by
+    one query of the primary keys, the bodies with one get_many, and the missed ones are loaded by one query,
+    whatever the number of the posts is.
+    """
+    cache = post_cache()
+    numbers = dict(Post.objects.filter(id__in=pks).order_by().values_list('id', 'change_seq'))
+    data_keys = {POST_DATA_KEY.format(pk, change_seq): pk for pk, change_seq in numbers.items()}
+    result = {data_keys[key]: data for key, data in cache.get_many(list(data_keys)).items()}
+    missed = set(numbers) - set(result)
+    if missed:
+        serializer = row_serializer(PostOutputSerializer)
+        loaded = {}
+        for row in Post.objects.filter(id__in=missed).values('change_seq', *serializer.columns):
+            result[row['id']] = loaded[POST_DATA_KEY.format(row['id'], row['change_seq'])] = \
+                serializer.to_representation(row)
+        cache.set_many(loaded)
+    return result
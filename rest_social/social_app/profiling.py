@@ -0,0 +1,92 @@
+"""
+On-demand profiling of single requests.
+
+A request is run under cProfile, when it carries the `X-Profile` header with the configured token,
+or when it's picked by the sampling rate. The stats are dumped into the profiles directory
+(`<time>-<endpoint>.prof`, readable with pstats or snakeviz) next to a JSON file with the endpoint
+and the executed SQL queries. Without a token and with the zero rate the middleware is removed at startup.
+"""
+from contextlib import ExitStack
+from datetime import datetime
+import cProfile
+import hmac
+import json
+import os
+import random
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .instrumentation import endpoint_name
+
+
+PROFILE_HEADER = 'X-Profile'
+
+
+class QueryLog:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({'sql': sql, 'params': repr(params), 'alias': context['connection'].alias,
+                                 'ms': round((time.perf_counter() - started) * 1000, 3)})
+
+
+def profiling_requested(request, options):
+    token = request.headers.get(PROFILE_HEADER)
+    if token and options['TOKEN'] and hmac.compare_digest(token, options['TOKEN']):
+        return True
+    return options['SAMPLE_RATE'] > 0 and random.random() < options['SAMPLE_RATE']
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        options = settings.PROFILING
+        if not options['TOKEN'] and not options['SAMPLE_RATE']:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = settings.PROFILING
+        if not profiling_requested(request, options):
+            return self.get_response(request)
+
+        profile, query_log = cProfile.Profile(), QueryLog()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_log))
+            profile.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profile.disable()
+        duration = (time.perf_counter() - started) * 1000
+
+        name = self.dump(request, response, profile, query_log.queries, duration, options['DIRECTORY'])
+        response[PROFILE_HEADER] = name
+        return response
+
+    @staticmethod
+    def dump(request, response, profile, queries, duration, directory):
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.url_name if match is not None and match.url_name else 'unmatched'
+        name = '{0}-{1}'.format(datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'), view_name)
+
+        os.makedirs(directory, exist_ok=True)
+        profile.dump_stats(os.path.join(directory, name + '.prof'))
+        with open(os.path.join(directory, name + '.json'), 'w') as output:
+            json.dump({
+                'endpoint': endpoint_name(request),
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'duration_ms': round(duration, 3),
+                'queries': queries,
+            }, output, indent=2)
+        return name + '.prof'
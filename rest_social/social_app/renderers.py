@@ -0,0 +1,61 @@
+from rest_framework.renderers import BaseRenderer, BrowsableAPIRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .instrumentation import timed
+
+try:
+    import orjson
+except ImportError:
+    # FastJSONRenderer falls back to the stock JSON renderer
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class TimedJSONRenderer(JSONRenderer):
+    # the rendering is reported as the `render` phase of the request
+    @timed('render')
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super(TimedJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+
+
+class FastJSONRenderer(TimedJSONRenderer):
+    """
+    JSONRenderer on orjson (when installed) with the same bytes: compact, UTF-8, U+2028/U+2029 escaped,
+    and the datetimes, decimals, lazy strings etc. are formatted by DRF's encoder.
+    The only difference are floats in the exponent notation (1e-7 instead of 1e-07), so it's meant for
+    the read endpoints, which don't return floats.
+    """
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+    @timed('render')
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        ret = orjson.dumps(data, default=JSONEncoder().default, option=self.options)
+        # the same escaping as JSONRenderer, the characters aren't valid in JavaScript strings
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack for the clients sending `Accept: application/msgpack` (requires the msgpack package).
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    @timed('render')
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=JSONEncoder().default, use_bin_type=True)
+
+
+# renderers of the fast read path, the MessagePack one only with msgpack installed
+FAST_RENDERER_CLASSES = [FastJSONRenderer] + ([MessagePackRenderer] if msgpack is not None else []) + \
+    [BrowsableAPIRenderer]
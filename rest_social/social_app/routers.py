@@ -0,0 +1,55 @@
+"""
+Read/write routing of the production database profile.
+
+Writes go to the primary connection. The reads of the safe (GET, HEAD, OPTIONS) requests go to the read-only
+connection (REPLICA), which under WAL doesn't wait for the writers; the other requests read from the primary,
+so they see their own writes. Without the replica configured everything goes to the primary.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_read_only = ContextVar('read_only_request', default=False)
+
+
+@contextmanager
+def read_only():
+    token = _read_only.set(True)
+    try:
+        yield
+    finally:
+        _read_only.reset(token)
+
+
+class ReadWriteRouter:
+    def db_for_read(self, model, **hints):
+        options = settings.DATABASE_ROUTING
+        if _read_only.get() and options['REPLICA'] in connections.databases:
+            return options['REPLICA']
+        return options['PRIMARY']
+
+    def db_for_write(self, model, **hints):
+        return settings.DATABASE_ROUTING['PRIMARY']
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both connections open the same database
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != settings.DATABASE_ROUTING['REPLICA']
+
+
+class ReadOnlyRequestMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method not in SAFE_METHODS:
+            return self.get_response(request)
+        with read_only():
+            return self.get_response(request)
@@ -0,0 +1,93 @@
+"""
+Full-text search over the posts by the SQLite FTS5 table.
+
+The index keeps its own copy of the title and content (rowid is the post id) and is updated by the
+model signals, so it survives the table rebuilds of the SQLite migrations. Bulk writes, which skip
+the signals, have to call index_posts() or the rebuild_search_index command.
+On the other databases the search falls back to the substring matching.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Post
+
+
+FTS_TABLE = 'social_app_post_fts'
+MAX_QUERY_TERMS = 16
+
+
+def fts_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def fts_query(query):
+    # Every term is quoted, so the user input can't use the FTS5 syntax; all the terms have to match
+    terms = re.findall(r'\w+', query)[:MAX_QUERY_TERMS]
+    return ' '.join('"{0}"'.format(term) for term in terms)
+
+
+def search_posts(query):
+    """
+    Posts matching the query, the best (by bm25 with the title weighted higher) are the first.
+    """
+    match = fts_query(query)
+    if not match:
+        return Post.objects.none()
+    if not fts_enabled():
+        condition = Q()
+        for term in re.findall(r'\w+', query)[:MAX_QUERY_TERMS]:
+            condition &= Q(title__icontains=term) | Q(content__icontains=term)
+        return Post.objects.filter(condition).order_by('-date', '-id')
+
+    return Post.objects.extra(
+        tables=[FTS_TABLE],
+        where=['{0}.rowid = social_app_post.id'.format(FTS_TABLE), '{0} MATCH %s'.format(FTS_TABLE)],
+        params=[match],
+        select={'rank': 'bm25({0}, 10.0, 1.0)'.format(FTS_TABLE)},
+        order_by=['rank', '-id'],
+    )
+
+
+def index_posts(post_ids):
+    if not fts_enabled() or not post_ids:
+        return
+    post_ids = list(post_ids)
+    placeholders = ', '.join(['%s'] * len(post_ids))
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {0} WHERE rowid IN ({1})'.format(FTS_TABLE, placeholders), post_ids)
+        cursor.execute('INSERT INTO {0} (rowid, title, content) SELECT id, title, content FROM social_app_post '
+                       'WHERE id IN ({1})'.format(FTS_TABLE, placeholders), post_ids)
+
+
+def rebuild_index():
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {0}'.format(FTS_TABLE))
+        cursor.execute('INSERT INTO {0} (rowid, title, content) SELECT id, title, content FROM social_app_post'
+                       .format(FTS_TABLE))
+        cursor.execute("INSERT INTO {0} ({0}) VALUES ('optimize')".format(FTS_TABLE))
+        cursor.execute('SELECT COUNT(*) FROM {0}'.format(FTS_TABLE))
+        return cursor.fetchone()[0]
+
+
+@receiver(post_save, sender=Post)
+def index_saved_post(sender, instance, update_fields=None, **kwargs):
+    if not fts_enabled():
+        return
+    if update_fields is not None and not {'title', 'content'} & set(update_fields):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {0} WHERE rowid = %s'.format(FTS_TABLE), [instance.id])
+        cursor.execute('INSERT INTO {0} (rowid, title, content) VALUES (%s, %s, %s)'.format(FTS_TABLE),
+                       [instance.id, instance.title, instance.content])
+
+
+@receiver(post_delete, sender=Post)
+def unindex_deleted_post(sender, instance, **kwargs):
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {0} WHERE rowid = %s'.format(FTS_TABLE), [instance.id])
@@ -1,17 +1,22 @@
+from functools import lru_cache
+
 from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.settings import api_settings
+from rest_framework import ISO_8601
 from .models import User, Post
 from django.core.exceptions import ValidationError
 import django.contrib.auth.password_validation as validators
-from rest_social.settings import EMAIL_HUNTER_API_KEY
-import requests
+from django.contrib.auth import hashers
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.conf import settings
+from django.utils import timezone as django_timezone
+from .email_verification import UNDELIVERABLE, UNKNOWN, cached_verdict, verify_email
+from .instrumentation import timed
 
 
 class UserSerializer(serializers.ModelSerializer):
     def validate(self, data):
-        # define custom exception
-        class EmailVerificationError(Exception):
-            pass
-
         user = User(**data)
         password = data.get('password')
         email = data.get('email')
@@ -25,22 +30,24 @@ class UserSerializer(serializers.ModelSerializer):
         except ValidationError as e:
             errors['password'] = list(e.messages)
 
-        # Email verification at emailhunter.co
-        try:
-            response = requests.get('https://api.hunter.io/v1/verify',
-                                    params={'email': email, 'api_key': EMAIL_HUNTER_API_KEY}).json()
-
-            if (response['status'] == 'error') or (
-                    response['status'] == 'success' and response['result'] == 'undeliverable'):
-                raise EmailVerificationError
-        # the exception raised here is custom
-        except EmailVerificationError as e:
-            errors['email'] = 'Email is undeliverable'
-
-        # Email existing check
+        # Email existing check (before the remote verification, which is much more expensive)
         if User.objects.filter(email=email).exists():
             raise ValidationError("Email exists")
 
+        # Email verification by the configured backend (emailhunter.co by default).
+        # In the background mode only a cached verdict is used, the rest is verified after the registration.
+        # With the 'verify_email' context False the verdict is left to the caller (the async registration)
+        if not email:
+            self.email_verdict = UNDELIVERABLE
+        elif settings.EMAIL_VERIFICATION['MODE'] == 'background':
+            self.email_verdict = cached_verdict(email) or UNKNOWN
+        elif not self.context.get('verify_email', True):
+            self.email_verdict = None
+        else:
+            self.email_verdict = verify_email(email)
+        if self.email_verdict == UNDELIVERABLE:
+            errors['email'] = 'Email is undeliverable'
+
         if errors:
             raise ValidationError(errors)
 
@@ -51,6 +58,37 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('username', 'password', 'email')
 
 
+class ImportUserSerializer(UserSerializer):
+    """
+    UserSerializer rules for the bulk import: the username and email uniqueness is checked by the importer
+    for the whole chunk at once, and the email isn't verified remotely.
+    Instead of the password an already encoded 'password_hash' can be given.
+    """
+    password_hash = serializers.CharField(required=False)
+
+    def validate(self, data):
+        if not data.get('email'):
+            raise ValidationError({'email': 'Email is required'})
+        if 'password_hash' in data:
+            try:
+                hashers.identify_hasher(data['password_hash'])
+            except ValueError:
+                raise ValidationError({'password_hash': 'Unknown password hash'})
+        elif not data.get('password'):
+            raise ValidationError({'password': 'Password or password_hash is required'})
+        else:
+            try:
+                validators.validate_password(password=data['password'], user=User)
+            except ValidationError as e:
+                raise ValidationError({'password': list(e.messages)})
+        return data
+
+    class Meta(UserSerializer.Meta):
+        fields = ('username', 'password', 'email', 'password_hash')
+        # only the uniqueness is checked by the importer, the format stays as of the registration
+        extra_kwargs = {'username': {'validators': [UnicodeUsernameValidator()]}, 'password': {'required': False}}
+
+
 class LoginSerializer(serializers.Serializer):
     username = serializers.CharField(required=True, allow_null=False)
     password = serializers.CharField(required=True, allow_null=False)
@@ -62,28 +100,150 @@ class PostSerializer(serializers.ModelSerializer):
         fields = ('title', 'content')
 
 
-class PostsOutputSerializer(serializers.ModelSerializer):
+class ImportPostSerializer(PostSerializer):
+    date = serializers.DateTimeField(required=False)
 
-    likes_count = serializers.SerializerMethodField()
+    class Meta(PostSerializer.Meta):
+        fields = ('title', 'content', 'date')
 
-    class Meta:
-        model = Post
-        fields = ('title', 'date', 'likes_count')
 
-    def get_likes_count(self, obj):
-        return obj.likes.count()
+class TimedSerializerMixin:
+    # the output serialization is reported as the `serialize` phase of the request
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super(TimedSerializerMixin, self).to_representation(instance)
+
 
+class PostsOutputSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+
+    like = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Post
+        fields = ('title', 'date', 'likes_count', 'like')
 
-class PostOutputSerializer(serializers.ModelSerializer):
+    def get_like(self, obj):
+        # ids of the page posts liked by the viewer are precalculated in the view
+        return 1 if obj.id in self.context.get('liked_ids', ()) else 0
 
-    likes_count = serializers.SerializerMethodField()
 
+class PostOutputSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Post
         fields = ('creator', 'title', 'content', 'date', 'likes_count')
 
-    def get_likes_count(self, obj):
-        return obj.likes.count()
+
+class PostChangeSerializer(PostOutputSerializer):
+    # a changed post of the delta sync: the post with its id and the viewer's like
+
+    like = serializers.SerializerMethodField()
+
+    class Meta(PostOutputSerializer.Meta):
+        fields = ('id',) + PostOutputSerializer.Meta.fields + ('like',)
+
+    def get_like(self, obj):
+        return 1 if obj.id in self.context.get('liked_ids', ()) else 0
+
+
+# ?fields= of the read endpoints
+POSTS_FIELDS = PostsOutputSerializer.Meta.fields
+POST_FIELDS = PostOutputSerializer.Meta.fields + ('like',)
+
+
+def requested_fields(request, allowed):
+    """
+    Fields of the comma separated ?fields= in the order of `allowed`, None without the parameter.
+    Raises ParseError for the unknown fields.
+    """
+    value = request.query_params.get('fields')
+    if not value:
+        return None
+    fields = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = fields - set(allowed)
+    if unknown:
+        raise ParseError('Unknown fields: {0}. Available fields: {1}'.format(', '.join(sorted(unknown)),
+                                                                              ', '.join(allowed)))
+    return tuple(name for name in allowed if name in fields)
+
+
+@lru_cache(maxsize=None)
+def sparse_serializer(serializer_class, fields):
+    # the serializer limited to the fields; the classes are built once per field set, not per request
+    if fields == tuple(serializer_class.Meta.fields):
+        return serializer_class
+    attrs = {name: None for name in serializer_class._declared_fields if name not in fields}
+    attrs['Meta'] = type('Meta', (serializer_class.Meta,), {'fields': fields})
+    return type(serializer_class.__name__, (serializer_class,), attrs)
+
+
+def model_columns(fields, *required):
+    # columns of Post for only(): the serialized model fields and the ones required by the caller (e.g. the ordering)
+    names = {field.name for field in Post._meta.concrete_fields}
+    return ['id'] + sorted({name for name in fields + required if name in names} - {'id'})
+
+
+class RowSerializer:
+    """
+    to_representation of a ModelSerializer precompiled for the values() rows: the fields are introspected once,
+    and a row is turned into a dict only by the field converters, with the same output as the serializer.
+    The values of the method fields (e.g. the viewer's like) are given by the caller.
+    """
+    # the database already returns these types, their to_representation would only copy the value
+    PLAIN_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.RelatedField)
+    # DateTimeField in ISO 8601, converted with the time zone looked up once per call instead of per value
+    ISO_DATETIME = 'iso-datetime'
+
+    def __init__(self, serializer_class):
+        self.fields = []
+        for name, field in serializer_class().fields.items():
+            if isinstance(field, serializers.SerializerMethodField):
+                self.fields.append((name, None, None))
+            elif isinstance(field, self.PLAIN_FIELDS):
+                self.fields.append((name, field.source, None))
+            elif self.is_iso_datetime(field):
+                self.fields.append((name, field.source, self.ISO_DATETIME))
+            else:
+                self.fields.append((name, field.source, field.to_representation))
+        self.columns = tuple(model_columns(tuple(source for _, source, _ in self.fields if source is not None)))
+
+    @staticmethod
+    def is_iso_datetime(field):
+        return (isinstance(field, serializers.DateTimeField) and settings.USE_TZ and not hasattr(field, 'timezone')
+                and str(getattr(field, 'format', api_settings.DATETIME_FORMAT)).lower() == ISO_8601)
+
+    def bound_fields(self):
+        current = django_timezone.get_current_timezone()
+
+        def iso_datetime(value):
+            value = value.astimezone(current).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+        return [(name, source, iso_datetime if convert == self.ISO_DATETIME else convert)
+                for name, source, convert in self.fields]
+
+    @staticmethod
+    def represent(fields, row, methods):
+        data = {}
+        for name, source, convert in fields:
+            if source is None:
+                data[name] = methods[name](row)
+                continue
+            value = row[source]
+            data[name] = value if value is None or convert is None else convert(value)
+        return data
+
+    def to_representation(self, row, **methods):
+        return self.represent(self.bound_fields(), row, methods)
+
+    def many(self, rows, **methods):
+        with timed('serialize'):
+            fields = self.bound_fields()
+            return [self.represent(fields, row, methods) for row in rows]
+
+
+@lru_cache(maxsize=None)
+def row_serializer(serializer_class, fields=None):
+    return RowSerializer(sparse_serializer(serializer_class, fields or tuple(serializer_class.Meta.fields)))
 
 
 class MarkSerializer(serializers.Serializer):
@@ -101,4 +261,13 @@ class MarkSerializer(serializers.Serializer):
         return super(MarkSerializer, self).validate(data)
 
     class Meta:
-        fields = ('post_id', 'like', 'unlike')
\ No newline at end of file
+        fields = ('post_id', 'like', 'unlike')
+
+
+class FollowSerializer(serializers.Serializer):
+    author_id = serializers.IntegerField(allow_null=False)
+    # 1 follows the author, 0 stops following
+    follow = serializers.IntegerField(allow_null=False, min_value=0, max_value=1)
+
+    class Meta:
+        fields = ('author_id', 'follow')
\ No newline at end of file
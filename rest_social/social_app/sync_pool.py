@@ -0,0 +1,55 @@
+"""
+Bounded thread pool for the sync work (the ORM, the cache) of the ASGI deployment.
+
+sync_to_async of Django 3.0 runs every request on the single thread-sensitive thread; the pool lets
+SYNC_WORKERS jobs run at once. Every job is one hop: the caller puts all its database work into one function.
+The threads keep their connections while CONN_MAX_AGE allows.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import asyncio
+import contextvars
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+
+
+_executor = None
+_lock = Lock()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.ASYNC_VIEWS['SYNC_WORKERS'],
+                                           thread_name_prefix='sync-pool')
+        return _executor
+
+
+@receiver(setting_changed)
+def reset_executor(**kwargs):
+    global _executor
+    if kwargs['setting'] == 'ASYNC_VIEWS':
+        with _lock:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = None
+
+
+def _call(function, args, kwargs):
+    try:
+        return function(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_sync(function, *args, **kwargs):
+    """
+    Awaits the sync function run on the pool; the context variables (e.g. the request timings) are passed along.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), context.run, _call, function, args,
+                                                            kwargs)
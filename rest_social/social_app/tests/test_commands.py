@@ -0,0 +1,242 @@
+from io import StringIO
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from rest_social.social_app.models import User, Post, likes_changed
+from rest_social.social_app.search import search_posts
+
+
+# Tests for the likes counter reconciliation command
+class TestRecountLikesCommand(TransactionTestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password='pwdd1598', email='ginger1@gmail.com')
+        user2 = User.objects.create(username='user2', password='pwdd1598', email='ginger2@gmail.com')
+
+        post1 = Post.objects.create(creator=user1, title='Test post 1', content='Content of test post 1')
+        post2 = Post.objects.create(creator=user2, title='Test post 2', content='Content of test post 2')
+        post1.likes.add(user1, user2)
+        post2.add_like(user1)
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command('recount_likes', '--dry-run', stdout=out)
+        self.assertIn('1 posts have a wrong likes counter', out.getvalue())
+        self.assertEqual(Post.objects.get(title='Test post 1').likes_count, 0, 'Dry run changed the counter')
+
+    def test_reconcile(self):
+        out = StringIO()
+        call_command('recount_likes', stdout=out)
+        self.assertIn('fixed for 1 posts', out.getvalue())
+        self.assertEqual(Post.objects.get(title='Test post 1').likes_count, 2, 'Counter was not fixed')
+        self.assertEqual(Post.objects.get(title='Test post 2').likes_count, 1, 'Correct counter was broken')
+
+    def test_rebuild_all(self):
+        out = StringIO()
+        call_command('recount_likes', '--all', stdout=out)
+        self.assertIn('rebuilt for 2 posts', out.getvalue())
+        self.assertFalse(Post.objects.with_wrong_likes_count().exists(), 'Counters were not rebuilt')
+
+    def test_notifies_fixed_posts(self):
+        notified = []
+
+        def receiver(sender, post_ids, **kwargs):
+            notified.append(set(post_ids))
+        likes_changed.connect(receiver)
+        try:
+            call_command('recount_likes', stdout=StringIO())
+        finally:
+            likes_changed.disconnect(receiver)
+        self.assertEqual(notified, [{Post.objects.get(title='Test post 1').id}], 'Fixed counters were not announced')
+
+
+# Tests for the "hot" score refreshing command
+class TestRefreshHotScoresCommand(TestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password='pwdd1598', email='ginger1@gmail.com')
+        for i in range(1, 4):
+            Post.objects.create(creator=user1, title='Test post {0}'.format(i), content='Content')
+        Post.objects.update(hot_score=0)
+
+    def test_refresh(self):
+        out = StringIO()
+        call_command('refresh_hot_scores', '--batch-size', '2', stdout=out)
+        self.assertIn('refreshed for 3 posts', out.getvalue())
+        self.assertFalse(Post.objects.filter(hot_score=0).exists(), 'Scores were not refreshed')
+
+
+# Tests for the full-text index rebuilding
+class TestRebuildSearchIndexCommand(TestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password='pwdd1598', email='ginger1@gmail.com')
+        Post.objects.bulk_create([Post(creator=user1, title='Bulk post {0}'.format(i), content='Imported content')
+                                  for i in range(3)])
+
+    def test_rebuild(self):
+        # bulk_create skips the signals, so the posts aren't indexed yet
+        self.assertFalse(search_posts('imported').exists())
+
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('3 posts were indexed', out.getvalue())
+        self.assertEqual(search_posts('imported').count(), 3, 'Posts were not indexed')
+
+
+# Tests for the synthetic data generator of the benchmarks
+class TestSeedDataCommand(TestCase):
+    def test_seed(self):
+        out = StringIO()
+        call_command('seed_data', '--users', '5', '--posts', '20', '--likes', '50', '--batch-size', '7', stdout=out)
+        self.assertIn('5 users, 20 posts', out.getvalue())
+        self.assertEqual(User.objects.filter(username__startswith='seed_user_').count(), 5)
+        self.assertEqual(Post.objects.count(), 20)
+        self.assertTrue(Post.objects.filter(likes_count__gt=0).exists(), 'Likes were not created')
+        self.assertFalse(Post.objects.with_wrong_likes_count().exists(), 'Counters were not recounted')
+        self.assertTrue(User.objects.get(username='seed_user_1').check_password('seedpass123'))
+
+    def test_deterministic(self):
+        call_command('seed_data', '--users', '3', '--posts', '10', '--likes', '20', stdout=StringIO())
+        titles = list(Post.objects.order_by('id').values_list('title', flat=True))
+        Post.objects.all().delete()
+        User.objects.all().delete()
+        call_command('seed_data', '--users', '3', '--posts', '10', '--likes', '20', stdout=StringIO())
+        self.assertEqual(list(Post.objects.order_by('id').values_list('title', flat=True)), titles)
+
+
+# Concurrent writers and readers on the production database profile
+class TestMixedLoadCommand(TestCase):
+    def test_production_profile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'load.json')
+            # the profile is chosen at the settings import, so the command runs in its own process
+            subprocess.run([sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'mixed_load',
+                            '--writers', '4', '--readers', '4', '--requests', '20', '--output', output],
+                           env=dict(os.environ, DATABASE_PROFILE='production'), check=True, stdout=subprocess.DEVNULL)
+            with open(output) as report:
+                report = json.load(report)
+
+        self.assertEqual(report['roles']['writers']['errors'], 0, report['roles']['writers']['error_types'])
+        self.assertEqual(report['roles']['readers']['errors'], 0, report['roles']['readers']['error_types'])
+        self.assertEqual(set(report['roles']['readers']['queries']), {'replica'}, 'Reads were not routed')
+        self.assertEqual(set(report['roles']['writers']['queries']), {'default'}, 'Writes were not routed')
+
+
+# Tests for the NDJSON export command
+class TestExportPostsCommand(TestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password='pwdd1598', email='ginger1@gmail.com')
+        for i in range(3):
+            Post.objects.create(creator=user1, title='Post {0}'.format(i), content='Content').add_like(user1)
+
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'posts.ndjson')
+            call_command('export_posts', '--output', output, '--chunk-size', '2')
+            with open(output) as export:
+                records = [json.loads(line) for line in export]
+        self.assertEqual(records[-1], {'type': 'end', 'posts': 3, 'likes': 3})
+
+        out = StringIO()
+        call_command('export_posts', '--since', '2100-01-01T00:00:00', '--no-likes', stdout=out)
+        self.assertEqual(json.loads(out.getvalue().splitlines()[-1]), {'type': 'end', 'posts': 0, 'likes': 0})
+
+        with self.assertRaises(CommandError):
+            call_command('export_posts', '--since', 'yesterday')
+
+
+@override_settings(PASSWORD_HASHING=dict(settings.PASSWORD_HASHING, WORKERS=0, ITERATIONS=1000))
+class TestImportDataCommand(TestCase):
+    def setUp(self):
+        User.objects.create(username='user1', password='pwdd1598', email='ginger1@gmail.com')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as source:
+            source.write(content)
+        return path
+
+    def test_import_ndjson(self):
+        records = [
+            {'type': 'user', 'username': 'importer1', 'email': 'importer1@gmail.com', 'password': 'pwdd1598_long'},
+            {'type': 'user', 'username': 'user1', 'email': 'other@gmail.com', 'password': 'pwdd1598_long'},
+            {'type': 'user', 'username': 'importer2', 'email': 'importer2@gmail.com', 'password': '123'},
+            {'type': 'post', 'id': 10, 'creator': 'importer1', 'title': 'Imported', 'content': 'Content',
+             'date': '2021-05-01T10:00:00Z'},
+            {'type': 'post', 'id': 11, 'creator': 'user1', 'title': 'Second', 'content': 'Content'},
+            {'type': 'post', 'id': 12, 'creator': 'nobody', 'title': 'Lost', 'content': 'Content'},
+            {'type': 'like', 'post_id': 10, 'user': 'user1'},
+            {'type': 'like', 'post_id': 10, 'user': 'importer1'},
+            {'type': 'like', 'post_id': 99, 'user': 'user1'},
+        ]
+        path = self.write('data.ndjson', '\n'.join(json.dumps(record) for record in records) + '\n{broken\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_data', path, '--batch-size', '4', stdout=out, stderr=err)
+
+        self.assertIn('Imported 1 users, 2 posts and 2 likes (5 errors)', out.getvalue())
+        self.assertIn('line 2: username', err.getvalue())
+        self.assertIn('line 10: Invalid JSON', err.getvalue())
+        self.assertTrue(User.objects.get(username='importer1').check_password('pwdd1598_long'))
+        post = Post.objects.get(title='Imported')
+        self.assertEqual(post.likes_count, 2)
+        self.assertEqual(post.date.isoformat(), '2021-05-01T10:00:00+00:00')
+        self.assertEqual(search_posts('imported').count(), 1)
+
+    def test_import_csv(self):
+        path = self.write('posts.csv', 'creator,title,content\nuser1,First,Content\nuser1,,Content\n')
+        out = StringIO()
+        call_command('import_data', path, '--type', 'post', stdout=out, stderr=StringIO())
+        self.assertIn('Imported 0 users, 1 posts and 0 likes (1 errors)', out.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command('import_data', os.path.join(self.directory.name, 'missing.csv'))
+
+    def test_import_duplicate_likes(self):
+        user1 = User.objects.get(username='user1')
+        records = [
+            {'type': 'post', 'id': 10, 'creator': 'user1', 'title': 'Imported', 'content': 'Content'},
+            {'type': 'like', 'post_id': 10, 'user': 'user1'},
+            {'type': 'like', 'post_id': 10, 'user': 'user1'},
+            {'type': 'like', 'post_id': 10, 'user': 'user1'},
+        ]
+        path = self.write('likes.ndjson', '\n'.join(json.dumps(record) for record in records))
+        out = StringIO()
+        # the like of the third record comes in the next chunk, when it's in the database already
+        call_command('import_data', path, '--batch-size', '3', stdout=out, stderr=StringIO())
+
+        self.assertIn('Imported 0 users, 1 posts and 1 likes (0 errors)', out.getvalue())
+        self.assertIn('2 likes were skipped as duplicates', out.getvalue())
+        self.assertEqual(list(Post.objects.get(title='Imported').likes.all()), [user1])
+
+    def test_import_invalid_username(self):
+        records = [
+            {'type': 'user', 'username': 'bad name!!', 'email': 'importer1@gmail.com', 'password': 'pwdd1598_long'},
+            {'type': 'user', 'username': 'importer2', 'email': 'importer2@gmail.com', 'password': 'pwdd1598_long'},
+        ]
+        path = self.write('users.ndjson', '\n'.join(json.dumps(record) for record in records))
+        out, err = StringIO(), StringIO()
+        call_command('import_data', path, stdout=out, stderr=err)
+
+        self.assertIn('Imported 1 users, 0 posts and 0 likes (1 errors)', out.getvalue())
+        self.assertIn('line 1: username', err.getvalue())
+        self.assertFalse(User.objects.filter(username='bad name!!').exists())
+
+    def test_import_without_password(self):
+        records = [
+            {'type': 'user', 'username': 'importer1', 'email': 'importer1@gmail.com'},
+            {'type': 'user', 'username': 'importer2', 'email': 'importer2@gmail.com', 'password': 'pwdd1598_long'},
+        ]
+        path = self.write('users.ndjson', '\n'.join(json.dumps(record) for record in records))
+        out, err = StringIO(), StringIO()
+        call_command('import_data', path, stdout=out, stderr=err)
+
+        self.assertIn('Imported 1 users, 0 posts and 0 likes (1 errors)', out.getvalue())
+        self.assertIn('line 1: password', err.getvalue())
+        self.assertFalse(User.objects.filter(username='importer1').exists())
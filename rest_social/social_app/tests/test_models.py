@@ -1,5 +1,15 @@
-from django.test import TestCase
-from rest_social.social_app.models import User, Post
+from django.db import connections
+from django.db.utils import ConnectionHandler
+from django.test import SimpleTestCase, TestCase, override_settings
+from unittest import mock
+import os
+import sqlite3
+import tempfile
+
+from rest_social.social_app.feed import fan_out, follow, unfollow
+from rest_social.social_app.models import Author, User, Post, Timeline, TimelineEntry, hot_score
+from rest_social.social_app.routers import ReadWriteRouter, read_only
+from rest_social.social_app.utils import lock_for_writes
 
 
 # Post actions: like / unlike, get all likes
@@ -47,3 +57,216 @@ class PostTestCases(TestCase):
         post2 = Post.objects.get(title='Test post 2')
         post2.likes.add(user1)
         self.assertEqual(list(user1.liked_posts.all()), list(Post.objects.all()), 'Error getting all likes from user')
+
+
+# Denormalized likes counter: incremental updates and reconciliation
+class LikesCounterTestCases(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username='user1', password='pwdd1598', email='ginger1@gmail.com')
+        self.user2 = User.objects.create(username='user2', password='pwdd1598', email='ginger2@gmail.com')
+        self.post = Post.objects.create(creator=self.user1, title='Test post', content='Content of test post')
+
+    def test_like_counter(self):
+        self.assertTrue(self.post.add_like(self.user1))
+        self.assertFalse(self.post.add_like(self.user1), 'Duplicated like was counted')
+        self.assertTrue(self.post.add_like(self.user2))
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 2, 'Likes counter was not increased')
+
+    def test_unlike_counter(self):
+        self.post.add_like(self.user1)
+        self.assertTrue(self.post.remove_like(self.user1))
+        self.assertFalse(self.post.remove_like(self.user1), 'Absent like was removed')
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0, 'Likes counter was not decreased')
+
+    def test_recount_likes(self):
+        # Likes added directly through the relation bypass the counter
+        self.post.likes.add(self.user1, self.user2)
+        self.assertEqual(list(Post.objects.with_wrong_likes_count()), [self.post], 'Drifted counter was not found')
+
+        Post.objects.recount_likes()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 2, 'Likes counter was not rebuilt')
+        self.assertFalse(Post.objects.with_wrong_likes_count().exists(), 'Counter is still drifted')
+
+        # a recount without any drift doesn't mark the posts as changed
+        self.assertEqual(Post.objects.recount_likes(), 0)
+        change_seq = self.post.change_seq
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.change_seq, change_seq, 'Correct post was marked as changed')
+
+    def test_liked_by(self):
+        post2 = Post.objects.create(creator=self.user1, title='Test post 2', content='Content of test post 2')
+        self.post.add_like(self.user2)
+
+        self.assertTrue(self.post.is_liked_by(self.user2), 'Like was not found')
+        self.assertFalse(self.post.is_liked_by(self.user1), 'Absent like was found')
+        self.assertEqual(Post.liked_ids(self.user2, [self.post, post2]), {self.post.id}, 'Wrong liked posts')
+
+
+# "Hot" ranking score: initial value and the incremental updates
+class HotScoreTestCases(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username='user1', password='pwdd1598', email='ginger1@gmail.com')
+        self.user2 = User.objects.create(username='user2', password='pwdd1598', email='ginger2@gmail.com')
+        self.post = Post.objects.create(creator=self.user1, title='Test post', content='Content of test post')
+
+    def test_initial_score(self):
+        self.assertAlmostEqual(self.post.hot_score, hot_score(0, self.post.date), places=3)
+
+    def test_score_follows_likes(self):
+        self.post.add_like(self.user1)
+        self.post.add_like(self.user2)
+        self.post.refresh_from_db()
+        self.assertAlmostEqual(self.post.hot_score, hot_score(2, self.post.date), places=6)
+
+        self.post.remove_like(self.user2)
+        self.post.refresh_from_db()
+        self.assertAlmostEqual(self.post.hot_score, hot_score(1, self.post.date), places=6)
+
+    def test_refresh(self):
+        Post.objects.update(hot_score=0)
+        self.assertEqual(Post.objects.refresh_hot_scores(), 1)
+        self.post.refresh_from_db()
+        self.assertAlmostEqual(self.post.hot_score, hot_score(0, self.post.date), places=6)
+
+
+# Read/write routing and the SQLite connection options of the production profile
+class DatabaseProfileTestCases(SimpleTestCase):
+    def test_routing(self):
+        router = ReadWriteRouter()
+        with read_only():
+            self.assertEqual(router.db_for_read(Post), 'default', 'Missing replica was used')
+
+        with mock.patch.dict(connections.databases, {'replica': dict(connections.databases['default'])}):
+            self.assertEqual(router.db_for_read(Post), 'default', 'Not a safe request read from the replica')
+            with read_only():
+                self.assertEqual(router.db_for_read(Post), 'replica')
+                self.assertEqual(router.db_for_write(Post), 'default')
+            self.assertFalse(router.allow_migrate('replica', 'social_app'))
+
+    def test_connection_options(self):
+        with tempfile.TemporaryDirectory() as directory:
+            name = os.path.join(directory, 'wal.sqlite3')
+            connection = ConnectionHandler({'default': {
+                'ENGINE': 'rest_social.social_app.backends.sqlite3', 'NAME': name,
+                'OPTIONS': {'init_command': 'PRAGMA journal_mode = WAL; PRAGMA busy_timeout = 1234',
+                            'transaction_mode': 'IMMEDIATE'}}})['default']
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA busy_timeout')
+                    self.assertEqual(cursor.fetchone()[0], 1234)
+                    cursor.execute('CREATE TABLE item (id integer)')
+
+                # the write lock is taken at BEGIN
+                connection._start_transaction_under_autocommit()
+                other = sqlite3.connect(name, timeout=0)
+                with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+                    other.execute('BEGIN IMMEDIATE')
+                other.close()
+            finally:
+                connection.close()
+
+    def test_lock_for_writes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            name = os.path.join(directory, 'lock.sqlite3')
+            connection = ConnectionHandler({'default': {
+                'ENGINE': 'rest_social.social_app.backends.sqlite3', 'NAME': name,
+                'OPTIONS': {'init_command': 'PRAGMA journal_mode = WAL'}}})['default']
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('CREATE TABLE item (id integer)')
+                # a deferred transaction takes the write lock only by the explicit call
+                connection._start_transaction_under_autocommit()
+                other = sqlite3.connect(name, timeout=0)
+                other.execute('BEGIN IMMEDIATE')
+                other.rollback()
+                lock_for_writes(connection, 'item')
+                with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+                    other.execute('BEGIN IMMEDIATE')
+                other.close()
+            finally:
+                connection.close()
+
+
+# Timelines: the fan-out of the new posts, the trimming, the follow backfill and the authors read at the feed time
+@override_settings(FEED={'FANOUT_LIMIT': 2, 'MAX_LENGTH': 3, 'TRIM_EVERY': 1})
+class TimelineTestCases(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username='user{0}'.format(i), password='pwdd1598',
+                                          email='ginger{0}@gmail.com'.format(i)) for i in range(1, 5)]
+
+    def timeline(self, user):
+        return list(TimelineEntry.objects.filter(user=user).order_by('-date', '-post_id').values_list('post_id', flat=True))
+
+    def test_fanOut(self):
+        author, follower, other = self.users[:3]
+        follow(follower, author)
+        post = Post.objects.create(creator=author, title='Post', content='Content')
+        self.assertEqual(self.timeline(follower), [post.id])
+        self.assertEqual(self.timeline(author), [post.id], 'Own post is not in the timeline')
+        self.assertEqual(self.timeline(other), [])
+        self.assertEqual(TimelineEntry.objects.get(user=follower).date, post.date)
+
+    def test_Trimming(self):
+        author, follower = self.users[:2]
+        follow(follower, author)
+        posts = [Post.objects.create(creator=author, title='Post', content='Content') for _ in range(5)]
+        self.assertEqual(self.timeline(follower), [post.id for post in reversed(posts)][:3])
+
+    @override_settings(FEED={'FANOUT_LIMIT': 5, 'MAX_LENGTH': 3, 'TRIM_EVERY': 2})
+    def test_trimmingPerTimeline(self):
+        first, second, follower = self.users[:3]
+        follow(follower, first)
+        follow(follower, second)
+        for i in range(10):
+            Post.objects.create(creator=(first, second)[i % 2], title='Post', content='Content')
+            for user in (first, second, follower):
+                length = len(self.timeline(user))
+                self.assertLessEqual(length, 4, 'Timeline has grown over MAX_LENGTH + TRIM_EVERY - 1')
+                counted = Timeline.objects.filter(user=user).values_list('length', flat=True).first() or 0
+                self.assertEqual(counted, length, 'Length is not counted')
+
+    def test_backfillIsTrimmed(self):
+        first, second, follower = self.users[:3]
+        follow(follower, first)
+        for author in (first, first, second, second, second):
+            Post.objects.create(creator=author, title='Post', content='Content')
+        follow(follower, second)
+        self.assertEqual(len(self.timeline(follower)), 3, 'Backfill was not trimmed')
+        self.assertEqual(Timeline.objects.get(user=follower).length, 3)
+
+        unfollow(follower, second)
+        self.assertEqual(Timeline.objects.get(user=follower).length, len(self.timeline(follower)))
+
+    def test_followBackfill(self):
+        author, follower = self.users[:2]
+        posts = [Post.objects.create(creator=author, title='Post', content='Content') for _ in range(4)]
+        self.assertTrue(follow(follower, author))
+        self.assertFalse(follow(follower, author), 'Author was followed twice')
+        self.assertEqual(self.timeline(follower), [post.id for post in reversed(posts)][:3])
+        self.assertEqual(Author.objects.get(user=author).followers_count, 1)
+
+        self.assertTrue(unfollow(follower, author))
+        self.assertFalse(unfollow(follower, author))
+        self.assertEqual(self.timeline(follower), [])
+        self.assertEqual(Author.objects.get(user=author).followers_count, 0)
+
+    def test_fanOutOnRead(self):
+        author = self.users[0]
+        for follower in self.users[1:]:
+            follow(follower, author)
+        stats = Author.objects.get(user=author)
+        self.assertTrue(stats.fanout_on_read, 'Big author is fanned out')
+        post = Post.objects.create(creator=author, title='Post', content='Content')
+        self.assertEqual(fan_out(post), 0)
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+
+        # the flag stays after the unfollowing
+        unfollow(self.users[1], author)
+        self.assertTrue(Author.objects.get(user=author).fanout_on_read)
@@ -1,13 +1,48 @@
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase, APIClient
 from rest_framework.views import status
 from django.urls import reverse
+from django.contrib.auth import hashers
 from django.contrib.auth.hashers import make_password
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from unittest import mock, skipUnless
+from asgiref.testing import ApplicationCommunicator
+import asyncio
+from datetime import timedelta
+from django.utils import timezone as django_timezone
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
 
-from rest_social.social_app.models import User, Post
+from rest_social.social_app.authentication import invalidate_user_tokens, token_cache
+from rest_social.social_app import events, hashing, like_buffer
+from rest_social.social_app.email_verification import FakeEmailVerifier, breaker, verify_pending_user
+from rest_social.social_app.export import export_lines
+from rest_social.social_app.handlers import AsyncHandler
+from rest_social.social_app.sync_pool import run_sync
+from rest_social.social_app.instrumentation import metrics
+from rest_social.social_app.models import User, Post, TokenVersion, changed, likes_changed
+from rest_social.social_app.post_cache import SingleFlight
+from rest_social.social_app.renderers import msgpack
+from rest_social.social_app.serializers import PostOutputSerializer, PostsOutputSerializer, row_serializer
 from rest_social.settings import SECRET_KEY
 import jwt
 
 
+# Cached entries of one test must not leak into the next one (the ids are reused)
+def clear_caches():
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
 # Method for token generation
 def user_token(user_id, username):
     payload = {
@@ -17,7 +52,15 @@ def user_token(user_id, username):
     return {'HTTP_token': jwt.encode(payload, SECRET_KEY).decode('utf-8')}
 
 
+# Local email verification, so the tests don't depend on emailhunter.co
+FAKE_EMAIL_VERIFICATION = dict(settings.EMAIL_VERIFICATION,
+                               BACKEND='rest_social.social_app.email_verification.FakeEmailVerifier',
+                               OPTIONS={'UNDELIVERABLE_DOMAINS': ['false.com'], 'UNAVAILABLE_DOMAINS': ['down.com']},
+                               FAILURE_THRESHOLD=2, EAGER=True)
+
+
 # Tests for registration request with data validating, checking for existing users, email verification
+@override_settings(EMAIL_VERIFICATION=FAKE_EMAIL_VERIFICATION)
 class TestRegistration(APITestCase):
     client = APIClient()
 
@@ -26,6 +69,10 @@ class TestRegistration(APITestCase):
         User.objects.create(username='user2', password=make_password('chat1597'), email='test_email2@gmail.com')
         User.objects.create(username='user3', password=make_password('testpass111'), email='test_email3@gmail.com')
 
+    def tearDown(self):
+        cache.clear()
+        breaker.reset()
+
     def test_required_field_checking(self):
         # All fields checking
         response = self.client.post(reverse('register'),
@@ -72,6 +119,57 @@ class TestRegistration(APITestCase):
         self.assertTrue(User.objects.get(username='gooduser') is not None, msg='User was not saved')
 
 
+# Tests for the email verification: verdicts caching, circuit breaker and the pending users
+@override_settings(EMAIL_VERIFICATION=FAKE_EMAIL_VERIFICATION)
+class TestEmailVerification(APITestCase):
+    def tearDown(self):
+        cache.clear()
+        breaker.reset()
+
+    def register(self, username, email):
+        return self.client.post(reverse('register'), {'username': username, 'password': 'testpass111', 'email': email})
+
+    def test_verdictCaching(self):
+        with mock.patch.object(FakeEmailVerifier, 'check', autospec=True,
+                               side_effect=FakeEmailVerifier.check) as check:
+            self.register('user1', 'someone@false.com')
+            self.register('user2', 'other@false.com')
+            response = self.register('user3', 'someone@false.com')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, 'Undeliverable email was passed')
+        self.assertEqual(check.call_count, 1, 'Undeliverable domain was verified again')
+
+    def test_unavailableService(self):
+        response = self.register('user1', 'first@down.com')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, 'User was not created')
+        self.assertFalse(User.objects.get(username='user1').is_active, 'Unverified user is active')
+
+        # The breaker is open after two failures, the service isn't called anymore
+        self.register('user2', 'second@down.com')
+        with mock.patch.object(FakeEmailVerifier, 'check') as check:
+            response = self.register('user3', 'third@gmail.com')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, 'User was not created')
+        self.assertFalse(check.called, 'Service was called with the open breaker')
+        self.assertFalse(User.objects.get(username='user3').is_active, 'Unverified user is active')
+
+        response = self.client.post(reverse('login'), {'username': 'user3', 'password': 'testpass111'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN, 'Unverified user logged in')
+
+    @override_settings(EMAIL_VERIFICATION=dict(FAKE_EMAIL_VERIFICATION, MODE='background'))
+    def test_backgroundMode(self):
+        with mock.patch('rest_social.social_app.views.schedule_verification') as schedule:
+            response = self.register('user1', 'someone@gmail.com')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, 'User was not created')
+        user = User.objects.get(username='user1')
+        self.assertFalse(user.is_active, 'User was verified during the request')
+        schedule.assert_called_once_with(user.id)
+
+        verify_pending_user(user.id)
+        self.assertTrue(User.objects.get(username='user1').is_active, 'User was not activated')
+
+        response = self.client.post(reverse('login'), {'username': 'user1', 'password': 'testpass111'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Verified user could not log in')
+
+
 # Tests for login view; jwt implementation, fields checking
 class TestLoginView(APITestCase):
     def setUp(self):
@@ -105,6 +203,117 @@ class TestLoginView(APITestCase):
         self.assertEqual(received, expected, 'JWT token failed')
 
 
+# Tests for the token authentication: single pass, payload caching, claims-only mode and revocation
+class TestTokenAuthentication(APITestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password=make_password('chat1597'), email='test_email1@gmail.com')
+        Post.objects.create(creator=user1, title='Post title', content='Post content')
+        token_cache.clear()
+
+    def tearDown(self):
+        clear_caches()
+        token_cache.clear()
+
+    def test_invalidToken(self):
+        response = self.client.get('http://testserver/post/1/', HTTP_token='not.a.token')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN, 'Invalid token was accepted')
+
+    def test_userLookedUpOnce(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('http://testserver/post/1/', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
+        user_queries = [query for query in queries if 'FROM "auth_user" WHERE' in query['sql']]
+        self.assertEqual(len(user_queries), 1, 'User was loaded more than once')
+
+    def test_payloadIsCached(self):
+        token = user_token(1, 'user1')
+        with mock.patch('rest_social.social_app.authentication.jwt.decode', wraps=jwt.decode) as decode:
+            self.client.get('http://testserver/post/1/', **token)
+            self.client.get('http://testserver/post/1/', **token)
+        self.assertEqual(decode.call_count, 1, 'Token was decoded twice')
+
+    @override_settings(TOKEN_AUTH={'CACHE_SIZE': 16, 'CACHE_TTL': 60, 'CLAIMS_ONLY': True, 'VERSION_TTL': 30})
+    def test_claimsOnly(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('change-mark'), {'post_id': 1, 'like': 1, 'unlike': 0},
+                                        **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, 'Mark was not changed')
+        self.assertFalse([query for query in queries if 'FROM "auth_user" WHERE' in query['sql']], 'User was loaded')
+        self.assertEqual(list(Post.objects.get(id=1).likes.values_list('username', flat=True)), ['user1'])
+
+        # the token version is cached, the next request doesn't query it
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('http://testserver/post/1/', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
+        self.assertFalse([query for query in queries if 'FROM "social_app_tokenversion"' in query['sql']],
+                         'Token version was read from the database')
+
+    def test_revokedToken(self):
+        old_token = user_token(1, 'user1')
+        invalidate_user_tokens(User.objects.get(id=1))
+
+        response = self.client.get('http://testserver/post/1/', **old_token)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN, 'Revoked token was accepted')
+
+        response = self.client.post(reverse('login'), {'username': 'user1', 'password': 'chat1597'})
+        response = self.client.get('http://testserver/post/1/', HTTP_token=response.data['token'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'New token was rejected')
+
+    def test_logout(self):
+        token = self.client.post(reverse('login'), {'username': 'user1', 'password': 'chat1597'}).data['token']
+        response = self.client.post(reverse('logout'), HTTP_token=token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Logout failed')
+        self.assertEqual(TokenVersion.objects.get(user_id=1).version, 1)
+
+        # the version is read from the database, not from a cache of the process
+        clear_caches()
+        response = self.client.get('http://testserver/post/1/', HTTP_token=token)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN, 'Token was accepted after the logout')
+
+    @override_settings(TOKEN_AUTH={'CACHE_SIZE': 16, 'CACHE_TTL': 60, 'CLAIMS_ONLY': True, 'VERSION_TTL': 30})
+    def test_revokedTokenClaimsOnly(self):
+        old_token = user_token(1, 'user1')
+        self.client.post(reverse('logout'), **old_token)
+        response = self.client.get('http://testserver/post/1/', **old_token)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN, 'Revoked token was accepted')
+
+
+# Tests for the password hashing on the process pool: rehash on login and the saturation
+@override_settings(PASSWORD_HASHING=dict(settings.PASSWORD_HASHING, ITERATIONS=2000, WORKERS=1, QUEUE_DEPTH=0))
+class TestPasswordHashing(APITestCase):
+    def setUp(self):
+        User.objects.create(username='user1', email='test_email1@gmail.com',
+                            password=hashers.PBKDF2PasswordHasher().encode('chat1597', 'somesalt', 1000))
+
+    def test_rehashOnLogin(self):
+        response = self.client.post(reverse('login'), {'username': 'user1', 'password': 'chat1597'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Authorization failed')
+        self.assertTrue(User.objects.get(username='user1').password.startswith('pbkdf2_sha256$2000$'),
+                        'Password was not rehashed')
+
+        response = self.client.post(reverse('login'), {'username': 'user1', 'password': 'chat1597'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Rehashed password is invalid')
+
+    def test_saturatedPool(self):
+        _, slots = hashing._get_pool()
+        slots.acquire()
+        try:
+            response = self.client.post(reverse('login'), {'username': 'user1', 'password': 'chat1597'})
+        finally:
+            slots.release()
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE, 'Busy pool accepted a request')
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_timedOutJobKeepsSlot(self):
+        with override_settings(PASSWORD_HASHING=dict(settings.PASSWORD_HASHING, TIMEOUT=0)):
+            response = self.client.post(reverse('login'), {'username': 'user1', 'password': 'chat1597'})
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE, 'Hashing did not time out')
+            _, slots = hashing._get_pool()
+            self.assertFalse(slots.acquire(blocking=False), 'Slot was released before the job ended')
+            self.assertTrue(slots.acquire(timeout=30), 'Slot was not released after the job')
+            slots.release()
+
+
 # Tests for post adding, data validating, fields checking
 class TestAddPostView(APITestCase):
 
@@ -164,6 +373,23 @@ class TestPostsRetrieving(APITestCase):
         print(response.content)
         self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
 
+    def test_likeFlags(self):
+        response = self.client.get('http://testserver/posts/?page_size=30', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
+        liked = [post['title'] for post in response.data['results'] if post['like'] == 1]
+        self.assertEqual(liked, ['Post title №1'], 'Wrong like flags of the viewer')
+
+    def test_queriesDontDependOnPageSize(self):
+        with CaptureQueriesContext(connection) as small_page:
+            response = self.client.get('http://testserver/posts/?page_size=2', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
+
+        with CaptureQueriesContext(connection) as big_page:
+            response = self.client.get('http://testserver/posts/?page_size=20', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertEqual(len(small_page), len(big_page), 'Likes are counted per post')
+
     def test_getWrongPage(self):
         response = self.client.get('http://testserver/posts/?page=70', content_type='application/json',
                                    **user_token(1, 'user1'))
@@ -171,6 +397,312 @@ class TestPostsRetrieving(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, 'Wrong page showing')
 
 
+# Tests for the ?fields= sparse fieldsets of the read endpoints
+class TestSparseFields(APITestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password=make_password('chat1597'), email='test_email1@gmail.com')
+        for i in range(1, 4):
+            Post.objects.create(creator=user1, title='Post title {0}'.format(i), content='Post content').add_like(user1)
+
+    def tearDown(self):
+        clear_caches()
+
+    def test_postsFields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('http://testserver/posts/?fields=title,like', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
+        self.assertEqual(response.data['results'][0], {'title': 'Post title 3', 'like': 1})
+        page_query = [query['sql'] for query in queries if 'FROM "social_app_post" ORDER BY' in query['sql']][0]
+        self.assertNotIn('"content"', page_query, 'Content was loaded')
+        self.assertNotIn('"likes_count"', page_query, 'Not requested column was loaded')
+
+        # without the like the likes of the viewer aren't queried
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('http://testserver/posts/?fields=title&pagination=cursor',
+                                       **user_token(1, 'user1'))
+        self.assertEqual(list(response.data['results'][0]), ['title'])
+        self.assertFalse([query for query in queries if 'social_app_post_likes' in query['sql']], 'Likes were queried')
+
+        response = self.client.get('http://testserver/posts/', **user_token(1, 'user1'))
+        self.assertEqual(list(response.data['results'][0]), ['title', 'date', 'likes_count', 'like'])
+
+    def test_postFields(self):
+        response = self.client.get('http://testserver/post/1/?fields=content,like', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
+        self.assertEqual(response.data, {'content': 'Post content', 'like': 1})
+
+        # the field set is a part of the ETag
+        etag = response['ETag']
+        response = self.client.get('http://testserver/post/1/', HTTP_IF_NONE_MATCH=etag, **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Other field set was not sent')
+
+    def test_unknownFields(self):
+        response = self.client.get('http://testserver/posts/?fields=title,password', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, 'Unknown field was accepted')
+        response = self.client.get('http://testserver/post/1/?fields=hot_score', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, 'Unknown field was accepted')
+
+
+# Tests for the values()-based read path: the output has to be the same as of the DRF serializers
+class TestFastReadPath(APITestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password=make_password('chat1597'), email='test_email1@gmail.com')
+        titles = ['Plain', 'Ünïcödé 😀', 'Line\u2028separator', 'Quotes "\\ </script>', 'Control \x01\t\n']
+        for title in titles:
+            Post.objects.create(creator=user1, title=title, content=title + ' content')
+        Post.objects.get(title='Plain').add_like(user1)
+
+    def tearDown(self):
+        clear_caches()
+
+    def test_postsSameBytes(self):
+        response = self.client.get('http://testserver/posts/', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
+
+        posts = Post.objects.order_by('-date', '-id')
+        liked_ids = Post.liked_ids(User.objects.get(id=1), posts)
+        expected = dict(response.data, results=PostsOutputSerializer(posts, many=True,
+                                                                      context={'liked_ids': liked_ids}).data)
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+    def test_postSameBytes(self):
+        post = Post.objects.get(title='Line\u2028separator')
+        response = self.client.get('http://testserver/post/{0}/'.format(post.id), **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
+        expected = dict(PostOutputSerializer(post).data, like=0)
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+    def test_rowSerializerTimeZone(self):
+        post = Post.objects.get(title='Plain')
+        serializer = row_serializer(PostOutputSerializer)
+        with django_timezone.override('Europe/Kiev'):
+            row = serializer.to_representation(Post.objects.values(*serializer.columns).get(id=post.id))
+            self.assertEqual(row, PostOutputSerializer(post).data)
+        self.assertFalse(row['date'].endswith('Z'))
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_messagePack(self):
+        response = self.client.get('http://testserver/posts/', HTTP_ACCEPT='application/msgpack',
+                                   **user_token(1, 'user1'))
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['count'], 5)
+
+
+# Tests for the write-behind buffer of the like marks
+@override_settings(LIKE_BUFFER=dict(settings.LIKE_BUFFER, ENABLED=True, FLUSH_INTERVAL=0, MAX_PENDING=100))
+class TestLikeBuffer(APITestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password=make_password('chat1597'), email='test_email1@gmail.com')
+        self.post1 = Post.objects.create(creator=user1, title='Post title', content='Post content')
+        self.post2 = Post.objects.create(creator=user1, title='Post title 2', content='Post content')
+
+    def tearDown(self):
+        like_buffer.stop_buffer()
+        clear_caches()
+
+    def mark(self, post, like):
+        response = self.client.post(reverse('change-mark'), {'post_id': post.id, 'like': like, 'unlike': 1 - like},
+                                    **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, 'Mark was not accepted')
+
+    def test_pendingMarksAreVisible(self):
+        self.mark(self.post1, 1)
+        self.assertFalse(self.post1.likes.exists(), 'Mark was written through')
+
+        response = self.client.get('http://testserver/post/{0}/'.format(self.post1.id), **user_token(1, 'user1'))
+        self.assertEqual((response.data['like'], response.data['likes_count']), (1, 1), 'Pending like is not seen')
+        response = self.client.get('http://testserver/posts/', **user_token(1, 'user1'))
+        post = [post for post in response.data['results'] if post['title'] == 'Post title'][0]
+        self.assertEqual((post['like'], post['likes_count']), (1, 1), 'Pending like is not seen in the list')
+
+        self.assertEqual(like_buffer.get_buffer().flush(), 1)
+        self.post1.refresh_from_db()
+        self.assertEqual(self.post1.likes_count, 1)
+        response = self.client.get('http://testserver/post/{0}/'.format(self.post1.id), **user_token(1, 'user1'))
+        self.assertEqual((response.data['like'], response.data['likes_count']), (1, 1), 'Like was counted twice')
+
+    def test_versionBumpedAfterDeltas(self):
+        self.mark(self.post1, 1)
+        buffer = like_buffer.get_buffer()
+        deltas = []
+
+        def receiver(sender, post_ids, **kwargs):
+            deltas.append(buffer.count_delta(self.post1.id))
+        likes_changed.connect(receiver)
+        try:
+            buffer.flush()
+        finally:
+            likes_changed.disconnect(receiver)
+        self.assertEqual(deltas, [0], 'Versions were bumped before the flushed marks left the deltas')
+
+    def test_flappingIsNotWritten(self):
+        for like in (1, 0, 1, 0):
+            self.mark(self.post1, like)
+        self.assertEqual(like_buffer.get_buffer().pending_count(), 0, 'Flapping marks were kept')
+
+        response = self.client.post(reverse('change-mark-batch'), [
+            {'post_id': self.post1.id, 'like': 1, 'unlike': 0}, {'post_id': self.post2.id, 'like': 0, 'unlike': 1},
+            {'post_id': 999, 'like': 1, 'unlike': 0}], format='json', **user_token(1, 'user1'))
+        self.assertEqual([result.get('Result', 'Error') for result in response.data['Result']],
+                         ['liked', 'unchanged', 'Error'])
+
+    def test_sizeThreshold(self):
+        with override_settings(LIKE_BUFFER=dict(settings.LIKE_BUFFER, MAX_PENDING=2)):
+            self.mark(self.post1, 1)
+            self.mark(self.post2, 1)
+            self.assertEqual(like_buffer.get_buffer().pending_count(), 0, 'Full buffer was not flushed')
+        self.assertEqual(Post.likes.through.objects.count(), 2)
+
+    def test_journalReplay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            options = dict(settings.LIKE_BUFFER, JOURNAL=os.path.join(directory, 'likes-{pid}.journal'))
+            with override_settings(LIKE_BUFFER=options):
+                # the journal of a crashed process
+                with open(os.path.join(directory, 'likes-1.journal'), 'w') as journal:
+                    journal.write(json.dumps([1, self.post1.id, 1]) + '\n')
+                self.mark(self.post2, 1)
+                self.assertTrue(self.post1.likes.exists(), 'Journaled mark was lost')
+                self.assertFalse(os.path.exists(os.path.join(directory, 'likes-1.journal')), 'Journal was kept')
+
+                # the journal of the running process is locked
+                with self.assertRaises(ImproperlyConfigured):
+                    like_buffer.LikeBuffer(options)
+                like_buffer.get_buffer().stop()
+                self.assertTrue(self.post2.likes.exists(), 'Pending mark was not written at the stop')
+
+    def test_sharedJournal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            options = dict(settings.LIKE_BUFFER, JOURNAL=os.path.join(directory, 'likes.journal'))
+            buffer = like_buffer.LikeBuffer(options)
+            try:
+                with self.assertRaises(ImproperlyConfigured):
+                    like_buffer.LikeBuffer(options)
+            finally:
+                buffer.stop()
+            # the journal is free after the stop
+            like_buffer.LikeBuffer(options).stop()
+
+
+# Tests for the "hot" order of the posts list
+class TestHotPosts(APITestCase):
+    def setUp(self):
+        users = [User.objects.create(username='user{0}'.format(i), password=make_password('chat1597'),
+                                     email='test_email{0}@gmail.com'.format(i)) for i in range(1, 21)]
+        for i in range(1, 6):
+            Post.objects.create(creator=users[0], title='Post title {0}'.format(i), content='Message {0}'.format(i))
+
+        # The oldest post is much more popular than the others
+        post1 = Post.objects.get(title='Post title 1')
+        Post.objects.filter(id=post1.id).update(date=post1.date - timedelta(hours=2))
+        post1 = Post.objects.get(id=post1.id)
+        for user in users:
+            post1.add_like(user)
+
+    def tearDown(self):
+        clear_caches()
+
+    def test_hotOrder(self):
+        response = self.client.get('http://testserver/posts/?order=hot', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
+        titles = [post['title'] for post in response.data['results']]
+        self.assertEqual(titles[0], 'Post title 1', 'Popular post is not the first')
+        self.assertEqual(titles[1:], ['Post title 5', 'Post title 4', 'Post title 3', 'Post title 2'])
+
+        response = self.client.get('http://testserver/posts/', **user_token(1, 'user1'))
+        self.assertEqual(response.data['results'][-1]['title'], 'Post title 1', 'Default order was changed')
+
+    def test_hotOrderWithCursor(self):
+        titles = []
+        url = 'http://testserver/posts/?order=hot&pagination=cursor&page_size=2'
+        while url:
+            response = self.client.get(url, **user_token(1, 'user1'))
+            titles += [post['title'] for post in response.data['results']]
+            url = response.data['links']['next']
+        self.assertEqual(titles, ['Post title 1', 'Post title 5', 'Post title 4', 'Post title 3', 'Post title 2'])
+
+
+# Tests for the opt-in keyset (cursor) pagination of the posts list
+class TestPostsCursorPagination(APITestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password=make_password('chat1597'), email='test_email1@gmail.com')
+
+        for i in range(1, 25):
+            Post.objects.create(creator=user1, title='Post title №{0}'.format(i), content='Message {0}'.format(i))
+
+        # Several posts with the same date check the tie-breaking by id
+        Post.objects.filter(id__in=[10, 11, 12, 13]).update(date=Post.objects.get(id=10).date)
+        self.expected = list(Post.objects.order_by('-date', '-id').values_list('title', flat=True))
+
+    def test_walkThroughPages(self):
+        titles = []
+        url = 'http://testserver/posts/?pagination=cursor&page_size=5'
+        while url:
+            response = self.client.get(url, **user_token(1, 'user1'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
+            self.assertNotIn('count', response.data, 'Full count was calculated')
+            titles += [post['title'] for post in response.data['results']]
+            url = response.data['links']['next']
+
+        self.assertEqual(titles, self.expected, 'Pages are inconsistent')
+
+    def test_previousPage(self):
+        response = self.client.get('http://testserver/posts/?pagination=cursor&page_size=5', **user_token(1, 'user1'))
+        self.assertIsNone(response.data['links']['previous'], 'First page has a previous link')
+        first_page = response.data['results']
+
+        response = self.client.get(response.data['links']['next'], **user_token(1, 'user1'))
+        self.assertEqual(response.data['results'][0]['title'], self.expected[5], 'Wrong second page')
+
+        response = self.client.get(response.data['links']['previous'], **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
+        self.assertEqual(response.data['results'], first_page, 'Previous page differs from the first one')
+        self.assertIsNotNone(response.data['links']['next'], 'Next link is lost')
+
+    def test_invalidCursor(self):
+        response = self.client.get('http://testserver/posts/?cursor=garbage', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, 'Invalid cursor was accepted')
+
+
+# Tests for the full-text search of the posts
+class TestPostsSearch(APITestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password=make_password('chat1597'), email='test_email1@gmail.com')
+        Post.objects.create(creator=user1, title='Cooking pasta', content='Boil the water and add some salt')
+        Post.objects.create(creator=user1, title='Travel notes', content='The pasta in Rome was great')
+        Post.objects.create(creator=user1, title='Gardening', content='Tomatoes need a lot of water')
+
+    def search(self, query):
+        response = self.client.get('http://testserver/posts/search/', {'q': query}, **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
+        return [post['title'] for post in response.data['results']]
+
+    def test_ranking(self):
+        # The match in the title is ranked higher
+        self.assertEqual(self.search('pasta'), ['Cooking pasta', 'Travel notes'])
+        self.assertEqual(self.search('water pasta'), ['Cooking pasta'], 'All terms have to match')
+
+    def test_indexSync(self):
+        post = Post.objects.get(title='Gardening')
+        post.content = 'Basil grows well near the window'
+        post.save()
+        self.assertEqual(self.search('tomatoes'), [], 'Old content is still indexed')
+        self.assertEqual(self.search('basil'), ['Gardening'], 'New content was not indexed')
+
+        post.delete()
+        self.assertEqual(self.search('basil'), [], 'Deleted post was found')
+
+    def test_pagination(self):
+        response = self.client.get('http://testserver/posts/search/', {'q': 'pasta', 'page_size': 1},
+                                   **user_token(1, 'user1'))
+        self.assertEqual(response.data['count'], 2)
+        self.assertIsNotNone(response.data['links']['next'])
+
+    def test_badQuery(self):
+        self.assertEqual(self.search('"pasta* ('), ['Cooking pasta', 'Travel notes'], 'Syntax was not escaped')
+        response = self.client.get('http://testserver/posts/search/', {'q': '  '}, **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, 'Empty query was accepted')
+
+
 # Tests for the exact post getting with existence check, and likes demonstration
 class TestPostRetrieving(APITestCase):
     def setUp(self):
@@ -180,6 +712,9 @@ class TestPostRetrieving(APITestCase):
         post1 = Post.objects.create(creator=user1, title='Post title', content='Post content')
         post1.likes.add(user2)
 
+    def tearDown(self):
+        clear_caches()
+
     def test_getWrongPost(self):
         response = self.client.get('http://testserver/post/27/', **user_token(2, 'user2'))
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, 'Wrong post was returned')
@@ -200,6 +735,144 @@ class TestPostRetrieving(APITestCase):
         self.assertEqual(result['like'], 0, 'Like exists, but it doesnt need to be there')
 
 
+# Tests for the /post/<pk>/ response cache and its invalidation
+class TestPostCache(APITestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password=make_password('chat1597'), email='test_email1@gmail.com')
+        User.objects.create(username='user2', password=make_password('chat1597'), email='test_email2@gmail.com')
+        Post.objects.create(creator=user1, title='Post title', content='Post content')
+
+    def tearDown(self):
+        clear_caches()
+
+    def post_queries(self, queries):
+        # the loads of the body, not the read of the change sequence number
+        return [query for query in queries if '"social_app_post"."title"' in query['sql']]
+
+    def test_cachedPost(self):
+        self.client.get('http://testserver/post/1/', **user_token(1, 'user1'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('http://testserver/post/1/', **user_token(2, 'user2'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
+        self.assertEqual(response.data['title'], 'Post title')
+        self.assertEqual(self.post_queries(queries), [], 'Cached post was loaded again')
+
+    def test_invalidation(self):
+        response = self.client.get('http://testserver/post/1/', **user_token(2, 'user2'))
+        self.assertEqual((response.data['likes_count'], response.data['like']), (0, 0))
+
+        self.client.post(reverse('change-mark'), {'post_id': 1, 'like': 1, 'unlike': 0}, **user_token(2, 'user2'))
+        response = self.client.get('http://testserver/post/1/', **user_token(2, 'user2'))
+        self.assertEqual((response.data['likes_count'], response.data['like']), (1, 1), 'Like is not seen')
+
+        # The shared body doesn't contain the like of another viewer
+        response = self.client.get('http://testserver/post/1/', **user_token(1, 'user1'))
+        self.assertEqual((response.data['likes_count'], response.data['like']), (1, 0), 'Viewer like leaked')
+
+        post = Post.objects.get(id=1)
+        post.title = 'New title'
+        post.save()
+        response = self.client.get('http://testserver/post/1/', **user_token(1, 'user1'))
+        self.assertEqual(response.data['title'], 'New title', 'Changed post was not invalidated')
+
+    def test_coalescedLoads(self):
+        flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        def load():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return 'post'
+
+        leader = threading.Thread(target=flight.do, args=(1, load))
+        leader.start()
+        started.wait()
+        results = []
+        followers = [threading.Thread(target=lambda: results.append(flight.do(1, load))) for _ in range(5)]
+        for thread in followers:
+            thread.start()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(len(calls), 1, 'Concurrent loads were not coalesced')
+        self.assertEqual(results, ['post'] * 5)
+
+
+# Tests for the conditional GET (ETag / Last-Modified) of the read endpoints
+class TestConditionalGet(APITestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password=make_password('chat1597'), email='test_email1@gmail.com')
+        User.objects.create(username='user2', password=make_password('chat1597'), email='test_email2@gmail.com')
+        for i in range(1, 4):
+            Post.objects.create(creator=user1, title='Post title {0}'.format(i), content='Post content')
+
+    def tearDown(self):
+        clear_caches()
+
+    def test_postsNotModified(self):
+        response = self.client.get('http://testserver/posts/', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Request failed')
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('http://testserver/posts/', HTTP_IF_NONE_MATCH=etag, **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED, 'Unchanged page was sent')
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse([query for query in queries if 'FROM "social_app_post" ORDER BY' in query['sql']],
+                         'Page query was run')
+
+        # Other viewer and other page have their own tags
+        response = self.client.get('http://testserver/posts/', HTTP_IF_NONE_MATCH=etag, **user_token(2, 'user2'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Page of another viewer was not sent')
+        response = self.client.get('http://testserver/posts/?page_size=1', HTTP_IF_NONE_MATCH=etag,
+                                   **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Another page was not sent')
+
+    def test_postsModified(self):
+        etag = self.client.get('http://testserver/posts/', **user_token(1, 'user1'))['ETag']
+
+        self.client.post(reverse('change-mark'), {'post_id': 1, 'like': 1, 'unlike': 0}, **user_token(2, 'user2'))
+        response = self.client.get('http://testserver/posts/', HTTP_IF_NONE_MATCH=etag, **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Like change was not noticed')
+        etag = response['ETag']
+
+        self.client.post(reverse('add-post'), {'title': 'New post', 'content': 'Post content'}, **user_token(2, 'user2'))
+        response = self.client.get('http://testserver/posts/', HTTP_IF_NONE_MATCH=etag, **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'New post was not noticed')
+
+    def test_postNotModified(self):
+        response = self.client.get('http://testserver/post/1/', **user_token(1, 'user1'))
+        etag = response['ETag']
+
+        response = self.client.get('http://testserver/post/1/', HTTP_IF_NONE_MATCH=etag, **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED, 'Unchanged post was sent')
+
+        self.client.post(reverse('change-mark'), {'post_id': 1, 'like': 1, 'unlike': 0}, **user_token(1, 'user1'))
+        response = self.client.get('http://testserver/post/1/', HTTP_IF_NONE_MATCH=etag, **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Changed post was not sent')
+        self.assertEqual(response.data['like'], 1)
+
+    def test_changeOfAnotherProcess(self):
+        # an UPDATE without the signals is what a process sees of the writes of the other processes
+        post_etag = self.client.get('http://testserver/post/1/', **user_token(1, 'user1'))['ETag']
+        posts_etag = self.client.get('http://testserver/posts/', **user_token(1, 'user1'))['ETag']
+        Post.objects.filter(id=1).update(title='New title', **changed())
+
+        response = self.client.get('http://testserver/post/1/', HTTP_IF_NONE_MATCH=post_etag, **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Changed post was not sent')
+        self.assertEqual(response.data['title'], 'New title', 'Cached body of the old version was sent')
+        response = self.client.get('http://testserver/posts/', HTTP_IF_NONE_MATCH=posts_etag, **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Changed page was not sent')
+
+    def test_wrongPostHasNoTag(self):
+        response = self.client.get('http://testserver/post/27/', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(response.has_header('ETag'), 'Error was tagged')
+
+
 # Tests for the like / unlike, with existing post check, fields validation
 class TestMarkChanging(APITestCase):
     def setUp(self):
@@ -246,7 +919,670 @@ class TestMarkChanging(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED, 'Mark was not changed')
         self.assertEqual(list(user1.liked_posts.all()), list(Post.objects.all()), 'Like was removed')
+        self.assertEqual(Post.objects.get(id=2).likes_count, 1, 'Likes counter was not increased')
+
+        # Repeated like doesn't change the counter
+        self.client.post(reverse('change-mark'), {'post_id': 2, 'like': 1, 'unlike': 0}, **user_token(1, 'user1'))
+        self.assertEqual(Post.objects.get(id=2).likes_count, 1, 'Repeated like was counted')
+
+        response = self.client.post(reverse('change-mark'),
+                                    {'post_id': 2, 'like': 0, 'unlike': 1},
+                                    **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, 'Mark was not changed')
+        self.assertEqual(Post.objects.get(id=2).likes_count, 0, 'Likes counter was not decreased')
+
+
+
+
+
+# Tests for the batch mark changing with per-item results
+class TestBatchMarkChanging(APITestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password=make_password('chat1597'), email='test_email1@gmail.com')
+
+        post1 = Post.objects.create(creator=user1, title='Post title 1', content='Post content')
+        Post.objects.create(creator=user1, title='Post title 2', content='Post content')
+        Post.objects.create(creator=user1, title='Post title 3', content='Post content')
+        post1.add_like(user1)
+
+    def test_FieldsValidating(self):
+        response = self.client.post(reverse('change-mark-batch'),
+                                    [{'post_id': 2, 'like': 1, 'unlike': 0}, {'post_id': 3, 'like': 1, 'unlike': 1}],
+                                    format='json', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, 'Equal marks were passed')
+        self.assertEqual(response.data['Error'][0], {}, 'Valid mark has errors')
+        self.assertEqual(Post.objects.get(id=2).likes_count, 0, 'Invalid batch was partly applied')
+
+        response = self.client.post(reverse('change-mark-batch'), {'post_id': 2, 'like': 1, 'unlike': 0},
+                                    format='json', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, 'Not a list was passed')
+
+    def test_BatchApplying(self):
+        marks = [
+            {'post_id': 1, 'like': 0, 'unlike': 1},
+            {'post_id': 2, 'like': 1, 'unlike': 0},
+            {'post_id': 3, 'like': 1, 'unlike': 0},
+            {'post_id': 3, 'like': 0, 'unlike': 1},
+            {'post_id': 2, 'like': 1, 'unlike': 0},
+            {'post_id': 27, 'like': 1, 'unlike': 0},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('change-mark-batch'), marks, format='json', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, 'Marks were not changed')
+
+        results = [item.get('Result', 'Error') for item in response.data['Result']]
+        self.assertEqual(results, ['unliked', 'liked', 'liked', 'unliked', 'unchanged', 'Error'], 'Wrong results')
+
+        user1 = User.objects.get(username='user1')
+        self.assertEqual(list(user1.liked_posts.values_list('id', flat=True)), [2], 'Wrong likes were stored')
+        self.assertEqual(list(Post.objects.order_by('id').values_list('likes_count', flat=True)), [0, 1, 0],
+                         'Likes counters are wrong')
+        self.assertLess(len(queries), 12, 'Marks are not written in bulk')
+
+
+# Tests for the Server-Timing header, the request log and the metrics endpoint
+@override_settings(EMAIL_VERIFICATION=FAKE_EMAIL_VERIFICATION)
+class TestInstrumentation(APITestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password=make_password('chat1597'), email='test_email1@gmail.com')
+        Post.objects.create(creator=user1, title='Post title 1', content='Post content')
+        metrics.reset()
+
+    def tearDown(self):
+        clear_caches()
+        breaker.reset()
+        metrics.reset()
+
+    def test_ServerTiming(self):
+        response = self.client.get(reverse('posts'), **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timing = {entry.split(';')[0]: entry for entry in response['Server-Timing'].split(', ')}
+        for phase in ('total', 'view', 'db', 'auth', 'paginate', 'serialize', 'render'):
+            self.assertIn(phase, timing, 'Phase {0} is not reported'.format(phase))
+        self.assertIn('queries"', timing['db'], 'Queries count is not reported')
+
+        with override_settings(INSTRUMENTATION=dict(settings.INSTRUMENTATION, SERVER_TIMING=False)):
+            response = self.client.get(reverse('posts'), **user_token(1, 'user1'))
+        self.assertFalse(response.has_header('Server-Timing'), 'Header was not disabled')
+
+    def test_EmailPhase(self):
+        response = self.client.post(reverse('register'), {'username': 'user7', 'password': 'testpass111',
+                                                          'email': 'test_email7@gmail.com'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn('email;dur=', response['Server-Timing'], 'Email service time is not reported')
+
+    def test_Log(self):
+        with self.assertLogs('rest_social.social_app.instrumentation', 'INFO') as logs:
+            self.client.get(reverse('post', args=[1]), **user_token(1, 'user1'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['endpoint'], 'GET post/<int:pk>/')
+        self.assertEqual(record['status'], 200)
+        self.assertIn('db_ms', record)
+        self.assertGreater(record['queries'], 0)
+
+    @override_settings(INSTRUMENTATION=dict(settings.INSTRUMENTATION, METRICS_TOKEN='metrics-token'))
+    def test_Metrics(self):
+        for _ in range(3):
+            self.client.get(reverse('posts'), **user_token(1, 'user1'))
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer metrics-token')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        histogram = response.data['Endpoints']['GET posts/']
+        self.assertEqual(histogram['count'], 3)
+        self.assertEqual(histogram['buckets_ms']['+Inf'], 3, 'Buckets are not cumulative')
+        self.assertIn('queries', histogram['sum'])
+
+        # the local address of a proxy isn't enough
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, 'Metrics are public')
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong-token')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, 'Wrong token was accepted')
+
+    def test_MetricsWithoutToken(self):
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer ')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, 'Metrics are on without a token')
+
+
+# Tests for the on-demand profiling of the requests
+class TestProfiling(APITestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password=make_password('chat1597'), email='test_email1@gmail.com')
+        Post.objects.create(creator=user1, title='Post title 1', content='Post content')
+        self.directory = tempfile.TemporaryDirectory()
+        self.profiling = override_settings(PROFILING={'TOKEN': 'secret', 'SAMPLE_RATE': 0,
+                                                      'DIRECTORY': self.directory.name})
+        self.profiling.enable()
+
+    def tearDown(self):
+        self.profiling.disable()
+        self.directory.cleanup()
+        clear_caches()
+
+    def test_Header(self):
+        response = self.client.get(reverse('posts'), HTTP_X_PROFILE='wrong', **user_token(1, 'user1'))
+        self.assertFalse(response.has_header('X-Profile'), 'Request with a wrong token was profiled')
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+        response = self.client.get(reverse('posts'), HTTP_X_PROFILE='secret', **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        name = response['X-Profile']
+        self.assertTrue(name.endswith('-posts.prof'))
+
+        stats = pstats.Stats(os.path.join(self.directory.name, name))
+        self.assertTrue(any(function == 'get_all_posts_view' for _, _, function in stats.stats),
+                        'View is not in the profile')
+        with open(os.path.join(self.directory.name, name[:-len('.prof')] + '.json')) as meta:
+            meta = json.load(meta)
+        self.assertEqual(meta['endpoint'], 'GET posts/')
+        self.assertTrue(any('FROM "social_app_post"' in query['sql'] for query in meta['queries']),
+                        'Queries are not attached')
+
+    def test_Sampling(self):
+        with override_settings(PROFILING=dict(settings.PROFILING, TOKEN=None, SAMPLE_RATE=1)):
+            response = self.client.get(reverse('post', args=[1]), **user_token(1, 'user1'))
+        self.assertTrue(response['X-Profile'].endswith('-post.prof'), 'Sampled request was not profiled')
+
+    def test_Disabled(self):
+        with override_settings(PROFILING=dict(settings.PROFILING, TOKEN=None, SAMPLE_RATE=0)):
+            response = self.client.get(reverse('posts'), HTTP_X_PROFILE='secret', **user_token(1, 'user1'))
+        self.assertFalse(response.has_header('X-Profile'), 'Disabled profiler was run')
+
+
+# Request through the ASGI application, returns (status, headers, body)
+async def asgi_request(application, method, path, data=None, headers=()):
+    body = json.dumps(data).encode('utf-8') if data is not None else b''
+    scope = {'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http', 'path': path,
+             'query_string': b'', 'root_path': '', 'server': ('testserver', 80), 'client': ('127.0.0.1', 5000),
+             'headers': [(b'host', b'testserver'), (b'content-type', b'application/json'),
+                         (b'content-length', str(len(body)).encode('ascii'))] + list(headers)}
+    communicator = ApplicationCommunicator(application, scope)
+    await communicator.send_input({'type': 'http.request', 'body': body})
+    start = await communicator.receive_output(10)
+    content = b''
+    while True:
+        message = await communicator.receive_output(10)
+        content += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return start['status'], dict(start['headers']), content
+
+
+# Tests for the ASGI deployment: native async registration, the rest on the sync pool
+@override_settings(EMAIL_VERIFICATION=dict(FAKE_EMAIL_VERIFICATION, OPTIONS=dict(FAKE_EMAIL_VERIFICATION['OPTIONS'],
+                                                                                 DELAY=0.3)),
+                   PASSWORD_HASHING=dict(settings.PASSWORD_HASHING, ITERATIONS=1000, WORKERS=0))
+class TestAsyncViews(TransactionTestCase):
+    def setUp(self):
+        # the ids aren't reset between the transaction tests
+        self.user1 = User.objects.create(username='user1', password=make_password('chat1597'),
+                                         email='test_email1@gmail.com')
+        self.post1 = Post.objects.create(creator=self.user1, title='Post title 1', content='Post content')
+        self.application = AsyncHandler()
+
+    def tearDown(self):
+        clear_caches()
+        breaker.reset()
+
+    def register(self, number, email=None):
+        return asgi_request(self.application, 'POST', '/register/', {
+            'username': 'user{0}'.format(number), 'password': 'testpass111',
+            'email': email or 'test_email{0}@gmail.com'.format(number)})
+
+    def test_Registration(self):
+        status_code, _, content = asyncio.run(self.register(7))
+        self.assertEqual(status_code, status.HTTP_201_CREATED, content)
+        self.assertEqual(json.loads(content), {'Result': 'User user7 was successfully added'})
+        user = User.objects.get(username='user7')
+        self.assertTrue(user.is_active)
+        self.assertTrue(user.check_password('testpass111'), 'Password was not hashed')
+
+        status_code, _, content = asyncio.run(self.register(8, 'test_email1@gmail.com'))
+        self.assertEqual(status_code, status.HTTP_400_BAD_REQUEST, 'Existing email was accepted')
+        status_code, _, content = asyncio.run(self.register(9, 'user9@false.com'))
+        self.assertEqual(status_code, status.HTTP_400_BAD_REQUEST, 'Undeliverable email was accepted')
+        self.assertEqual(json.loads(content), {'email': 'Email is undeliverable'})
+
+        status_code, _, content = asyncio.run(self.register(10, 'user10@down.com'))
+        self.assertEqual(status_code, status.HTTP_201_CREATED)
+        self.assertIn('Email', json.loads(content), 'Unverified user is not pending')
+
+    def test_ConcurrentVerification(self):
+        async def register_many():
+            return await asyncio.gather(*(self.register(number) for number in range(10, 16)))
+
+        started = time.monotonic()
+        responses = asyncio.run(register_many())
+        self.assertEqual([status_code for status_code, _, _ in responses], [status.HTTP_201_CREATED] * 6)
+        # six 0.3s checks of the email service are awaited at once
+        self.assertLess(time.monotonic() - started, 1.2, 'Email checks were serialized')
+
+    def test_SyncViews(self):
+        token = user_token(self.user1.id, 'user1')['HTTP_token']
+        status_code, headers, content = asyncio.run(asgi_request(
+            self.application, 'GET', '/post/{0}/'.format(self.post1.id), headers=[(b'token', token.encode('utf-8'))]))
+        self.assertEqual(status_code, status.HTTP_200_OK, content)
+        self.assertEqual(json.loads(content)['title'], 'Post title 1')
+        self.assertIn(b'Server-Timing', headers, 'Middleware was not run')
+
+        status_code, _, _ = asyncio.run(asgi_request(self.application, 'GET', '/posts/'))
+        self.assertEqual(status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_StreamingExport(self):
+        # the export queries run lazily while the body is sent, outside the event loop
+        self.post1.add_like(self.user1)
+        token = user_token(self.user1.id, 'user1')['HTTP_token']
+        status_code, headers, content = asyncio.run(asgi_request(
+            self.application, 'GET', '/posts/export/', headers=[(b'token', token.encode('utf-8'))]))
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(headers[b'Content-Type'], b'application/x-ndjson')
+        records = [json.loads(line) for line in content.decode('utf-8').splitlines()]
+        self.assertEqual(records[-1], {'type': 'end', 'posts': 1, 'likes': 1})
+
+
+# Tests for the NDJSON export of the posts and likes
+class TestPostsExport(APITestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password=make_password('chat1597'), email='test_email1@gmail.com')
+        user2 = User.objects.create(username='user2', password=make_password('chat1597'), email='test_email2@gmail.com')
+        for i in range(1, 4):
+            Post.objects.create(creator=user1, title='Post title {0}'.format(i), content='Post content')
+        Post.objects.get(id=1).add_like(user2)
+        Post.objects.get(id=3).add_like(user1)
+        Post.objects.get(id=3).add_like(user2)
+        Post.objects.filter(id__in=[1, 2]).update(updated=django_timezone.now() - timedelta(days=2))
+
+    def tearDown(self):
+        clear_caches()
+
+    def export(self, params=None):
+        response = self.client.get(reverse('posts-export'), params or {}, **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming, 'Export is not streamed')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+
+    def test_FullExport(self):
+        records = self.export()
+        self.assertEqual(records[0]['type'], 'export')
+        self.assertIsNone(records[0]['since'])
+        self.assertEqual(records[-1], {'type': 'end', 'posts': 3, 'likes': 3})
+
+        posts = [record for record in records if record['type'] == 'post']
+        self.assertEqual([post['id'] for post in posts], [1, 2, 3], 'Posts are not ordered by the change time')
+        self.assertEqual(posts[2]['likes_count'], 2)
+        self.assertEqual(posts[2]['creator'], 1)
+        likes = [(record['post_id'], record['user_id']) for record in records if record['type'] == 'like']
+        self.assertEqual(likes, [(1, 2), (3, 1), (3, 2)])
+
+        records = self.export({'likes': '0'})
+        self.assertFalse(any(record['type'] == 'like' for record in records), 'Likes were exported')
+
+    def test_IncrementalExport(self):
+        since = (django_timezone.now() - timedelta(days=1)).isoformat()
+        records = self.export({'since': since})
+        self.assertEqual([record['id'] for record in records if record['type'] == 'post'], [3])
+        self.assertEqual(records[-1], {'type': 'end', 'posts': 1, 'likes': 2})
+
+        # a like changes the post
+        Post.objects.get(id=2).add_like(User.objects.get(id=2))
+        records = self.export({'since': records[0]['until']})
+        self.assertEqual([record['id'] for record in records if record['type'] == 'post'], [2])
+
+    def test_Validation(self):
+        response = self.client.get(reverse('posts-export'), {'since': 'yesterday'}, **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('posts-export'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_Chunking(self):
+        blocks = list(export_lines(chunk_size=2))
+        # the header, three blocks of two rows (3 posts and 3 likes) and the end
+        self.assertEqual(len(blocks), 5, 'Rows are not written by blocks')
+        self.assertEqual(sum(block.count('\n') for block in blocks), 8)
+
+
+# Tests for the delta sync of the posts
+class TestDeltaSync(APITestCase):
+    def setUp(self):
+        user1 = User.objects.create(username='user1', password=make_password('chat1597'), email='test_email1@gmail.com')
+        User.objects.create(username='user2', password=make_password('chat1597'), email='test_email2@gmail.com')
+        for i in range(1, 4):
+            Post.objects.create(creator=user1, title='Post title {0}'.format(i), content='Post content')
+
+    def tearDown(self):
+        clear_caches()
+
+    def changes(self, params=None, user_id=1, username='user1'):
+        response = self.client.get(reverse('posts-changes'), params or {}, **user_token(user_id, username))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_FullSync(self):
+        data = self.changes()
+        self.assertEqual([post['id'] for post in data['changes']], [1, 2, 3])
+        self.assertEqual(data['changes'][0], {'id': 1, 'creator': 1, 'title': 'Post title 1', 'content': 'Post content',
+                                              'date': data['changes'][0]['date'], 'likes_count': 0, 'like': 0})
+        self.assertFalse(data['more'])
+        self.assertEqual(self.changes({'since': data['token']})['changes'], [], 'Unchanged posts were returned')
+
+    def test_IncrementalSync(self):
+        token = self.changes()['token']
+        Post.objects.get(id=2).add_like(User.objects.get(id=1))
+        response = self.client.post(reverse('add-post'), {'title': 'New title', 'content': 'New content'},
+                                    **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        data = self.changes({'since': token})
+        self.assertEqual([post['id'] for post in data['changes']], [2, 4], 'Posts are not in the change order')
+        self.assertEqual(data['changes'][0]['likes_count'], 1)
+        self.assertEqual(data['changes'][0]['like'], 1)
+        self.assertEqual(self.changes({'since': token}, 2, 'user2')['changes'][0]['like'], 0)
+
+        # the post changed again comes after the others once
+        token = data['token']
+        Post.objects.get(id=1).add_like(User.objects.get(id=2))
+        Post.objects.get(id=2).remove_like(User.objects.get(id=1))
+        data = self.changes({'since': token})
+        self.assertEqual([post['id'] for post in data['changes']], [1, 2])
+
+    def test_Limit(self):
+        data = self.changes({'limit': 2})
+        self.assertEqual([post['id'] for post in data['changes']], [1, 2])
+        self.assertTrue(data['more'])
+        data = self.changes({'since': data['token'], 'limit': 2})
+        self.assertEqual([post['id'] for post in data['changes']], [3])
+        self.assertFalse(data['more'])
+
+    def test_sameSequence(self):
+        # the posts changed by one statement share the sequence number and are paged by id
+        Post.objects.all().touch()
+        token = self.changes({'limit': 3})['token']
+        self.assertEqual(len(set(Post.objects.values_list('change_seq', flat=True))), 1)
+        Post.objects.all().touch()
+        data = self.changes({'since': token, 'limit': 2})
+        self.assertEqual([post['id'] for post in data['changes']], [1, 2])
+        data = self.changes({'since': data['token'], 'limit': 2})
+        self.assertEqual([post['id'] for post in data['changes']], [3])
+
+    def test_Validation(self):
+        for params in ({'since': 'garbage'}, {'since': 'eyJjIjpbMV19'}, {'limit': '0'}, {'limit': 'ten'}):
+            response = self.client.get(reverse('posts-changes'), params, **user_token(1, 'user1'))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+        response = self.client.get(reverse('posts-changes'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_changeIndex(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.changes({'since': self.changes({'limit': 1})['token']})
+        plan = connection.cursor().execute('EXPLAIN QUERY PLAN ' + next(
+            query['sql'] for query in queries.captured_queries if 'change_seq' in query['sql'])).fetchall()
+        self.assertIn('social_app_post_change_id_idx', str(plan), 'Changes are not read by the index')
+
+
+def parse_frame(message):
+    # fields of one server-sent event (or of the retry / heartbeat frame)
+    lines = message.get('body', b'').decode('utf-8').splitlines()
+    return dict(line.split(': ', 1) for line in lines if line and not line.startswith(':'))
+
+
+# Tests for the server-sent events of the new posts and the likes counters
+@override_settings(EVENTS=dict(settings.EVENTS, HEARTBEAT=0.2, QUEUE_SIZE=3, HISTORY=5))
+class TestEvents(TransactionTestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username='user1', password=make_password('chat1597'),
+                                         email='test_email1@gmail.com')
+        self.token = user_token(self.user1.id, 'user1')['HTTP_token'].encode('utf-8')
+        self.application = AsyncHandler()
+
+    def tearDown(self):
+        events.reset_hub(setting='EVENTS')
+        clear_caches()
+
+    async def open_stream(self, headers=None, query_string=b''):
+        scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'path': '/events/',
+                 'query_string': query_string, 'root_path': '', 'server': ('testserver', 80),
+                 'client': ('127.0.0.1', 5000),
+                 'headers': [(b'host', b'testserver')] + (headers if headers is not None else [(b'token', self.token)])}
+        communicator = ApplicationCommunicator(self.application, scope)
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        start = await communicator.receive_output(5)
+        return communicator, start
+
+    async def close_stream(self, communicator):
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(5)
+
+    def test_Stream(self):
+        async def scenario():
+            communicator, start = await self.open_stream()
+            self.assertEqual(start['status'], status.HTTP_200_OK)
+            self.assertEqual(dict(start['headers'])[b'Content-Type'], b'text/event-stream')
+            self.assertEqual(parse_frame(await communicator.receive_output(5)), {'retry': '3000'})
+
+            post = await run_sync(Post.objects.create, creator=self.user1, title='Post title', content='Content')
+            frame = parse_frame(await communicator.receive_output(5))
+            self.assertEqual(frame['event'], 'post')
+            self.assertEqual(json.loads(frame['data'])['title'], 'Post title')
+            self.assertEqual(json.loads(frame['data'])['likes_count'], 0)
+
+            await run_sync(post.add_like, self.user1)
+            frame = parse_frame(await communicator.receive_output(5))
+            self.assertEqual(frame['event'], 'likes')
+            self.assertEqual(json.loads(frame['data']), {'id': post.id, 'likes_count': 1})
+
+            # the heartbeat keeps the idle stream open
+            self.assertEqual((await communicator.receive_output(5))['body'], b': ping\n\n')
+            await self.close_stream(communicator)
+            self.assertEqual(events.get_hub().connections(), 0, 'Closed stream is still subscribed')
+
+        asyncio.run(scenario())
+
+    def test_Resume(self):
+        async def publish(hub, count):
+            for number in range(count):
+                hub.publish([('likes', {'id': number, 'likes_count': number})])
+
+        async def scenario():
+            communicator, _ = await self.open_stream()
+            await communicator.receive_output(5)
+            hub = events.get_hub()
+            await publish(hub, 3)
+            ids = [parse_frame(await communicator.receive_output(5))['id'] for _ in range(3)]
+            await self.close_stream(communicator)
+
+            # the events after Last-Event-ID are sent first
+            communicator, _ = await self.open_stream([(b'token', self.token), (b'last-event-id', ids[0].encode())])
+            await communicator.receive_output(5)
+            self.assertEqual([parse_frame(await communicator.receive_output(5))['id'] for _ in range(2)], ids[1:])
+            await self.close_stream(communicator)
+
+            # the history keeps 5 events, the older position is lost
+            await publish(hub, 5)
+            communicator, _ = await self.open_stream(query_string='token={0}&last_event_id={1}'.format(
+                self.token.decode('ascii'), ids[0]).encode('ascii'))
+            await communicator.receive_output(5)
+            self.assertEqual(parse_frame(await communicator.receive_output(5))['event'], 'reset')
+            await self.close_stream(communicator)
+
+        asyncio.run(scenario())
+
+    def test_Backpressure(self):
+        async def scenario():
+            communicator, _ = await self.open_stream()
+            await communicator.receive_output(5)
+            hub = events.get_hub()
+            # the stream doesn't get to run, while the 5 events are published
+            for number in range(5):
+                hub.publish([('likes', {'id': number, 'likes_count': number})])
+            message = await communicator.receive_output(5)
+            self.assertEqual(message, {'type': 'http.response.body'}, 'Stream was not closed')
+            await communicator.wait(5)
+            self.assertEqual(hub.connections(), 0)
+
+        asyncio.run(scenario())
+
+    def test_Validation(self):
+        async def scenario():
+            _, start = await self.open_stream([])
+            self.assertEqual(start['status'], status.HTTP_403_FORBIDDEN)
+            _, start = await self.open_stream([(b'token', self.token), (b'last-event-id', b'abc')])
+            self.assertEqual(start['status'], status.HTTP_400_BAD_REQUEST)
+            with override_settings(EVENTS=dict(settings.EVENTS, MAX_CONNECTIONS=1)):
+                communicator, _ = await self.open_stream()
+                _, start = await self.open_stream()
+                self.assertEqual(start['status'], status.HTTP_503_SERVICE_UNAVAILABLE)
+                await self.close_stream(communicator)
+
+        asyncio.run(scenario())
+
+    @override_settings(EVENTS=dict(settings.EVENTS, BACKEND='rest_social.social_app.events.DatabaseBackend',
+                                   POLL_INTERVAL=0))
+    def test_DatabaseBackend(self):
+        # two processes: the publishing one has no streams
+        publisher, hub = events.get_hub(), events.EventHub(settings.EVENTS)
+        hub.start()
+        Post.objects.create(creator=self.user1, title='Post title', content='Content')
+        publisher.publish([('likes', {'id': 1, 'likes_count': 1})])
+        self.assertEqual(hub.backend.poll(), 2, 'Events were not fanned out')
+
+        loop = asyncio.new_event_loop()
+        try:
+            _, missed = hub.subscribe(loop, 0)
+        finally:
+            loop.close()
+        self.assertEqual([parse_frame({'body': frame})['event'] for frame in missed], ['post', 'likes'])
+
+
+# Tests for the home timeline and the following
+@override_settings(FEED=dict(settings.FEED, FANOUT_LIMIT=1))
+class TestFeed(APITestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username='user{0}'.format(i), password=make_password('chat1597'),
+                                          email='test_email{0}@gmail.com'.format(i)) for i in range(1, 5)]
+
+    def tearDown(self):
+        clear_caches()
+
+    def follow(self, user, author, follow=1):
+        return self.client.post(reverse('follow'), {'author_id': author.id, 'follow': follow},
+                                **user_token(user.id, user.username))
+
+    def feed(self, user, params=None):
+        response = self.client.get(reverse('feed'), params or {}, **user_token(user.id, user.username))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_Follow(self):
+        user1, user2 = self.users[:2]
+        response = self.follow(user1, user2)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'Result': 'Author was followed'})
+        self.assertEqual(self.follow(user1, user2).data, {'Result': 'Author is already followed'})
+        self.assertEqual(self.follow(user1, user2, 0).data, {'Result': 'Author was unfollowed'})
+
+        self.assertEqual(self.follow(user1, user1).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.follow(user1, User(id=100)).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.follow(user1, user2, 2).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(reverse('feed')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_Feed(self):
+        user1, user2, user3, user4 = self.users
+        self.follow(user1, user2)
+        # user3 has two followers, so the posts are read at the feed time
+        self.follow(user1, user3)
+        self.follow(user4, user3)
+        titles = []
+        for number in range(6):
+            author = (user1, user2, user3, user4)[number % 4]
+            Post.objects.create(creator=author, title='Post {0}'.format(number), content='Content')
+            titles.append('Post {0}'.format(number))
+        Post.objects.get(title='Post 2').add_like(user1)
+
+        data = self.feed(user1, {'page_size': 2})
+        self.assertEqual([post['title'] for post in data['results']], ['Post 5', 'Post 4'])
+        data = self.client.get(data['links']['next'], **user_token(user1.id, 'user1')).data
+        self.assertEqual([post['title'] for post in data['results']], ['Post 2', 'Post 1'])
+        self.assertEqual(data['results'][0]['like'], 1)
+        self.assertEqual(data['results'][0]['likes_count'], 1)
+        data = self.client.get(data['links']['next'], **user_token(user1.id, 'user1')).data
+        self.assertEqual([post['title'] for post in data['results']], ['Post 0'])
+        self.assertIsNone(data['links']['next'])
+
+        # back to the previous page
+        data = self.client.get(data['links']['previous'], **user_token(user1.id, 'user1')).data
+        self.assertEqual([post['title'] for post in data['results']], ['Post 2', 'Post 1'])
+
+        self.assertEqual([post['title'] for post in self.feed(user4)['results']], ['Post 3', 'Post 2'])
+        self.assertEqual([list(post) for post in self.feed(user2, {'fields': 'title'})['results']], [['title']] * 2)
+
+    def test_timelineScan(self):
+        self.follow(self.users[0], self.users[1])
+        Post.objects.create(creator=self.users[1], title='Post', content='Content')
+        with CaptureQueriesContext(connection) as queries:
+            self.feed(self.users[0])
+        timeline = next(query['sql'] for query in queries.captured_queries
+                        if 'social_app_timelineentry' in query['sql'])
+        plan = str(connection.cursor().execute('EXPLAIN QUERY PLAN ' + timeline).fetchall())
+        self.assertIn('social_app_timelineentry USING COVERING INDEX', plan, 'Timeline is not read by its key')
+        self.assertNotIn('TEMP B-TREE', plan, 'Timeline is sorted')
+
+
+# Tests for the batch retrieval of the posts
+class TestPostsBatch(APITestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username='user1', password=make_password('chat1597'),
+                                         email='test_email1@gmail.com')
+        self.posts = [Post.objects.create(creator=self.user1, title='Post title {0}'.format(i), content='Content')
+                      for i in range(1, 51)]
+        self.posts[1].add_like(self.user1)
+
+    def tearDown(self):
+        clear_caches()
+
+    def batch(self, ids, params=None):
+        response = self.client.get(reverse('posts-batch'), dict(params or {}, ids=ids), **user_token(1, 'user1'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response.data['results']
+
+    def test_Batch(self):
+        first, second = self.posts[:2]
+        results = self.batch('{0},100,{1},{0}'.format(second.id, first.id))
+        self.assertEqual([result['id'] for result in results], [second.id, 100, first.id, second.id])
+        self.assertEqual(results[1], {'id': 100, 'Error': 'Post with id "100" does not exist'})
+        # the same body as /post/POST_ID
+        response = self.client.get(reverse('post', args=[second.id]), **user_token(1, 'user1'))
+        self.assertEqual(results[0], dict(response.data, id=second.id))
+        self.assertEqual((results[0]['likes_count'], results[0]['like']), (1, 1))
+        self.assertEqual((results[2]['likes_count'], results[2]['like']), (0, 0))
+
+        self.assertEqual(self.batch(str(first.id), {'fields': 'title'}), [{'id': first.id, 'title': 'Post title 1'}])
 
+    def test_fixedQueries(self):
+        counts = []
+        for ids in (self.posts[:3], self.posts):
+            clear_caches()
+            with CaptureQueriesContext(connection) as queries:
+                self.batch(','.join(str(post.id) for post in ids))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1], 'Queries grow with the number of the posts')
 
+        # the cached bodies aren't loaded again
+        with CaptureQueriesContext(connection) as queries:
+            self.batch(','.join(str(post.id) for post in self.posts))
+        self.assertFalse([query for query in queries if '"social_app_post"."title"' in query['sql']])
 
+    def test_coldCache(self):
+        clear_caches()
+        cache = caches['posts']
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many, \
+                mock.patch.object(cache, 'add', wraps=cache.add) as add:
+            self.batch(','.join(str(post.id) for post in self.posts[:10]) + ',1000,1001')
+        self.assertEqual((get_many.call_count, add.call_count), (1, 0), 'Posts were looked up one by one')
+        # only the bodies are kept, nothing for the missing posts
+        self.assertEqual(len(cache._cache), 10, 'Cache has keys of the missing posts')
 
+    def test_Validation(self):
+        for ids in ('', '1,a', ','.join(['1'] * 101)):
+            response = self.client.get(reverse('posts-batch'), {'ids': ids}, **user_token(1, 'user1'))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, ids)
+        response = self.client.get(reverse('posts-batch'), {'ids': '1'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -1,13 +1,24 @@
 from django.urls import path
 from django.conf.urls import url
-from .views import register_user_view, login_view, add_post_view, get_all_posts_view, get_post_view, set_mark_view
+from .views import register_user_view, login_view, add_post_view, get_all_posts_view, get_post_view, set_mark_view, \
+    set_marks_batch_view, search_posts_view, export_posts_view, post_changes_view, \
+    feed_view, follow_view, get_posts_batch_view, metrics_view, logout_view
 
 urlpatterns = [
     path('register/', register_user_view, name='register'),
     path('login/', login_view, name='login'),
+    path('logout/', logout_view, name='logout'),
     path('add-post/', add_post_view, name='add-post'),
     path('posts/', get_all_posts_view, name='posts'),
+    path('posts/search/', search_posts_view, name='posts-search'),
+    path('posts/export/', export_posts_view, name='posts-export'),
+    path('posts/changes/', post_changes_view, name='posts-changes'),
+    path('posts/batch/', get_posts_batch_view, name='posts-batch'),
     # url(r'^get-post/(?P<pk>\d+)$', get_post_view, name='get-post'),
     path('post/<int:pk>/', get_post_view, name='post'),
-    path('change-mark/', set_mark_view, name='change-mark')
+    path('change-mark/', set_mark_view, name='change-mark'),
+    path('change-mark/batch/', set_marks_batch_view, name='change-mark-batch'),
+    path('feed/', feed_view, name='feed'),
+    path('follow/', follow_view, name='follow'),
+    path('metrics/', metrics_view, name='metrics')
 ]
@@ -0,0 +1,21 @@
+"""
+Helpers shared by the bulk writes of the app and of its management commands.
+"""
+from django.db import connection
+
+
+def insert_batch_size(fields, batch_size):
+    # Django 3.0 doesn't cap an explicit batch_size by the backend limits (500 rows of a compound SELECT on SQLite)
+    return max(1, min(batch_size, connection.ops.bulk_batch_size(fields, [None] * batch_size)))
+
+
+def lock_for_writes(connection, table):
+    """
+    Takes the write lock of the SQLite database in the current transaction at once, as the IMMEDIATE transactions
+    of the production profile do at BEGIN, so what is read afterwards (e.g. the next free id) stays valid until
+    the commit: the other writers wait for it.
+    """
+    if connection.vendor == 'sqlite' and not getattr(connection, 'transaction_mode', None):
+        with connection.cursor() as cursor:
+            # an UPDATE takes the lock, even if it changes nothing
+            cursor.execute('UPDATE {0} SET id = id WHERE 0'.format(connection.ops.quote_name(table)))
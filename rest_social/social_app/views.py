@@ -1,17 +1,57 @@
+from django.conf import settings
+from django.db import router
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
-from rest_framework.decorators import api_view, permission_classes, authentication_classes
+from rest_framework.decorators import api_view, permission_classes, authentication_classes, renderer_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.exceptions import ParseError
-from django.contrib.auth.hashers import make_password
+from rest_framework.exceptions import ParseError, PermissionDenied
 from django.db.models import Value, IntegerField
 from rest_framework.views import status
 from rest_social.settings import SECRET_KEY
 from .serializers import UserSerializer, LoginSerializer, PostSerializer, PostsOutputSerializer, PostOutputSerializer, MarkSerializer
+from .serializers import FollowSerializer, PostChangeSerializer
+from .serializers import POST_FIELDS, POSTS_FIELDS, model_columns, requested_fields, row_serializer
 from .models import User, Post
-from .authentication import TokenAuthentication
-from .pagination import CustomPagination
-import jwt, json
+from .authentication import TokenAuthentication, invalidate_user_tokens, token_payload
+from .email_verification import DELIVERABLE, schedule_verification
+from .hashing import HashingUnavailable, hash_password, verify_password
+from .conditional import conditional_response, post_validators, posts_validators, set_validators
+from .post_cache import get_post_data, get_posts_data
+from .search import fts_query, search_posts
+from .export import export_lines, parse_since
+from .feed import FeedPagination, feed_sources, follow, unfollow
+from .delta_sync import changed_posts, decode_token, parse_limit
+from .instrumentation import metrics
+from .pagination import CustomPagination, KeysetPagination, cursor_pagination_requested
+from .renderers import FAST_RENDERER_CLASSES
+from .like_buffer import get_buffer
+import hmac, jwt, json
+
+
+MAX_MARKS_BATCH = 500
+MAX_POSTS_BATCH = 100
+HOT_ORDERING = ('-hot_score', '-id')
+
+
+def busy_response():
+    return Response(data={'Error': 'Server is busy, try again later'}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={'Retry-After': '1'})
+
+
+def viewer_likes(user, rows, like=True):
+    # ids of the values() rows liked by the user (with `like`), the likes counters of the rows are corrected
+    # by the pending marks of the like buffer, so they are seen at once
+    post_ids = [row['id'] for row in rows]
+    liked_ids = Post.liked_among(user, post_ids) if like else set()
+    buffer = get_buffer()
+    if buffer is not None:
+        if like:
+            liked_ids = buffer.visible_likes(user.id, post_ids, liked_ids)
+        for row in rows:
+            if 'likes_count' in row:
+                row['likes_count'] += buffer.count_delta(row['id'])
+    return liked_ids
 
 
 # Create your views here.
@@ -21,14 +61,22 @@ def register_user_view(request):
     try:
         serialized = UserSerializer(data=request.data, context={'request': request})
         if serialized.is_valid():
-            User.objects.create(username=serialized.validated_data['username'],
-                                password=make_password(serialized.validated_data['password']),
-                                email=serialized.validated_data['email'])
+            # the user stays inactive until the email is verified
+            pending = serialized.email_verdict != DELIVERABLE
+            user = User.objects.create(username=serialized.validated_data['username'],
+                                       password=hash_password(serialized.validated_data['password']),
+                                       email=serialized.validated_data['email'],
+                                       is_active=not pending)
             data = {"Result": "User {0} was successfully added".format(serialized.data['username'])}
+            if pending:
+                schedule_verification(user.id)
+                data['Email'] = 'Email verification is pending'
             status_code = status.HTTP_201_CREATED
         else:
             data = {key: str(value[0]) for key, value in serialized.errors.items()}
             status_code = status.HTTP_400_BAD_REQUEST
+    except HashingUnavailable:
+        return busy_response()
     except Exception as e:
         data = {'Error': 'Ensure in the username, password and email existence \n' + str(e)}
         status_code = status.HTTP_400_BAD_REQUEST
@@ -42,12 +90,11 @@ def login_view(request):
         serialized = LoginSerializer(data=request.data, many=False)
         if serialized.is_valid():
             user = User.objects.get(username=serialized.validated_data['username'])
-            if not user.check_password(serialized.validated_data['password']):
+            if not verify_password(user, serialized.validated_data['password']):
                 raise User.DoesNotExist
-            payload = {
-                'id': user.id,
-                'username': user.username
-            }
+            if not user.is_active:
+                raise PermissionDenied('Email of the user is not verified yet')
+            payload = token_payload(user)
             jwt_token = {'token': jwt.encode(payload, SECRET_KEY).decode('utf-8')}
             data = jwt_token
             status_code = status.HTTP_200_OK
@@ -57,19 +104,32 @@ def login_view(request):
     except User.DoesNotExist:
         data = {'Error': 'Wrong user credentials!'}
         status_code = status.HTTP_400_BAD_REQUEST
+    except PermissionDenied as e:
+        data = {'Error': str(e.detail)}
+        status_code = status.HTTP_403_FORBIDDEN
+    except HashingUnavailable:
+        return busy_response()
     except ParseError:
         data = {'Error': 'Bad request'}
         status_code = status.HTTP_400_BAD_REQUEST
     return Response(data=data, status=status_code)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated, ])
+@authentication_classes([TokenAuthentication, ])
+def logout_view(request):
+    # the tokens are stateless, so all the tokens of the user are revoked
+    invalidate_user_tokens(request.user)
+    data = {'Result': 'User {0} was logged out'.format(request.user.username)}
+    return Response(data=data, status=status.HTTP_200_OK)
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated, ])
 @authentication_classes([TokenAuthentication, ])
 def add_post_view(request):
-    authentication_classes(TokenAuthentication, )
-    user_data = jwt.decode(bytes(request.headers.get('token'), 'utf-8'), SECRET_KEY, ['HS256'])
-    user = User.objects.get(username=user_data['username'])
+    user = request.user
     try:
         serialized_post = PostSerializer(data=request.data, context={'request': request})
         if serialized_post.is_valid():
@@ -94,51 +154,117 @@ def add_post_view(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated, ])
 @authentication_classes([TokenAuthentication, ])
+@renderer_classes(FAST_RENDERER_CLASSES)
 def get_all_posts_view(request):
-    authentication_classes(TokenAuthentication, )
-    user_data = jwt.decode(bytes(request.headers.get('token'), 'utf-8'), SECRET_KEY, ['HS256'])
-    user = User.objects.get(username=user_data['username'])
-    paginator = CustomPagination()
-    posts = Post.objects.all()
+    # ?fields=title,like limits the response and the loaded columns
+    fields = requested_fields(request, POSTS_FIELDS) or POSTS_FIELDS
+    etag, last_modified = posts_validators(request)
+    not_modified = conditional_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    # ?order=hot ranks by the stored score, the default order is the newest first
+    ordering = HOT_ORDERING if request.query_params.get('order') == 'hot' else KeysetPagination.ordering
+    paginator = KeysetPagination(ordering) if cursor_pagination_requested(request) else CustomPagination()
+    # the page is fetched as values() rows of the serialized columns only (the content is never listed),
+    # and serialized by the precompiled row serializer with the same output as PostsOutputSerializer
+    serializer = row_serializer(PostsOutputSerializer, fields)
+    posts = Post.objects.order_by(*ordering).values(*model_columns(serializer.columns,
+                                                                   *(name.lstrip('-') for name in ordering)))
     result_page = paginator.paginate_queryset(posts, request)
-    serializer = PostsOutputSerializer(result_page, many=True, context={'request': request})
+    liked_ids = viewer_likes(request.user, result_page, 'like' in fields)
+    data = serializer.many(result_page, like=lambda row: 1 if row['id'] in liked_ids else 0)
+    return set_validators(paginator.get_paginated_response(data), etag, last_modified)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, ])
+@authentication_classes([TokenAuthentication, ])
+def search_posts_view(request):
+    query = request.query_params.get('q', '')
+    if not fts_query(query):
+        return Response(data={'Error': 'Search query is empty'}, status=status.HTTP_400_BAD_REQUEST)
+
+    paginator = CustomPagination()
+    result_page = paginator.paginate_queryset(search_posts(query), request)
+    liked_ids = Post.liked_ids(request.user, result_page)
+    serializer = PostsOutputSerializer(result_page, many=True, context={'request': request, 'liked_ids': liked_ids})
     return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated, ])
 @authentication_classes([TokenAuthentication, ])
+@renderer_classes(FAST_RENDERER_CLASSES)
 def get_post_view(request, pk):
-    authentication_classes(TokenAuthentication, )
-    user_data = jwt.decode(bytes(request.headers.get('token'), 'utf-8'), SECRET_KEY, ['HS256'])
-    user = User.objects.get(username=user_data['username'])
-    try:
-        if Post.objects.get(id=pk) is not None:
-            post = Post.objects.get(id=pk)
-            like_value = 1 if user in post.likes.all() else 0
-            serializer = PostOutputSerializer(post, many=False, context={'request': request})
-            data = serializer.data
-            data['like'] = like_value
-            status_code = status.HTTP_200_OK
+    fields = requested_fields(request, POST_FIELDS) or POST_FIELDS
+    etag, last_modified, change_seq = post_validators(request, pk)
+    not_modified = conditional_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
 
-        else:
-            data = {'Error': 'Post with id "{0}" does not exist'.format(pk)}
-            status_code = status.HTTP_400_BAD_REQUEST
+    try:
+        # the shared body is cached whole, so ?fields= only picks from it and skips the viewer's like check
+        body = get_post_data(pk, change_seq)
+        data = {name: body[name] for name in fields if name != 'like'}
+        buffer = get_buffer()
+        if buffer is not None and 'likes_count' in data:
+            data['likes_count'] += buffer.count_delta(pk)
+        if 'like' in fields:
+            like = buffer.pending_state(request.user.id, pk) if buffer is not None else None
+            data['like'] = 1 if (Post.is_liked(pk, request.user) if like is None else like) else 0
+        status_code = status.HTTP_200_OK
+    except Post.DoesNotExist:
+        data = {'Error': 'Post with id "{0}" does not exist'.format(pk)}
+        status_code = status.HTTP_400_BAD_REQUEST
     except Exception as e:
         data = {'Error': 'Bad request ' + str(e)}
         status_code = status.HTTP_400_BAD_REQUEST
 
-    return Response(data=data, status=status_code)
+    response = Response(data=data, status=status_code)
+    if status_code == status.HTTP_200_OK:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, ])
+@authentication_classes([TokenAuthentication, ])
+@renderer_classes(FAST_RENDERER_CLASSES)
+def get_posts_batch_view(request):
+    # ?ids=3,1,2 in the /post/POST_ID format and in the requested order, ?fields= as /post/POST_ID
+    fields = requested_fields(request, POST_FIELDS) or POST_FIELDS
+    try:
+        ids = [int(pk) for pk in request.query_params.get('ids', '').split(',') if pk.strip()]
+    except ValueError:
+        ids = None
+    if not ids or len(ids) > MAX_POSTS_BATCH:
+        return Response(data={'Error': 'Expected a comma separated list of at most {0} post ids'.format(
+            MAX_POSTS_BATCH)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # the shared bodies come from the post cache at once, the like flags by one query
+    bodies = get_posts_data(set(ids))
+    rows = {pk: dict(bodies[pk], id=pk) for pk in dict.fromkeys(ids) if pk in bodies}
+    liked_ids = viewer_likes(request.user, list(rows.values()), 'like' in fields)
+    results = []
+    for pk in ids:
+        row = rows.get(pk)
+        if row is None:
+            results.append({'id': pk, 'Error': 'Post with id "{0}" does not exist'.format(pk)})
+            continue
+        data = {'id': pk}
+        data.update((name, row[name]) for name in fields if name != 'like')
+        if 'like' in fields:
+            data['like'] = 1 if pk in liked_ids else 0
+        results.append(data)
+    return Response(data={'results': results}, status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated, ])
 @authentication_classes([TokenAuthentication, ])
 def set_mark_view(request):
-    authentication_classes(TokenAuthentication, )
-    user_data = jwt.decode(bytes(request.headers.get('token'), 'utf-8'), SECRET_KEY, ['HS256'])
-    user = User.objects.get(username=user_data['username'])
-
+    user = request.user
     try:
         serialized = MarkSerializer(data=request.data, context={'request': request})
         if serialized.is_valid():
@@ -150,13 +276,16 @@ def set_mark_view(request):
             unlike = int(mark_data['unlike'])
 
             post = Post.objects.get(id=post_id)
+            buffer = get_buffer()
 
-            if like > unlike:
-                post.likes.add(user)
+            if buffer is not None:
+                buffer.mark(user.id, post.id, like > unlike)
+
+            elif like > unlike:
+                post.add_like(user)
 
             else:
-                if user in post.likes.all():
-                    post.likes.remove(user)
+                post.remove_like(user)
 
             data = {"Result": "Mark was successfully changed"}
             status_code = status.HTTP_201_CREATED
@@ -167,3 +296,138 @@ def set_mark_view(request):
         data = {'Error': 'Bad request \n' + str(e)}
         status_code = status.HTTP_400_BAD_REQUEST
     return Response(data=data, status=status_code)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated, ])
+@authentication_classes([TokenAuthentication, ])
+def set_marks_batch_view(request):
+    try:
+        if not isinstance(request.data, list) or len(request.data) > MAX_MARKS_BATCH:
+            data = {'Error': 'Expected a list of at most {0} marks'.format(MAX_MARKS_BATCH)}
+            status_code = status.HTTP_400_BAD_REQUEST
+        else:
+            serialized = MarkSerializer(data=request.data, many=True, context={'request': request})
+            if serialized.is_valid():
+                marks = [(mark['post_id'], mark['like'] > mark['unlike']) for mark in serialized.validated_data]
+                buffer = get_buffer()
+                if buffer is not None:
+                    data = {'Result': buffer.apply_marks(request.user, marks)}
+                else:
+                    data = {'Result': Post.apply_marks(request.user, marks)}
+                status_code = status.HTTP_201_CREATED
+            else:
+                data = {'Error': [{key: str(value[0]) for key, value in errors.items()}
+                                  for errors in serialized.errors]}
+                status_code = status.HTTP_400_BAD_REQUEST
+    except Exception as e:
+        data = {'Error': 'Bad request \n' + str(e)}
+        status_code = status.HTTP_400_BAD_REQUEST
+    return Response(data=data, status=status_code)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, ])
+@authentication_classes([TokenAuthentication, ])
+@renderer_classes(FAST_RENDERER_CLASSES)
+def post_changes_view(request):
+    # ?since=<token> of the previous response, without it the sync starts from the beginning
+    try:
+        position = decode_token(request.query_params.get('since'))
+        limit = parse_limit(request.query_params.get('limit'))
+    except ValueError as e:
+        return Response(data={'Error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = row_serializer(PostChangeSerializer)
+    rows, token, more = changed_posts(position, serializer.columns, limit, using=router.db_for_read(Post))
+    # the pending marks of the like buffer are seen at once, the posts come again after their flush
+    liked_ids = viewer_likes(request.user, rows)
+    data = {
+        'changes': serializer.many(rows, like=lambda row: 1 if row['id'] in liked_ids else 0),
+        'token': token,
+        'more': more,
+    }
+    return Response(data=data, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, ])
+@authentication_classes([TokenAuthentication, ])
+@renderer_classes(FAST_RENDERER_CLASSES)
+def feed_view(request):
+    # the posts of the followed authors and of the user, newest first, by cursor pages
+    fields = requested_fields(request, POSTS_FIELDS) or POSTS_FIELDS
+    paginator = FeedPagination()
+    keys = paginator.paginate_sources(feed_sources(request.user), request)
+    serializer = row_serializer(PostsOutputSerializer, fields)
+    rows = {row['id']: row for row in Post.objects.filter(id__in=[key['id'] for key in keys])
+            .values(*model_columns(serializer.columns))}
+    # the posts deleted after the page was read are skipped
+    result_page = [rows[key['id']] for key in keys if key['id'] in rows]
+    liked_ids = viewer_likes(request.user, result_page, 'like' in fields)
+    data = serializer.many(result_page, like=lambda row: 1 if row['id'] in liked_ids else 0)
+    return paginator.get_paginated_response(data)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated, ])
+@authentication_classes([TokenAuthentication, ])
+def follow_view(request):
+    user = request.user
+    try:
+        serialized = FollowSerializer(data=request.data, context={'request': request})
+        if serialized.is_valid():
+            author = User.objects.get(id=serialized.validated_data['author_id'])
+            if author.id == user.id:
+                data = {'Error': 'Users can not follow themselves'}
+                status_code = status.HTTP_400_BAD_REQUEST
+            elif serialized.validated_data['follow']:
+                data = {'Result': 'Author was followed' if follow(user, author) else 'Author is already followed'}
+                status_code = status.HTTP_201_CREATED
+            else:
+                data = {'Result': 'Author was unfollowed' if unfollow(user, author) else 'Author is not followed'}
+                status_code = status.HTTP_201_CREATED
+        else:
+            data = {key: str(value[0]) for key, value in serialized.errors.items()}
+            status_code = status.HTTP_400_BAD_REQUEST
+    except User.DoesNotExist:
+        data = {'Error': 'User with id "{0}" does not exist'.format(serialized.validated_data['author_id'])}
+        status_code = status.HTTP_400_BAD_REQUEST
+    except Exception as e:
+        data = {'Error': 'Bad request \n' + str(e)}
+        status_code = status.HTTP_400_BAD_REQUEST
+    return Response(data=data, status=status_code)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, ])
+@authentication_classes([TokenAuthentication, ])
+def export_posts_view(request):
+    try:
+        since = request.query_params.get('since')
+        since = parse_since(since) if since else None
+    except ValueError as e:
+        return Response(data={'Error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # the stream is read after the view returns, so the connection is chosen now
+    lines = export_lines(since, likes=request.query_params.get('likes') != '0', using=router.db_for_read(Post))
+    response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename="posts.ndjson"'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny, ])
+@authentication_classes([])
+def metrics_view(request):
+    # internal endpoint: the histograms are shown only with the configured token, the client address
+    # can't be trusted behind a proxy
+    token = settings.INSTRUMENTATION['METRICS_TOKEN']
+    scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+    if token and scheme == 'Bearer' and hmac.compare_digest(given, token):
+        data = {'Endpoints': metrics.snapshot()}
+        status_code = status.HTTP_200_OK
+    else:
+        data = {'Error': 'Not found'}
+        status_code = status.HTTP_404_NOT_FOUND
+    return Response(data=data, status=status_code)